@@ -0,0 +1,161 @@
+"""
+Cached per-request user and event-membership context.
+
+Every page is behind `LoginRequiredMixin`, and with Django's defaults each
+view costs a session SELECT and a user SELECT before it starts, plus a join
+through `Event.invitees` to find the events the user may see.  These
+queries run against the same SQLite file as the comment writes.  Sessions,
+users and memberships change rarely, so they are read from the cache:
+
+* Sessions use the cached_db session engine with the `shared` cache alias
+  (see `CACHES` in `dart/settings.py`): file based by default, so every
+  worker on the host sees them, or Redis when `DART_REDIS_URL` is set.  The
+  database holds the sessions too, so an entry culled from the cache is
+  read back from there rather than logging the user out.
+* `CachedModelBackend` keeps the authenticated user's fields in the shared
+  cache for `DART_USER_CACHE_SECONDS`, without the password hash: only the
+  session hash derived from it is kept, which is all a request needs.
+  Saving or deleting a user, or changing their groups or permissions,
+  evicts the entry.
+* `invited_events` returns the ``{event_id: name}`` of the events a user is
+  invited to, cached in the shared cache and remembered on the request.
+  Each entry records the membership version it was read at; the version is
+  replaced whenever invitees change (`m2m_changed`) or an event is saved or
+  deleted, so a stale membership is never served.
+
+Read-mostly page views therefore reach the database only for the event
+data itself.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+CACHE_ALIAS = 'shared'
+VERSION_KEY = 'dart:membership-version'
+
+
+def _cache():
+    return caches[CACHE_ALIAS if CACHE_ALIAS in settings.CACHES else 'default']
+
+
+def _timeout() -> int:
+    return getattr(settings, 'DART_USER_CACHE_SECONDS', 300)
+
+
+def _user_key(user_id) -> str:
+    return f'dart:user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """`ModelBackend` that loads the user of each request from the shared cache."""
+
+    def get_user(self, user_id):
+        cache = _cache()
+        key = _user_key(user_id)
+        entry = cache.get(key)
+        # Entries written before the password was left out were whole users.
+        if isinstance(entry, dict):
+            return _restore_user(entry)
+        user = super().get_user(user_id)
+        if user is not None:
+            cache.set(key, _cache_entry(user), _timeout())
+        return user
+
+
+def _cache_entry(user) -> dict:
+    """The user's fields except the password hash, and the session hash derived from it."""
+    return {
+        'fields': {f.attname: getattr(user, f.attname) for f in user._meta.concrete_fields if f.attname != 'password'},
+        'session_auth_hash': user.get_session_auth_hash(),
+    }
+
+
+def _restore_user(entry: dict):
+    fields = entry['fields']
+    # The password stays deferred: it is loaded from the database only if
+    # something asks for it, and saving the user leaves it alone.
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+    session_auth_hash = entry['session_auth_hash']
+    user.get_session_auth_hash = lambda: session_auth_hash
+    return user
+
+
+def forget_user(user_id) -> None:
+    _cache().delete(_user_key(user_id))
+
+
+def _membership_version() -> str:
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # A random version cannot collide with entries written before eviction.
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_membership() -> None:
+    """Invalidate every cached membership."""
+    _cache().set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def invited_events(request) -> dict[int, str]:
+    """The ``{event_id: name}`` of the events the request's user is invited to."""
+    cached = getattr(request, '_dart_invited_events', None)
+    if cached is not None:
+        return cached
+    user = request.user
+    if not user.is_authenticated:
+        return {}
+    cache = _cache()
+    key = f'dart:membership:{user.pk}'
+    version = _membership_version()
+    entry = cache.get(key)
+    if entry is not None and entry[0] == version:
+        events = entry[1]
+    else:
+        events = dict(user.invited_events.values_list('id', 'name'))
+        cache.set(key, (version, events), _timeout())
+    request._dart_invited_events = events
+    return events
+
+
+def is_invited(request, event_id: int) -> bool:
+    return int(event_id) in invited_events(request)
+
+
+# -- signal receivers (connected in `BaseConfig.ready`) -------------------------
+
+def user_changed(sender, instance, **kwargs) -> None:
+    """`post_save`/`post_delete` receiver for `User`."""
+    forget_user(instance.pk)
+
+
+def user_relations_changed(sender, instance, action, reverse, pk_set, **kwargs) -> None:
+    """`m2m_changed` receiver for a user's groups and permissions."""
+    if not reverse:
+        if action.startswith('post_'):
+            forget_user(instance.pk)
+    elif action == 'pre_clear':
+        # `instance` is a group or permission; its users are only known before the clear.
+        for user_id in instance.user_set.values_list('pk', flat=True):
+            forget_user(user_id)
+    elif action in ('post_add', 'post_remove'):
+        for user_id in pk_set or ():
+            forget_user(user_id)
+
+
+def invitees_changed(sender, action, **kwargs) -> None:
+    """`m2m_changed` receiver for `Event.invitees`."""
+    if action.startswith('post_'):
+        bump_membership()
+
+
+def event_changed(sender, **kwargs) -> None:
+    """`post_save`/`post_delete` receiver for `Event`: names and memberships may have changed."""
+    bump_membership()
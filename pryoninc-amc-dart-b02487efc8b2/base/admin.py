@@ -1,7 +1,273 @@
-from django.contrib import admin
-from .models import Event, Comment, Chat
+"""
+Admin for large Comment and Chat tables.
 
-# Register your models here.
-admin.site.register(Event)
-admin.site.register(Comment)
-admin.site.register(Chat)
+The default `ModelAdmin` counts every row twice per change list page
+(``COUNT(*)`` with and without filters), pages with ``OFFSET`` (which reads
+and discards every earlier row), calls `Comment.__str__` for each row (two
+further queries per row) and loads whole chat histories.  Past a few
+hundred thousand comments the change lists stop loading.  `ScalableAdmin`
+therefore:
+
+* counts with `EstimatedCountPaginator`: the planner's row estimate for
+  unfiltered lists (PostgreSQL statistics, or `sqlite_stat1` after
+  ``ANALYZE``), otherwise an exact count cached for
+  `DART_ADMIN_COUNT_CACHE_SECONDS`; the unfiltered total is not shown;
+* pages by key (`KeysetChangeList`): in the default newest-first order a
+  page is ``WHERE id < <last id of the previous page> LIMIT n``, which costs
+  the same on the last page as on the first.  Sorting by a column falls back
+  to numbered pages;
+* selects the related users and events in the same query and defers the
+  large text and JSON fields on the change lists.
+
+Comment search uses the event's search index when the list is filtered by
+event, and otherwise looks up comment ids and exact usernames, so it never
+scans the comment texts with ``LIKE``.  Re-indexing, recomputing sentiment
+and archiving run as background jobs (see `base.jobs`).
+"""
+
+import hashlib
+
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.functions import Substr
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from . import jobs
+from .models import Event, Comment, CommentUpload, Chat, PrecomputedAnswer
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+def _planner_estimate(queryset) -> int | None:
+    """The database's estimate of the number of rows in the queryset's table, if it keeps one."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """A paginator that estimates or caches its count instead of running ``COUNT(*)`` on every page."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = _planner_estimate(queryset)
+            if estimate is not None:
+                return estimate
+        sql, params = queryset.order_by().query.sql_with_params()
+        key = 'dart:admin-count:' + hashlib.sha256(f'{sql}{params}'.encode('utf-8')).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, getattr(settings, 'DART_ADMIN_COUNT_CACHE_SECONDS', 300))
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    """A change list paged by primary key while it is in its default newest-first order."""
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = self._cursor(request, AFTER_VAR)
+        self.before = self._cursor(request, BEFORE_VAR)
+        self.keyset = ORDER_VAR not in request.GET
+        self.next_url = self.previous_url = None
+        super().__init__(request, *args, **kwargs)
+
+    @staticmethod
+    def _cursor(request, name):
+        value = request.GET.get(name, '')
+        return int(value) if value.isdigit() else None
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(AFTER_VAR, None)
+        params.pop(BEFORE_VAR, None)
+        return params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Changing filters or ordering starts again from the first page.
+        new_params = dict(new_params or {})
+        if AFTER_VAR not in new_params and BEFORE_VAR not in new_params:
+            remove = [*(remove or []), AFTER_VAR, BEFORE_VAR]
+        return super().get_query_string(new_params, remove)
+
+    def get_results(self, request):
+        if not self.keyset:
+            return super().get_results(request)
+        per_page = self.list_per_page
+        queryset = self.queryset
+        if self.before is not None:
+            rows = list(queryset.filter(pk__gt=self.before).order_by('pk')[:per_page + 1])
+            has_newer, rows = len(rows) > per_page, rows[:per_page][::-1]
+            has_older = True
+        else:
+            if self.after is not None:
+                queryset = queryset.filter(pk__lt=self.after)
+            rows = list(queryset.order_by('-pk')[:per_page + 1])
+            has_older, rows = len(rows) > per_page, rows[:per_page]
+            has_newer = self.after is not None
+        if rows and has_older:
+            self.next_url = self.get_query_string({AFTER_VAR: rows[-1].pk}, [BEFORE_VAR])
+        if rows and has_newer:
+            self.previous_url = self.get_query_string({BEFORE_VAR: rows[0].pk}, [AFTER_VAR])
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, per_page)
+        self.result_count = self.paginator.count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = has_older or has_newer
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ('-pk',)
+    list_per_page = 50
+    change_list_template = 'admin/base/scalable_change_list.html'
+    # Fields deferred on the change list only.
+    changelist_defer = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        match = request.resolver_match
+        if self.changelist_defer and match is not None and match.url_name.endswith('_changelist'):
+            queryset = queryset.defer(*self.changelist_defer)
+        return queryset
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {**(extra_context or {}), 'dart_jobs': jobs.recent()}
+        return super().changelist_view(request, extra_context)
+
+    def _submit(self, request, name, func, event_ids):
+        event_ids = sorted(set(event_ids))
+        if not event_ids:
+            self.message_user(request, "No events selected.", messages.WARNING)
+            return
+        job = jobs.submit(f"{name} ({len(event_ids)} events)", request.user, func, event_ids)
+        self.message_user(request, f"Started job {job.id}: {job.name} on worker {job.worker}. "
+                                   "Its progress is shown above the list.")
+
+
+def _event_ids(queryset) -> list[int]:
+    if queryset.model is Event:
+        return list(queryset.values_list('pk', flat=True))
+    return list(queryset.order_by().values_list('event_id', flat=True).distinct())
+
+
+@admin.action(description="Rebuild the search index of the selected events (in the background)")
+def reindex(modeladmin, request, queryset):
+    modeladmin._submit(request, "Re-index", jobs.reindex_events, _event_ids(queryset))
+
+
+@admin.action(description="Recompute sentiment and sentiment summaries (in the background)")
+def recompute_sentiment(modeladmin, request, queryset):
+    modeladmin._submit(request, "Recompute sentiment", jobs.recompute_sentiment, _event_ids(queryset))
+
+
+@admin.action(description="Archive the selected events (in the background)")
+def archive(modeladmin, request, queryset):
+    modeladmin._submit(request, "Archive", jobs.archive_events, _event_ids(queryset))
+
+
+@admin.register(Event)
+class EventAdmin(ScalableAdmin):
+    list_display = ('name', 'user', 'start_date', 'end_date', 'archived_at', 'comments_version', 'updated_at')
+    list_filter = (('archived_at', admin.EmptyFieldListFilter), 'end_date')
+    list_select_related = ('user',)
+    search_fields = ('name',)
+    changelist_defer = ('summary',)
+    filter_horizontal = ('invitees',)
+    raw_id_fields = ('user',)
+    actions = (reindex, recompute_sentiment, archive)
+
+
+@admin.register(Comment)
+class CommentAdmin(ScalableAdmin):
+    list_display = ('id', 'event', 'user', 'excerpt', 'created_at')
+    list_filter = ('event',)
+    list_select_related = ('user', 'event')
+    # Only `get_search_results` below is used; the field enables the search box.
+    search_fields = ('=id',)
+    search_help_text = ("Filter by event to search the comments' text; otherwise search by "
+                        "comment id or exact username.")
+    raw_id_fields = ('user', 'event')
+    actions = (reindex, recompute_sentiment, archive)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        match = request.resolver_match
+        if match is not None and match.url_name.endswith('_changelist'):
+            queryset = queryset.annotate(observation_excerpt=Substr('observation', 1, 100)).defer(
+                'observation', 'discussion', 'recommendation', 'fingerprint',
+                'user__password', 'event__summary',
+            )
+        return queryset
+
+    @admin.display(description='Observation')
+    def excerpt(self, comment):
+        return getattr(comment, 'observation_excerpt', None) or comment.observation[:100]
+
+    def get_search_results(self, request, queryset, search_term):
+        from . import search
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        event_id = request.GET.get('event__id__exact', '')
+        if event_id.isdigit():
+            index = search.get_indexes([int(event_id)])[int(event_id)]
+            limit = getattr(settings, 'DART_ADMIN_SEARCH_LIMIT', 500)
+            comment_ids = [index.comment_ids[doc_idx] for _, doc_idx in index.search(term, limit)]
+            return queryset.filter(pk__in=comment_ids), False
+        return queryset.filter(user__username=term), False
+
+
+@admin.register(Chat)
+class ChatAdmin(ScalableAdmin):
+    list_display = ('id', 'event', 'user', 'summarize', 'updated_at')
+    list_filter = ('event',)
+    list_select_related = ('user', 'event')
+    changelist_defer = ('query_dict', 'user__password', 'event__summary')
+    raw_id_fields = ('user', 'event')
+
+
+@admin.register(CommentUpload)
+class CommentUploadAdmin(ScalableAdmin):
+    list_display = ('name', 'event', 'user', 'status', 'rows_committed', 'rows_total', 'created_at')
+    list_filter = ('status', 'event')
+    list_select_related = ('user', 'event')
+    changelist_defer = ('user__password', 'event__summary')
+    raw_id_fields = ('user', 'event')
+
+
+@admin.register(PrecomputedAnswer)
+class PrecomputedAnswerAdmin(ScalableAdmin):
+    list_display = ('event', 'kind', 'key', 'model_name', 'comment_count', 'computed_at')
+    list_filter = ('kind', 'event')
+    list_select_related = ('event',)
+    changelist_defer = ('text', 'text_html', 'sources', 'event__summary')
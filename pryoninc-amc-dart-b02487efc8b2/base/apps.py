@@ -4,3 +4,22 @@ from django.apps import AppConfig
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        from django.contrib.auth.models import User
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import m2m_changed, post_delete, post_save
+        from . import access
+        from .db import configure_connection
+        from .models import Event
+        connection_created.connect(configure_connection, dispatch_uid='dart-configure-connection')
+        # Keep the cached users and event memberships (see base/access.py) current.
+        post_save.connect(access.user_changed, sender=User, dispatch_uid='dart-user-saved')
+        post_delete.connect(access.user_changed, sender=User, dispatch_uid='dart-user-deleted')
+        post_save.connect(access.event_changed, sender=Event, dispatch_uid='dart-event-saved')
+        post_delete.connect(access.event_changed, sender=Event, dispatch_uid='dart-event-deleted')
+        m2m_changed.connect(access.user_relations_changed, sender=User.groups.through,
+                            dispatch_uid='dart-user-groups')
+        m2m_changed.connect(access.user_relations_changed, sender=User.user_permissions.through,
+                            dispatch_uid='dart-user-permissions')
+        m2m_changed.connect(access.invitees_changed, sender=Event.invitees.through, dispatch_uid='dart-invitees')
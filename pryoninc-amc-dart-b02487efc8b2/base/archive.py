@@ -0,0 +1,393 @@
+"""
+Cold storage for finished events.
+
+Once an event is over its comments and chat history are only ever read, yet
+they stay in the hot `base_comment` and `base_chat` tables, which makes the
+database, every query on those tables and every backup larger.
+`archive_event` moves them into one compressed file per event under
+`DART_ARCHIVE_DIR` and deletes the rows; the `Event` row itself (with its
+summary and invitees) stays, marked by `archived_at`.
+
+File layout::
+
+    b'DARTARC1'
+    u32 header length, header (JSON, uncompressed)
+    compressed sections, back to back
+
+The header describes the event and lists each section's name, offset and
+length.  Comments are stored column by column (one section per field), each
+column a sequence of length-prefixed UTF-8 values, so similar values sit next
+to each other and compress well.  The precomputed search index (sentiments,
+IDF weights and postings) and the chat rows are stored too, so an archived
+event is searchable without rebuilding anything.
+
+Sections are compressed with zstd when the optional `zstandard` package is
+installed, otherwise with the standard library's `lzma`; the codec is
+recorded in the header.  Archived events stay searchable, read only, through
+`base.search` (which the chat view, cross-event search and batch reports all
+use), and `rehydrate_event` restores the rows, with their original ids and
+timestamps, before anyone adds comments to the event.
+"""
+
+import json
+import logging
+import lzma
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+MAGIC = b'DARTARC1'
+FORMAT_VERSION = 1
+COMMENT_COLUMNS = ('observation', 'discussion', 'recommendation', 'fingerprint', 'created_at', 'updated_at')
+_NULL = 0xFFFFFFFF
+_LENGTH = struct.Struct('<I')
+
+
+class ArchiveError(Exception):
+    """Raised when an archive cannot be written or read."""
+
+
+# -- encoding ------------------------------------------------------------
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=getattr(settings, 'DART_ARCHIVE_LEVEL', 10)).compress(data)
+    return lzma.compress(data)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ArchiveError("This archive is zstd compressed; install the zstandard package to read it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'lzma':
+        return lzma.decompress(data)
+    raise ArchiveError(f"Unknown archive codec {codec!r}.")
+
+
+def _pack_strings(values) -> bytes:
+    parts = []
+    for value in values:
+        if value is None:
+            parts.append(_LENGTH.pack(_NULL))
+        else:
+            encoded = value.encode('utf-8')
+            parts.append(_LENGTH.pack(len(encoded)))
+            parts.append(encoded)
+    return b''.join(parts)
+
+
+def _unpack_strings(data: bytes) -> list:
+    values, offset, view = [], 0, memoryview(data)
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += 4
+        if length == _NULL:
+            values.append(None)
+        else:
+            values.append(str(view[offset:offset + length], 'utf-8'))
+            offset += length
+    return values
+
+
+def _pack_ints(values) -> bytes:
+    return array('q', values).tobytes()
+
+
+def _unpack_ints(data: bytes) -> list[int]:
+    values = array('q')
+    values.frombytes(data)
+    return values.tolist()
+
+
+def archive_path(event_id: int) -> str:
+    directory = getattr(settings, 'DART_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive'))
+    return os.path.join(directory, f'event-{event_id}.dart')
+
+
+def _write(path: str, header: dict, sections: dict[str, bytes]) -> int:
+    codec = 'zstd' if zstandard is not None else 'lzma'
+    header = dict(header, codec=codec, format=FORMAT_VERSION, sections=[])
+    blobs, offset = [], 0
+    for name, raw in sections.items():
+        blob = _compress(raw, codec)
+        header['sections'].append({'name': name, 'offset': offset, 'length': len(blob), 'raw_length': len(raw)})
+        blobs.append(blob)
+        offset += len(blob)
+    encoded_header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(MAGIC)
+        handle.write(_LENGTH.pack(len(encoded_header)))
+        handle.write(encoded_header)
+        for blob in blobs:
+            handle.write(blob)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+
+class ArchivedEvent:
+    """A decoded archive file.  Sections are decompressed on first use."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ArchiveError(f"{path} is not a DART archive.")
+        (header_length,) = _LENGTH.unpack_from(data, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(data[start:start + header_length])
+        self._body = data[start + header_length:]
+        self._sections = {s['name']: s for s in self.header['sections']}
+        self._decoded: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _raw(self, name: str) -> bytes:
+        section = self._sections[name]
+        blob = self._body[section['offset']:section['offset'] + section['length']]
+        return _decompress(blob, self.header['codec'])
+
+    def _section(self, name: str, decode):
+        with self._lock:
+            if name not in self._decoded:
+                self._decoded[name] = decode(self._raw(name))
+            return self._decoded[name]
+
+    @property
+    def version(self) -> tuple:
+        return ('archived', self.header['archived_at'])
+
+    def column(self, name: str) -> list:
+        if name in ('id', 'user_id'):
+            return self._section(f'comments.{name}', _unpack_ints)
+        return self._section(f'comments.{name}', _unpack_strings)
+
+    def rows(self) -> list[tuple[int, str]]:
+        """``(comment_id, document)`` pairs, as `base.search.load_event_rows` returns them."""
+        return list(zip(self.column('id'), self._section('documents', _unpack_strings)))
+
+    def index_parts(self) -> dict:
+        return self._section('index', json.loads)
+
+    def chats(self) -> list[dict]:
+        return self._section('chats', json.loads)
+
+
+_open_archives: OrderedDict[tuple, ArchivedEvent] = OrderedDict()
+_open_lock = threading.Lock()
+
+
+def open_archive(event_id: int) -> ArchivedEvent:
+    """Return the decoded archive of an event, cached by path and mtime."""
+    path = archive_path(event_id)
+    try:
+        key = (path, os.stat(path).st_mtime_ns)
+    except FileNotFoundError:
+        raise ArchiveError(f"No archive found for event {event_id} at {path}.")
+    with _open_lock:
+        archived = _open_archives.get(key)
+        if archived is not None:
+            _open_archives.move_to_end(key)
+            return archived
+    archived = ArchivedEvent(path)
+    with _open_lock:
+        _open_archives[key] = archived
+        while len(_open_archives) > getattr(settings, 'DART_ARCHIVE_CACHE_SIZE', 8):
+            _open_archives.popitem(last=False)
+    return archived
+
+
+# -- archiving -----------------------------------------------------------
+
+def eligible_events(grace_days: int | None = None):
+    """Events that ended more than the grace period ago and are still hot."""
+    from .models import Event
+    if grace_days is None:
+        grace_days = getattr(settings, 'DART_ARCHIVE_GRACE_DAYS', 30)
+    cutoff = date.today() - timedelta(days=grace_days)
+    return Event.objects.filter(end_date__lt=cutoff, archived_at__isnull=True)
+
+
+def _comment_stamps(event, lock: bool = False) -> tuple:
+    from .models import Event
+    events = Event.objects.select_for_update() if lock else Event.objects
+    return events.filter(pk=event.pk).values_list('comments_version', 'comments_rewrites').get()
+
+
+def _chat_stamps(event) -> set[tuple[int, str]]:
+    from .models import Chat
+    return {
+        (chat_id, updated_at.isoformat())
+        for chat_id, updated_at in Chat.objects.filter(event=event).values_list('id', 'updated_at')
+    }
+
+
+def _delete_ids(queryset, ids, batch_size: int = 500) -> None:
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        queryset.filter(id__in=ids[start:start + batch_size]).delete()
+
+
+def archive_event(event) -> dict:
+    """
+    Write `event`'s comments, chats and search index to its archive file,
+    verify the file, then delete the rows and mark the event archived.
+    Returns a dictionary describing the archive.
+    """
+    from . import segments
+    from .db import use_primary
+    from .models import Chat, Comment, batched_comment_versions
+    from .search import EventIndex, join_comment_text
+
+    if event.archived_at is not None:
+        raise ArchiveError(f"Event {event.id} is already archived.")
+    archived_at = timezone.now()
+    # The snapshot is compared with the primary before deleting, so read it there.
+    with use_primary():
+        # Read before the snapshot: any comment written after this moves them.
+        stamps = _comment_stamps(event)
+        comments = list(
+            Comment.objects.filter(event=event).order_by('id')
+            .values_list('id', 'user_id', *COMMENT_COLUMNS)
+        )
+        chats = [
+            {
+                'id': chat.id, 'user_id': chat.user_id, 'query_dict': chat.query_dict, 'summarize': chat.summarize,
+                'created_at': chat.created_at.isoformat(), 'updated_at': chat.updated_at.isoformat(),
+            }
+            for chat in Chat.objects.filter(event=event).order_by('id')
+        ]
+    documents = [join_comment_text(o, d, r) for _, _, o, d, r, *_ in comments]
+    version = ('archived', archived_at.isoformat())
+    index = EventIndex(event.id, version, list(zip([c[0] for c in comments], documents)))
+
+    columns = list(zip(*comments)) or [()] * (2 + len(COMMENT_COLUMNS))
+    sections = {
+        'comments.id': _pack_ints(columns[0]),
+        'comments.user_id': _pack_ints(columns[1]),
+    }
+    for name, values in zip(COMMENT_COLUMNS, columns[2:]):
+        if name in ('created_at', 'updated_at'):
+            values = [value.isoformat() for value in values]
+        sections[f'comments.{name}'] = _pack_strings(values)
+    sections['documents'] = _pack_strings(documents)
+    sections['index'] = json.dumps(
+        {'sentiments': index.sentiments, 'idf': index.idf, 'postings': index.postings},
+        separators=(',', ':'),
+    ).encode('utf-8')
+    sections['chats'] = json.dumps(chats, separators=(',', ':')).encode('utf-8')
+
+    header = {
+        'event_id': event.id,
+        'name': event.name,
+        'start_date': event.start_date.isoformat(),
+        'end_date': event.end_date.isoformat(),
+        'summary': event.summary,
+        'comment_count': len(comments),
+        'chat_count': len(chats),
+        'archived_at': archived_at.isoformat(),
+    }
+    path = archive_path(event.id)
+    size = _write(path, header, sections)
+
+    # Check the file reads back before deleting anything.
+    check = ArchivedEvent(path)
+    if len(check.column('id')) != len(comments) or len(check.chats()) != len(chats):
+        os.remove(path)
+        raise ArchiveError(f"Archive of event {event.id} failed verification.")
+
+    try:
+        with transaction.atomic(), batched_comment_versions():
+            # Only delete what the file holds, and only if nothing was written
+            # to the event since the snapshot; otherwise it would be lost.
+            if (_comment_stamps(event, lock=True) != stamps
+                    or _chat_stamps(event) != {(chat['id'], chat['updated_at']) for chat in chats}):
+                raise ArchiveError(f"Event {event.id} changed while it was being archived; try again.")
+            _delete_ids(Comment.objects.filter(event=event), columns[0])
+            _delete_ids(Chat.objects.filter(event=event), [chat['id'] for chat in chats])
+            event.archived_at = archived_at
+            event.save(update_fields=['archived_at'])
+    except Exception:
+        os.remove(path)
+        raise
+    # The archive carries the index from now on.
+    segments.remove_event(event.id)
+    raw_size = sum(len(raw) for raw in sections.values())
+    logger.info(
+        f"Archived event {event.id}: {len(comments)} comments and {len(chats)} chats, "
+        f"{raw_size} bytes compressed to {size} ({check.header['codec']})."
+    )
+    return {'path': path, 'comments': len(comments), 'chats': len(chats), 'raw_bytes': raw_size, 'bytes': size}
+
+
+def rehydrate_event(event) -> int:
+    """
+    Restore an archived event's comments and chats into the database with
+    their original ids and timestamps, and remove the archive file.  Returns
+    the number of comments restored.
+    """
+    from .models import Chat, Comment, Event
+
+    if event.archived_at is None:
+        return 0
+    with transaction.atomic():
+        # Lock the event so two concurrent edits do not both restore it.
+        if Event.objects.select_for_update().get(pk=event.pk).archived_at is None:
+            event.archived_at = None
+            return 0
+        archived = ArchivedEvent(archive_path(event.id))
+        ids, user_ids = archived.column('id'), archived.column('user_id')
+        values = {name: archived.column(name) for name in COMMENT_COLUMNS}
+        comments = [
+            Comment(
+                id=comment_id, user_id=user_ids[i], event=event,
+                observation=values['observation'][i], discussion=values['discussion'][i],
+                recommendation=values['recommendation'][i], fingerprint=values['fingerprint'][i],
+            )
+            for i, comment_id in enumerate(ids)
+        ]
+        Comment.objects.bulk_create(comments, batch_size=getattr(settings, 'DART_INGEST_BATCH_SIZE', 2000))
+        chats = [
+            Chat(id=row['id'], user_id=row['user_id'], event=event,
+                 query_dict=row['query_dict'], summarize=row['summarize'])
+            for row in archived.chats()
+        ]
+        Chat.objects.bulk_create(chats)
+        # bulk_create stamps auto_now fields with the current time, so put
+        # the original timestamps back.
+        for i, comment in enumerate(comments):
+            comment.created_at = parse_datetime(values['created_at'][i])
+            comment.updated_at = parse_datetime(values['updated_at'][i])
+        Comment.objects.bulk_update(comments, ['created_at', 'updated_at'], batch_size=500)
+        for chat, row in zip(chats, archived.chats()):
+            chat.created_at = parse_datetime(row['created_at'])
+            chat.updated_at = parse_datetime(row['updated_at'])
+        Chat.objects.bulk_update(chats, ['created_at', 'updated_at'])
+        # bulk_create sends no signals.  The restored ids predate any corpus
+        # cached before archiving, so force the search caches to reload.
+        Event.bump_comments_version(event.id, rewrite=True)
+        event.archived_at = None
+        event.save(update_fields=['archived_at'])
+    os.remove(archived.path)
+    logger.info(f"Rehydrated event {event.id}: {len(comments)} comments and {len(chats)} chats restored.")
+    return len(comments)
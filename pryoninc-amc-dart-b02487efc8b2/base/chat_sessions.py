@@ -0,0 +1,165 @@
+"""
+Multi-turn chat sessions.
+
+Without a session every chat question builds a prompt from scratch, so a
+follow-up makes the model re-read all the retrieved comments it has just
+seen, and the model may have been unloaded between questions.  This module
+keeps a conversation per chat:
+
+* Ollama returns the token `context` of each generation.  It is kept in the
+  Django cache (for `DART_CHAT_SESSION_TIMEOUT` seconds) together with the
+  digests of the comments already sent.  A follow-up passes the context back
+  and only includes comments the model has not seen yet, so prompt
+  evaluation covers just the new text.
+* When the context grows beyond `DART_CHAT_MAX_CONTEXT_TOKENS`, or the user
+  switches model or clears the chat, the next question starts a new
+  conversation.
+* Chat generations pass `DART_LLM_KEEP_ALIVE` so the model stays loaded while
+  the event is being discussed, and `preload_async` loads the chat's model in
+  the background when the chat page is opened.  With "Auto" selected the
+  preloaded model is pinned to the chat, so its first question goes to the
+  model that was just loaded rather than being routed afresh.
+
+The default cache is per process, so with several workers a follow-up that
+lands on another worker simply starts a new conversation; configure a shared
+cache to avoid that.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .model_router import AUTO, CHAT
+from .ollama_client import OllamaClient
+
+logger = logging.getLogger(__name__)
+
+_preload_executor: ThreadPoolExecutor | None = None
+_preload_executor_pid: int | None = None
+_preloaded: dict[str, float] = {}
+_preloaded_lock = threading.Lock()
+
+
+def _get_preload_executor() -> ThreadPoolExecutor:
+    global _preload_executor, _preload_executor_pid
+    with _preloaded_lock:
+        # One pool per process: threads do not survive a fork.
+        if _preload_executor is None or _preload_executor_pid != os.getpid():
+            _preload_executor_pid = os.getpid()
+            _preload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dart-preload')
+        return _preload_executor
+
+
+def _keep_alive():
+    return getattr(settings, 'DART_LLM_KEEP_ALIVE', '30m')
+
+
+def _session_key(chat) -> str:
+    return f'dart:chat-session:{chat.pk}'
+
+
+def _pin_key(chat) -> str:
+    return f'dart:chat-preloaded:{chat.pk}'
+
+
+def _digest(document: str) -> str:
+    return hashlib.sha256(document.encode('utf-8')).hexdigest()[:16]
+
+
+def first_prompt(query: str, documents: list[str]) -> str:
+    context = ' '.join(documents)
+    return (
+        "Based on the following context, answer the user's question.\n\n"
+        f"Context:\n{context}\n\nQuestion: {query}\n\nAnswer:"
+    )
+
+
+def followup_prompt(query: str, documents: list[str]) -> str:
+    if not documents:
+        return f"Using the context above, answer this follow-up question.\n\nQuestion: {query}\n\nAnswer:"
+    context = ' '.join(documents)
+    return (
+        "Additional context for the next question:\n"
+        f"{context}\n\nUsing all of the context so far, answer this follow-up question.\n\n"
+        f"Question: {query}\n\nAnswer:"
+    )
+
+
+def reset(chat) -> None:
+    """Forget the conversation of `chat`, so the next question starts afresh."""
+    if chat.pk is not None:
+        cache.delete_many([_session_key(chat), _pin_key(chat)])
+
+
+def answer(chat, query: str, documents: list[str], model_name: str) -> str:
+    """
+    Answer `query` from the retrieved `documents` as the next turn of the
+    chat's conversation.  Falls back to an extractive summary of the
+    documents when no model can be used, like `Event._answer_question`.
+    Unsaved chats (archived events) get single-turn answers.
+    """
+    session = cache.get(_session_key(chat)) if chat.pk is not None else None
+    client = OllamaClient()
+    # Stay on the conversation's model, or the one preloaded for it: reusing
+    # its context (or its loaded weights) is worth more than switching to
+    # whichever model is fastest right now.
+    pinned = session['model'] if session else (cache.get(_pin_key(chat)) if chat.pk is not None else None)
+    if model_name == AUTO and pinned in client.models:
+        model_name = pinned
+    else:
+        model_name = client.resolve_model(model_name, CHAT) if client.models else model_name
+    max_tokens = getattr(settings, 'DART_CHAT_MAX_CONTEXT_TOKENS', 8192)
+    if (not session or session['model'] != model_name
+            or len(session['context']) > max_tokens):
+        session = None
+
+    if session:
+        sent = set(session['sent'])
+        new_documents = [doc for doc in documents if _digest(doc) not in sent]
+        prompt = followup_prompt(query, new_documents)
+        context = session['context']
+    else:
+        new_documents = documents
+        prompt = first_prompt(query, documents)
+        context = None
+
+    text, new_context = client.converse(
+        model_name, prompt, context=context, keep_alive=_keep_alive(), task=CHAT
+    )
+    if OllamaClient.is_fallback(text):
+        return chat.event._simple_summarise(' '.join(documents))
+    if new_context and chat.pk is not None:
+        cache.set(_session_key(chat), {
+            'model': model_name,
+            'context': list(new_context),
+            'sent': (session['sent'] if session else []) + [_digest(doc) for doc in new_documents],
+            'turns': (session['turns'] if session else 0) + 1,
+        }, getattr(settings, 'DART_CHAT_SESSION_TIMEOUT', 1800))
+    return text
+
+
+def preload_async(client: OllamaClient, model_name: str, chat=None) -> None:
+    """
+    Load `model_name` in the background with the chat keep-alive, at most
+    once every `DART_LLM_PRELOAD_INTERVAL` seconds per model and process.
+    "Auto" is resolved without registering a routing trial, and the model
+    is pinned to `chat` until its conversation starts.
+    """
+    if not model_name or not client.client or not client.models:
+        return
+    requested, model_name = model_name, client.resolve_model(model_name, CHAT, record_trial=False)
+    if requested == AUTO and chat is not None and chat.pk is not None and not cache.get(_session_key(chat)):
+        cache.set(_pin_key(chat), model_name, getattr(settings, 'DART_CHAT_SESSION_TIMEOUT', 1800))
+    interval = getattr(settings, 'DART_LLM_PRELOAD_INTERVAL', 60)
+    now = time.monotonic()
+    with _preloaded_lock:
+        if now - _preloaded.get(model_name, float('-inf')) < interval:
+            return
+        _preloaded[model_name] = now
+    _get_preload_executor().submit(client.preload, model_name, _keep_alive())
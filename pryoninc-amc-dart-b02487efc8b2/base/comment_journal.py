@@ -0,0 +1,359 @@
+"""
+Write-behind group commit for live comment submission.
+
+During a live exercise many invitees submit comments at the same moment.
+Each submission used to be its own write transaction, and SQLite has a
+single database-wide write lock, so submissions queued on it and some
+failed with "database is locked".  With the journal a submission does not
+touch the database at all:
+
+* The comment is appended to this process's journal file in
+  `DART_COMMENT_JOURNAL_DIR` (one JSON line, fsynced), which makes it
+  durable, and handed to a committer thread.
+* The committer collects the submissions that arrive within
+  `DART_COMMENT_GROUP_WAIT_MS` (up to `DART_COMMENT_GROUP_SIZE`) and
+  inserts them with one `bulk_create` in one transaction, so the write lock
+  is taken once per group rather than once per comment.  Lock timeouts are
+  retried with backoff, and a group that still fails stays unacknowledged
+  and is retried; only records the database rejects (say, because their
+  event was deleted) are dropped.
+* Work that follows a commit, such as bumping the events' comment versions
+  and refreshing their search indexes (which classifies the sentiment of
+  the new comments), is done once per group and event.
+* The submitting request waits up to `DART_COMMENT_COMMIT_WAIT` seconds for
+  its group to commit, so the author sees the comment straight away; if the
+  database is slower than that the comment is still safe in the journal.
+
+Each journalled comment carries a fingerprint derived from its journal
+record, and the unique (event, fingerprint) constraint makes inserts
+idempotent.  A checkpoint file records how much of the journal has been
+committed, and the journal is truncated whenever everything has been.  A
+process that finds the journal of a process that is no longer running
+(after a crash or restart) replays it from its checkpoint.  Set
+`DART_COMMENT_JOURNAL_DIR` to None to write comments synchronously instead.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_FINGERPRINT_PREFIX = 'journal:'
+_ORPHAN_SCAN_INTERVAL = 60.0
+_RETRY_DELAY_MAX = 30.0
+_JOURNAL_RE = re.compile(r'^(?P<journal>comments-(?P<pid>\d+)\.journal)(?:\.replay-(?P<replayer>\d+))?$')
+
+
+def journal_dir() -> str | None:
+    directory = getattr(settings, 'DART_COMMENT_JOURNAL_DIR', os.path.join(settings.BASE_DIR, 'journal'))
+    return str(directory) if directory else None
+
+
+def enabled() -> bool:
+    return journal_dir() is not None
+
+
+class PendingComment:
+    """A journalled submission; `wait` blocks until its group has committed."""
+
+    def __init__(self, record: dict, end_offset: int):
+        self.record = record
+        self.end_offset = end_offset
+        self.error: Exception | None = None
+        self._committed = threading.Event()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait for the group to be processed; True if the comment was committed."""
+        return self._committed.wait(timeout) and self.error is None
+
+
+def _insert(records: list[dict]) -> set[int]:
+    """
+    Insert journal records in one transaction, retrying while the database
+    is locked.  Returns the ids of the events that received comments.
+    """
+    from .models import Comment, Event
+    comments = [
+        Comment(
+            user_id=record['user_id'], event_id=record['event_id'],
+            observation=record['observation'], discussion=record['discussion'],
+            recommendation=record['recommendation'], fingerprint=_FINGERPRINT_PREFIX + record['id'],
+        )
+        for record in records
+    ]
+    event_ids = {record['event_id'] for record in records}
+    delay = 0.05
+    for attempt in range(8):
+        try:
+            with transaction.atomic():
+                # ignore_conflicts makes replaying an already committed record a no-op.
+                Comment.objects.bulk_create(comments, ignore_conflicts=True)
+                for event_id in event_ids:
+                    Event.bump_comments_version(event_id)
+            return event_ids
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == 7:
+                raise
+            logger.warning(f"Database locked while committing {len(records)} comments; retrying in {delay:.2f}s.")
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+    return event_ids
+
+
+def _insert_or_drop(records: list[dict]) -> tuple[set[int], dict[str, Exception]]:
+    """
+    Insert records as one group or, if the group violates a constraint, one
+    at a time, dropping those the database rejects (e.g. the event or the
+    author was deleted after the comment was submitted).  Returns the ids of
+    the events that received comments and the errors of the dropped records
+    by record id.  Any other error, such as the database staying locked, is
+    raised: the records must stay in the journal and be retried.
+    """
+    try:
+        return _insert(records), {}
+    except IntegrityError as e:
+        logger.error(f"Could not commit a group of {len(records)} comments, committing one by one: {e}")
+    event_ids, dropped = set(), {}
+    for record in records:
+        try:
+            event_ids |= _insert([record])
+        except IntegrityError as e:
+            logger.error(f"Dropping journalled comment {record['id']}: {e}")
+            dropped[record['id']] = e
+    return event_ids, dropped
+
+
+def _after_commit(event_ids: set[int]) -> None:
+    """Refresh the search indexes of the events that received comments, once per group."""
+    from . import search
+    try:
+        search.get_indexes(event_ids)
+    except Exception as e:
+        logger.error(f"Could not refresh the indexes of events {sorted(event_ids)}: {e}")
+
+
+def _read_records(path: str, offset: int) -> list[dict]:
+    records = []
+    with open(path, 'rb') as handle:
+        handle.seek(offset)
+        for line in handle:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A torn final line from a crash mid-append was never acknowledged.
+                logger.warning(f"Ignoring an incomplete record in {path}.")
+    return records
+
+
+def _read_checkpoint(path: str) -> int:
+    try:
+        with open(f'{path}.ckpt', encoding='utf-8') as handle:
+            return int(handle.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _write_checkpoint(path: str, offset: int) -> None:
+    tmp_path = f'{path}.ckpt.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        handle.write(str(offset))
+    os.replace(tmp_path, f'{path}.ckpt')
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def replay_orphans(directory: str | None = None, own_pid: int | None = None) -> int:
+    """
+    Commit the uncheckpointed records of journals whose process is no longer
+    running, and delete those journals.  Returns the number of records.
+    """
+    directory = directory or journal_dir()
+    if not directory or not os.path.isdir(directory):
+        return 0
+    replayed = 0
+    for name in os.listdir(directory):
+        # comments-<pid>.journal, or comments-<pid>.journal.replay-<pid> while
+        # another process replays it; either belongs to the last pid.
+        match = _JOURNAL_RE.match(name)
+        if match is None:
+            continue
+        pid = int(match['replayer'] or match['pid'])
+        if pid == own_pid or (pid != os.getpid() and _process_alive(pid)):
+            continue
+        path = os.path.join(directory, name)
+        claimed = f"{os.path.join(directory, match['journal'])}.replay-{os.getpid()}"
+        try:
+            # Claim the journal so two processes never replay it together.
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        if os.path.exists(f'{path}.ckpt'):
+            os.replace(f'{path}.ckpt', f'{claimed}.ckpt')
+        records = _read_records(claimed, _read_checkpoint(claimed))
+        size = getattr(settings, 'DART_COMMENT_GROUP_SIZE', 100)
+        event_ids = set()
+        try:
+            for start in range(0, len(records), size):
+                event_ids |= _insert_or_drop(records[start:start + size])[0]
+        except Exception:
+            # Hand the journal back under its dead owner's name so that the
+            # next scan replays it again; inserting a record twice is a no-op.
+            released = os.path.join(directory, match['journal'])
+            os.rename(claimed, released)
+            if os.path.exists(f'{claimed}.ckpt'):
+                os.replace(f'{claimed}.ckpt', f'{released}.ckpt')
+            raise
+        if event_ids:
+            _after_commit(event_ids)
+        for leftover in (claimed, f'{claimed}.ckpt'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        logger.info(f"Replayed {len(records)} journalled comments from {name}.")
+        replayed += len(records)
+    return replayed
+
+
+class CommentJournal:
+    """The journal and committer thread of one process."""
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'comments-{self.pid}.journal')
+        # A journal left by an earlier process with the same pid is replayed first.
+        try:
+            replay_orphans(directory, own_pid=None)
+        except Exception as e:
+            # Released for the committer's next scan of orphaned journals.
+            logger.error(f"Could not replay orphaned comment journals: {e}")
+        self._handle = open(self.path, 'ab')
+        self._append_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._queue: list[PendingComment] = []
+        self._committed_offset = 0
+        _write_checkpoint(self.path, 0)
+        self._thread = threading.Thread(target=self._run, name='dart-comment-committer', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id: int, event_id: int, observation: str, discussion: str,
+               recommendation: str) -> PendingComment:
+        record = {
+            'id': uuid.uuid4().hex, 'user_id': user_id, 'event_id': event_id,
+            'observation': observation, 'discussion': discussion, 'recommendation': recommendation,
+        }
+        line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._append_lock:
+            self._handle.write(line)
+            self._handle.flush()
+            if getattr(settings, 'DART_COMMENT_JOURNAL_FSYNC', True):
+                os.fsync(self._handle.fileno())
+            pending = PendingComment(record, self._handle.tell())
+        with self._condition:
+            self._queue.append(pending)
+            self._condition.notify()
+        return pending
+
+    def _next_group(self) -> list[PendingComment]:
+        size = getattr(settings, 'DART_COMMENT_GROUP_SIZE', 100)
+        wait = getattr(settings, 'DART_COMMENT_GROUP_WAIT_MS', 20) / 1000
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._queue, timeout=_ORPHAN_SCAN_INTERVAL):
+                return []
+            # Give concurrent submitters a moment to join the group.
+            deadline = time.monotonic() + wait
+            while len(self._queue) < size and (remaining := deadline - time.monotonic()) > 0:
+                self._condition.wait(remaining)
+            group, self._queue = self._queue[:size], self._queue[size:]
+            return group
+
+    def _run(self) -> None:
+        delay = 0.5
+        while True:
+            group = self._next_group()
+            if not group:
+                self._scan_orphans()
+                continue
+            try:
+                event_ids, dropped = _insert_or_drop([pending.record for pending in group])
+            except Exception as e:
+                # Not the records' fault (e.g. the database is still locked):
+                # leave them unacknowledged and try the group again.
+                logger.error(f"Could not commit a group of {len(group)} comments, retrying in {delay:.1f}s: {e}")
+                connections.close_all()
+                with self._condition:
+                    self._queue[:0] = group
+                time.sleep(delay)
+                delay = min(delay * 2, _RETRY_DELAY_MAX)
+                continue
+            delay = 0.5
+            for pending in group:
+                pending.error = dropped.get(pending.record['id'])
+                pending._committed.set()
+            self._checkpoint(group[-1].end_offset)
+            _after_commit(event_ids)
+            logger.info(f"Committed a group of {len(group)} comments for events {sorted(event_ids)}.")
+
+    def _checkpoint(self, offset: int) -> None:
+        self._committed_offset = offset
+        _write_checkpoint(self.path, offset)
+        with self._append_lock:
+            if self._handle.tell() == offset:
+                # Everything is committed: start the journal afresh.
+                self._handle.truncate(0)
+                self._handle.seek(0)
+                self._committed_offset = 0
+                _write_checkpoint(self.path, 0)
+
+    def _scan_orphans(self) -> None:
+        try:
+            replay_orphans(os.path.dirname(self.path), own_pid=self.pid)
+        except Exception as e:
+            logger.error(f"Could not replay orphaned comment journals: {e}")
+        finally:
+            connections.close_all()
+
+
+_journal: CommentJournal | None = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> CommentJournal:
+    """The journal of this process, created (and its committer started) on first use and after a fork."""
+    global _journal
+    with _journal_lock:
+        if _journal is None or _journal.pid != os.getpid():
+            _journal = CommentJournal(journal_dir())
+        return _journal
+
+
+COMMITTED = 'committed'
+PENDING = 'pending'
+FAILED = 'failed'
+
+
+def submit(user, event, observation: str, discussion: str, recommendation: str) -> str:
+    """
+    Journal a comment and wait up to `DART_COMMENT_COMMIT_WAIT` seconds for
+    it to be committed.  Returns `COMMITTED`, `PENDING` (durable in the
+    journal, committed later) or `FAILED` (rejected by the database).
+    """
+    pending = get_journal().submit(user.id, event.id, observation, discussion, recommendation)
+    if pending.wait(getattr(settings, 'DART_COMMENT_COMMIT_WAIT', 2.0)):
+        return COMMITTED
+    return FAILED if pending.error is not None else PENDING
@@ -0,0 +1,268 @@
+"""
+Per-process cache of each event's searchable corpus.
+
+Every index in `base.search` is built from the text of an event's comments.
+Fetching that text through the ORM and tokenising it again on every change
+is the expensive part of keeping the indexes fresh, so this module keeps the
+corpus of each recently used event in memory in a compact form:
+
+* Comment ids live in an ``array('q')``; the joined comment texts are stored
+  as one UTF-8 buffer with an ``array('Q')`` of offsets, instead of one
+  Python string (with its ~50 bytes of overhead) per comment.
+* Texts are tokenised once.  Tokens are stored as ids into a process-wide
+  vocabulary in an ``array('I')`` with per-document offsets, and each
+  comment's sentiment is stored as a one-byte code.
+* Each corpus records the event's `comments_version` and
+  `comments_rewrites` stamps.  Comment writes bump `comments_version`;
+  edits and deletions also bump `comments_rewrites`.  If only
+  `comments_version` moved, the new comments (``id > last_id``) are fetched
+  and appended to a copy of the corpus; otherwise the corpus is reloaded.
+* The cache is an LRU bounded by the total size of the buffers
+  (`DART_CORPUS_CACHE_BYTES`).  Evicting a corpus also drops the indexes
+  built from it.
+
+Indexes are rebuilt from a cached corpus without touching the database, so a
+hot event is searched without any ORM materialisation.
+"""
+
+import logging
+import threading
+from array import array
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SENTIMENTS = ('Neutral', 'Positive', 'Negative')
+NEUTRAL, POSITIVE, NEGATIVE = range(3)
+
+
+class Vocabulary:
+    """Process-wide mapping between terms and integer ids."""
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self.terms: list[str] = []
+        self._lock = threading.Lock()
+
+    def ids(self, terms) -> list[int]:
+        ids = self._ids
+        result = []
+        for term in terms:
+            term_id = ids.get(term)
+            if term_id is None:
+                with self._lock:
+                    term_id = ids.get(term)
+                    if term_id is None:
+                        term_id = ids[term] = len(self.terms)
+                        self.terms.append(term)
+            result.append(term_id)
+        return result
+
+    def get(self, term: str) -> int | None:
+        return self._ids.get(term)
+
+
+vocabulary = Vocabulary()
+
+
+class TextColumn:
+    """
+    An append-only sequence of strings stored as one UTF-8 buffer.  The
+    buffers may also be read-only views, e.g. of a mapped segment file.
+    """
+
+    __slots__ = ('_data', '_offsets')
+
+    def __init__(self, data: bytearray | None = None, offsets: array | None = None):
+        self._data = data if data is not None else bytearray()
+        self._offsets = offsets if offsets is not None else array('Q', [0])
+
+    def copy(self) -> 'TextColumn':
+        return TextColumn(bytearray(self._data), array('Q', self._offsets))
+
+    def append(self, text: str) -> None:
+        self._data += text.encode('utf-8')
+        self._offsets.append(len(self._data))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) + self._offsets.itemsize * len(self._offsets)
+
+
+class EventCorpus:
+    """The tokenised comments of one event."""
+
+    __slots__ = ('event_id', 'version', 'rewrites', 'last_id', 'comment_ids', 'texts',
+                 'tokens', 'token_offsets', 'sentiments')
+
+    def __init__(self, event_id: int, version: int, rewrites: int):
+        self.event_id = event_id
+        self.version = version
+        self.rewrites = rewrites
+        self.last_id = 0
+        self.comment_ids = array('q')
+        self.texts = TextColumn()
+        self.tokens = array('I')
+        self.token_offsets = array('I', [0])
+        self.sentiments = array('b')
+
+    def copy(self, version: int) -> 'EventCorpus':
+        corpus = EventCorpus(self.event_id, version, self.rewrites)
+        corpus.last_id = self.last_id
+        corpus.comment_ids = array('q', self.comment_ids)
+        corpus.texts = self.texts.copy()
+        corpus.tokens = array('I', self.tokens)
+        corpus.token_offsets = array('I', self.token_offsets)
+        corpus.sentiments = array('b', self.sentiments)
+        return corpus
+
+    def append(self, comment_id: int, text: str) -> None:
+        from .models import Event
+        from .search import tokenize
+        words = tokenize(text)
+        positive = sum(1 for w in words if w in Event.POSITIVE_WORDS)
+        negative = sum(1 for w in words if w in Event.NEGATIVE_WORDS)
+        self.comment_ids.append(comment_id)
+        self.texts.append(text)
+        self.tokens.extend(vocabulary.ids(words))
+        self.token_offsets.append(len(self.tokens))
+        self.sentiments.append(POSITIVE if positive > negative else NEGATIVE if negative > positive else NEUTRAL)
+        self.last_id = max(self.last_id, comment_id)
+
+    def __len__(self) -> int:
+        return len(self.comment_ids)
+
+    def term_counts(self, doc_idx: int) -> Counter:
+        """Counts of the term ids of one document."""
+        return Counter(self.tokens[self.token_offsets[doc_idx]:self.token_offsets[doc_idx + 1]])
+
+    def sentiment(self, doc_idx: int) -> str:
+        return SENTIMENTS[self.sentiments[doc_idx]]
+
+    def rows(self) -> list[tuple[int, str]]:
+        return list(zip(self.comment_ids, self.texts))
+
+    @property
+    def nbytes(self) -> int:
+        return (self.texts.nbytes
+                + sum(a.itemsize * len(a) for a in (self.comment_ids, self.tokens, self.token_offsets, self.sentiments)))
+
+
+_corpora: OrderedDict[int, EventCorpus] = OrderedDict()
+_corpora_lock = threading.Lock()
+_evict_listeners = []
+
+
+def on_evict(listener) -> None:
+    """Register `listener(event_id)` to be called when a corpus is evicted."""
+    _evict_listeners.append(listener)
+
+
+def _comment_rows(queryset):
+    from .search import join_comment_text
+    values = queryset.order_by('event_id', 'id').values_list(
+        'event_id', 'id', 'observation', 'discussion', 'recommendation'
+    )
+    for event_id, comment_id, observation, discussion, recommendation in values.iterator():
+        yield event_id, comment_id, join_comment_text(observation, discussion, recommendation)
+
+
+def _refresh(corpus: EventCorpus, version: int) -> EventCorpus | None:
+    """Append the comments added since `corpus` was loaded, or None if it must be reloaded."""
+    from .models import Comment
+    comments = Comment.objects.filter(event_id=corpus.event_id)
+    new_rows = list(_comment_rows(comments.filter(id__gt=corpus.last_id)))
+    # A comment committed out of id order would be missed; reload instead.
+    if len(corpus) + len(new_rows) != comments.count():
+        return None
+    refreshed = corpus.copy(version)
+    for _, comment_id, text in new_rows:
+        refreshed.append(comment_id, text)
+    logger.info(f"Appended {len(new_rows)} comments to the corpus of event {corpus.event_id}.")
+    return refreshed
+
+
+def get_corpora(versions: dict[int, tuple[int, int]]) -> dict[int, EventCorpus]:
+    """
+    Return an up to date corpus for each event in `versions`, a mapping of
+    event id to its ``(comments_version, comments_rewrites)`` stamps.
+    """
+    from .models import Comment
+    with _corpora_lock:
+        cached = {event_id: _corpora.get(event_id) for event_id in versions}
+        for event_id, corpus in cached.items():
+            if corpus is not None:
+                _corpora.move_to_end(event_id)
+
+    result, reload = {}, []
+    for event_id, (version, rewrites) in versions.items():
+        corpus = cached[event_id]
+        if corpus is not None and corpus.version == version and corpus.rewrites == rewrites:
+            result[event_id] = corpus
+        elif corpus is not None and corpus.rewrites == rewrites:
+            refreshed = _refresh(corpus, version)
+            if refreshed is None:
+                reload.append(event_id)
+            else:
+                result[event_id] = refreshed
+        else:
+            reload.append(event_id)
+
+    if reload:
+        fresh = {event_id: EventCorpus(event_id, *versions[event_id]) for event_id in reload}
+        for event_id, comment_id, text in _comment_rows(Comment.objects.filter(event_id__in=reload)):
+            fresh[event_id].append(comment_id, text)
+        result.update(fresh)
+
+    _store({event_id: corpus for event_id, corpus in result.items() if corpus is not cached[event_id]})
+    return result
+
+
+def _store(corpora: dict[int, EventCorpus]) -> None:
+    if not corpora:
+        return
+    budget = getattr(settings, 'DART_CORPUS_CACHE_BYTES', 256 * 1024 * 1024)
+    evicted = []
+    with _corpora_lock:
+        for event_id, corpus in corpora.items():
+            _corpora[event_id] = corpus
+            _corpora.move_to_end(event_id)
+        total = sum(corpus.nbytes for corpus in _corpora.values())
+        while total > budget and len(_corpora) > 1:
+            event_id, corpus = _corpora.popitem(last=False)
+            total -= corpus.nbytes
+            evicted.append(event_id)
+    for event_id in evicted:
+        logger.info(f"Evicted the corpus of event {event_id} from the cache.")
+        for listener in _evict_listeners:
+            listener(event_id)
+
+
+def discard(event_id: int) -> None:
+    """Drop the cached corpus of an event, e.g. once it has been written to a segment."""
+    with _corpora_lock:
+        _corpora.pop(event_id, None)
+
+
+def cache_info() -> dict:
+    """Number of cached corpora and their total size in bytes."""
+    with _corpora_lock:
+        return {'events': len(_corpora), 'bytes': sum(c.nbytes for c in _corpora.values())}
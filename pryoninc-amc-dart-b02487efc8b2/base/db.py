@@ -0,0 +1,126 @@
+"""
+Database connection tuning and read/write routing.
+
+SQLite allows one writer at a time.  By default a connection that finds the
+database locked gives up after five seconds and readers block writers, so
+bursts of submissions fail with "database is locked".  Every new SQLite
+connection is therefore switched to write-ahead logging (readers no longer
+block the writer, nor the writer readers) with `synchronous=NORMAL`, which
+is safe in WAL mode and avoids an fsync per transaction.  The pragmas are
+configured in `DART_SQLITE_PRAGMAS`; the lock wait is the `timeout` in the
+database `OPTIONS`.
+
+Reads and writes are also kept apart.  `ReplicaRouter` sends writes to the
+`default` database and reads to the aliases in `DART_DB_REPLICAS`, so chat
+searches, page views and background analytics do not hold the connection
+that comment submissions and imports write through.  With SQLite the
+replica is a second, read-only (``mode=ro``) connection to the same WAL
+file, which sees every committed write at once; with PostgreSQL it can be a
+streaming replica.  Reads stay on `default`:
+
+* during unsafe (POST, ...) requests, and inside `use_primary()`;
+* inside a transaction on `default`, so read-modify-write code sees its own
+  uncommitted rows;
+* for `DART_DB_STICKY_SECONDS` after a user's last write, tracked by a
+  cookie set by `PrimaryPinMiddleware`, so users see their own comments
+  even on a replica that lags behind.
+"""
+
+import contextvars
+import logging
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal'}
+# Database-wide settings only the writer may change.
+WRITER_PRAGMAS = frozenset({'journal_mode'})
+STICKY_COOKIE = 'dart_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_use_primary: contextvars.ContextVar[bool] = contextvars.ContextVar('dart_use_primary', default=False)
+
+
+def _read_only(connection) -> bool:
+    return 'mode=ro' in str(connection.settings_dict.get('NAME', ''))
+
+
+def configure_connection(sender, connection, **kwargs) -> None:
+    """`connection_created` receiver applying `DART_SQLITE_PRAGMAS` to SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'DART_SQLITE_PRAGMAS', DEFAULT_PRAGMAS)
+    read_only = _read_only(connection)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            if read_only and name in WRITER_PRAGMAS:
+                continue
+            try:
+                cursor.execute(f'PRAGMA {name} = {value}')
+            except Exception as e:
+                logger.error(f"Could not set PRAGMA {name} = {value}: {e}")
+
+
+def replicas() -> list[str]:
+    return [alias for alias in getattr(settings, 'DART_DB_REPLICAS', []) if alias in settings.DATABASES]
+
+
+@contextmanager
+def use_primary():
+    """Send the reads made in this block (and the threads it starts with its context) to `default`."""
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class ReplicaRouter:
+    """Database router sending writes to `default` and reads to a replica (see the module docstring)."""
+
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return aliases[0] if len(aliases) == 1 else random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as `default`.
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinMiddleware:
+    """
+    Pin unsafe requests, and a user's requests for `DART_DB_STICKY_SECONDS`
+    after one, to the primary database.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+        unsafe = request.method not in SAFE_METHODS
+        token = _use_primary.set(unsafe or STICKY_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        sticky = getattr(settings, 'DART_DB_STICKY_SECONDS', 5)
+        if unsafe and sticky > 0:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=sticky, httponly=True, samesite='Lax')
+        return response
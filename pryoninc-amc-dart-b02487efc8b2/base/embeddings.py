@@ -0,0 +1,231 @@
+"""
+Text embeddings for vector retrieval.
+
+Two embedders are provided:
+
+* `HashingEmbedder` (the default) needs no model at all.  Every word is
+  broken into character n-grams (with word boundary markers, as fastText
+  does) and the n-grams are hashed into a fixed number of dimensions.  The
+  vectors are L2 normalised, so a dot product is a cosine similarity.
+  Sub-word features make it robust to inflections and misspellings
+  ("communicate" / "communications"), which complements the exact-token
+  lexical retriever.
+* `OllamaEmbedder` asks the local Ollama server for embeddings from the
+  model named in `DART_EMBEDDING_MODEL` (for example `nomic-embed-text`).
+  It captures paraphrases far better but costs a model call per batch.
+  Each process makes one and reuses it; while Ollama cannot be reached the
+  hashing embedder is used, and Ollama is tried again after
+  `_RETRY_SECONDS`.
+
+`numpy` is used for the similarity computation when it is installed; the
+pure Python fallback gives the same results, only slower.
+"""
+
+import logging
+import math
+import operator
+import os
+import threading
+import time
+import zlib
+from array import array
+
+from django.conf import settings
+
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+
+class HashingEmbedder:
+    name = 'hashing'
+
+    def __init__(self, dimensions: int = 256, ngram_range: tuple = (3, 5)):
+        self.dimensions = dimensions
+        self.ngram_range = ngram_range
+
+    def _features(self, text: str):
+        low, high = self.ngram_range
+        for word in tokenize(text):
+            marked = f'<{word}>'
+            yield marked
+            for n in range(low, high + 1):
+                for i in range(len(marked) - n + 1):
+                    yield marked[i:i + n]
+
+    def embed_one(self, text: str) -> array:
+        vector = array('f', bytes(4 * self.dimensions))
+        dimensions = self.dimensions
+        for feature in self._features(text):
+            # crc32 is fast and, unlike hash(), stable across processes.
+            digest = zlib.crc32(feature.encode('utf-8'))
+            vector[digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        for i in range(self.dimensions):
+            vector[i] /= norm
+        return vector
+
+    def embed(self, texts: list[str]) -> list[array]:
+        return [self.embed_one(text) for text in texts]
+
+
+class OllamaEmbedder:
+    name = 'ollama'
+    batch_size = 64
+
+    def __init__(self, model: str):
+        from .ollama_client import OllamaClient
+        self.model = model
+        self.name = f'ollama:{model}'
+        client = OllamaClient()
+        # The client is created even when the server is down; an empty model
+        # list means it could not be reached.
+        if not client.client or not client.models:
+            raise RuntimeError("Ollama is not available.")
+        self.client = client.client
+
+    def embed(self, texts: list[str]) -> list[array]:
+        if not self.client:
+            raise RuntimeError("Ollama client is not available.")
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embed(model=self.model, input=texts[start:start + self.batch_size])
+            for values in response.get('embeddings', []):
+                norm = math.sqrt(sum(v * v for v in values)) or 1.0
+                vectors.append(array('f', (v / norm for v in values)))
+        return vectors
+
+
+# Seconds before an Ollama embedder that could not be created is tried again.
+_RETRY_SECONDS = 60.0
+
+# (pid, model) -> (embedder, time.monotonic() at which it was made).
+_embedders: dict[tuple, tuple] = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder():
+    """Return the configured embedder, falling back to `HashingEmbedder`."""
+    model = getattr(settings, 'DART_EMBEDDING_MODEL', None)
+    key = (os.getpid(), model)
+    with _embedders_lock:
+        cached = _embedders.get(key)
+        if cached is not None:
+            embedder, made = cached
+            if not isinstance(embedder, HashingEmbedder) or not model or time.monotonic() - made < _RETRY_SECONDS:
+                return embedder
+        embedder = HashingEmbedder()
+        if model:
+            try:
+                embedder = OllamaEmbedder(model)
+            except Exception as e:
+                logger.error(f"Falling back to hashing embeddings, Ollama embedder unavailable: {e}")
+        _embedders[key] = (embedder, time.monotonic())
+        return embedder
+
+
+class EmbeddingMatrix:
+    """Matrix of unit vectors, one row per document."""
+
+    def __init__(self, vectors: list[array]):
+        self.rows = len(vectors)
+        self.dimensions = len(vectors[0]) if vectors else 0
+        if np is not None and vectors:
+            self.data = np.array(vectors, dtype=np.float32)
+        else:
+            self.data = list(vectors)
+
+    @classmethod
+    def concat(cls, parts: list) -> 'EmbeddingMatrix':
+        """Stack runs of rows (lists of vectors or `vectors` slices) into one matrix."""
+        parts = [part for part in parts if len(part)]
+        matrix = cls.__new__(cls)
+        matrix.rows = sum(len(part) for part in parts)
+        matrix.dimensions = len(parts[0][0]) if parts else 0
+        if np is not None and parts:
+            matrix.data = np.vstack([np.asarray(part, dtype=np.float32) for part in parts])
+        else:
+            matrix.data = [row for part in parts for row in part]
+        return matrix
+
+    @classmethod
+    def from_buffer(cls, buffer, rows: int, dimensions: int) -> 'EmbeddingMatrix':
+        """Wrap a buffer of float32 rows, such as a mapped segment file, without copying it."""
+        matrix = cls.__new__(cls)
+        matrix.rows = rows
+        matrix.dimensions = dimensions
+        view = memoryview(buffer).cast('B').cast('f')
+        if np is not None and rows:
+            matrix.data = np.frombuffer(view, dtype=np.float32).reshape(rows, dimensions)
+        else:
+            matrix.data = _BufferRows(view, dimensions)
+        return matrix
+
+    def tobytes(self) -> bytes:
+        """The rows as packed float32 values, as `from_buffer` reads them."""
+        if np is not None and not isinstance(self.data, (list, _BufferRows)):
+            return self.data.astype(np.float32).tobytes()
+        return b''.join(array('f', row).tobytes() for row in self.data)
+
+    def vectors(self, start: int, stop: int):
+        """Rows `start` to `stop`, for `concat`."""
+        return self.data[start:stop]
+
+    def similarities(self, query_vector: array, rows=None) -> list[float]:
+        """Cosine similarity of `query_vector` with every (or selected) row."""
+        if self.rows == 0:
+            return []
+        if np is not None:
+            query = np.asarray(query_vector, dtype=np.float32)
+            data = self.data if rows is None else self.data[list(rows)]
+            return (data @ query).tolist()
+        data = self.data if rows is None else [self.data[i] for i in rows]
+        return [sum(map(operator.mul, row, query_vector)) for row in data]
+
+
+class _BufferRows:
+    """Rows of a flat float32 buffer, for the pure Python code path."""
+
+    def __init__(self, view: memoryview, dimensions: int):
+        self.view = view
+        self.dimensions = dimensions
+
+    def __len__(self) -> int:
+        return len(self.view) // self.dimensions if self.dimensions else 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.view[i * self.dimensions:(i + 1) * self.dimensions]
+
+
+class StackedMatrix:
+    """Two matrices queried as one; the rows of `second` follow those of `first`."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+        self.rows = first.rows + second.rows
+        self.dimensions = first.dimensions or second.dimensions
+
+    def vectors(self, start: int, stop: int) -> list:
+        split = self.first.rows
+        first = self.first.vectors(min(start, split), min(stop, split))
+        second = self.second.vectors(max(start - split, 0), max(stop - split, 0))
+        return [*first, *second]
+
+    def similarities(self, query_vector: array, rows=None) -> list[float]:
+        if rows is None:
+            return self.first.similarities(query_vector) + self.second.similarities(query_vector)
+        rows = list(rows)
+        split = self.first.rows
+        first = iter(self.first.similarities(query_vector, [r for r in rows if r < split]))
+        second = iter(self.second.similarities(query_vector, [r - split for r in rows if r >= split]))
+        return [next(first) if r < split else next(second) for r in rows]
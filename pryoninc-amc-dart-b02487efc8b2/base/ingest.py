@@ -0,0 +1,452 @@
+"""
+Bulk comment ingestion.
+
+Comment exports arrive as CSV, JSON Lines, JSON or XLSX files, often several
+at once or bundled in a zip archive.  `ingest_files` turns any mix of those
+into `Comment` rows:
+
+1. Every upload is staged on disk and expanded into parse tasks, one per
+   file or archive member.
+2. The tasks are parsed in parallel on a process pool.  Parsing is pure
+   Python and CPU bound, so processes (not threads) are what make use of a
+   multi-core machine.  The parse functions do not touch Django, and the
+   pool uses the "spawn" start method so the workers never inherit the
+   server's threads, locks or database connections.
+3. Each parser normalises its rows to the observation / discussion /
+   recommendation schema, accepting the common header aliases below, and
+   streams them to a spool file in the staging directory in batches of
+   `DART_INGEST_BATCH_SIZE`.  Neither the worker nor the pipe back to the
+   calling process ever holds a whole file's rows.
+4. A single writer in the calling process reads each spool file back batch
+   by batch and inserts the rows with `bulk_create`, one transaction per
+   batch, as the parse results come in.
+
+Imports are idempotent.  Every file (or archive member) is recorded as a
+`CommentUpload` keyed by the SHA-256 of its content, and every row carries a
+fingerprint of its content that is unique per event.  Uploading a file
+again, or a browser retrying the POST, is recognised and skipped; rows that
+overlap with an earlier export are not inserted twice; and an import that
+failed part way resumes after the last batch it committed, because the
+upload's `rows_committed` advances in the same transaction as the batch.
+An import first claims its upload with a conditional update from pending
+(or failed) to running; a concurrent import of the same file finds it
+claimed and skips it.  A claim whose import has written nothing for
+`DART_INGEST_CLAIM_TIMEOUT` seconds (its process died) may be taken over.
+
+Progress and throughput are logged after every batch and can also be
+followed through an optional callback, which `manage.py import_comments`
+uses to print progress for large dumps.  XLSX files are read with the
+standard library (an .xlsx file is a zip of XML parts), so no spreadsheet
+dependency is needed.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.csv', '.jsonl', '.ndjson', '.json', '.xlsx')
+FIELDS = ('observation', 'discussion', 'recommendation')
+HEADER_ALIASES = {
+    'observation': 'observation', 'observations': 'observation', 'obs': 'observation',
+    'discussion': 'discussion', 'discussions': 'discussion', 'disc': 'discussion',
+    'recommendation': 'recommendation', 'recommendations': 'recommendation', 'rec': 'recommendation',
+    'recs': 'recommendation',
+}
+
+
+@dataclass
+class IngestReport:
+    files: int = 0
+    rows: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+    duplicate_files: int = 0
+    duplicate_rows: int = 0
+    resumed_files: int = 0
+    errors: list = field(default_factory=list)
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+# -- parsing (runs in worker processes) --------------------------------------
+
+def _normalise_key(key) -> str | None:
+    if key is None:
+        return None
+    cleaned = re.sub(r'[^a-z]', '', str(key).strip().lower())
+    return HEADER_ALIASES.get(cleaned)
+
+
+def _normalise(record: dict) -> tuple | None:
+    """Map a parsed record onto the ODR schema; None if it has no content."""
+    values = dict.fromkeys(FIELDS, '')
+    for key, value in record.items():
+        name = _normalise_key(key)
+        if name and value is not None:
+            values[name] = str(value).strip()
+    if not any(values.values()):
+        return None
+    return tuple(values[name] for name in FIELDS)
+
+
+def _parse_csv(handle):
+    return csv.DictReader(io.TextIOWrapper(handle, encoding='utf-8-sig', newline=''))
+
+
+def _parse_jsonl(handle):
+    for line in io.TextIOWrapper(handle, encoding='utf-8-sig'):
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _parse_json(handle):
+    data = json.load(io.TextIOWrapper(handle, encoding='utf-8-sig'))
+    if isinstance(data, dict):
+        data = data.get('comments', [data])
+    return data
+
+
+_XLSX_NS = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+def _column_index(cell_ref: str) -> int:
+    index = 0
+    for char in cell_ref:
+        if not char.isalpha():
+            break
+        index = index * 26 + (ord(char.upper()) - ord('A') + 1)
+    return index - 1
+
+
+def _parse_xlsx(handle):
+    """Yield the rows of the first worksheet as dictionaries keyed by the header row."""
+    with zipfile.ZipFile(handle) as workbook:
+        shared = []
+        if 'xl/sharedStrings.xml' in workbook.namelist():
+            root = ElementTree.fromstring(workbook.read('xl/sharedStrings.xml'))
+            for item in root.findall('m:si', _XLSX_NS):
+                shared.append(''.join(t.text or '' for t in item.iter(f'{{{_XLSX_NS["m"]}}}t')))
+        sheets = sorted(n for n in workbook.namelist() if re.match(r'xl/worksheets/sheet\d+\.xml$', n))
+        if not sheets:
+            return
+        header = None
+        with workbook.open(sheets[0]) as sheet:
+            for _, element in ElementTree.iterparse(sheet):
+                if element.tag != f'{{{_XLSX_NS["m"]}}}row':
+                    continue
+                cells = {}
+                for cell in element.findall('m:c', _XLSX_NS):
+                    kind = cell.get('t')
+                    if kind == 'inlineStr':
+                        value = ''.join(t.text or '' for t in cell.iter(f'{{{_XLSX_NS["m"]}}}t'))
+                    else:
+                        raw = cell.find('m:v', _XLSX_NS)
+                        value = raw.text if raw is not None else ''
+                        if kind == 's' and value:
+                            value = shared[int(value)]
+                    cells[_column_index(cell.get('r', ''))] = value
+                element.clear()
+                if header is None:
+                    header = cells
+                    continue
+                yield {header[i]: v for i, v in cells.items() if i in header}
+
+
+PARSERS = {
+    '.csv': _parse_csv,
+    '.jsonl': _parse_jsonl,
+    '.ndjson': _parse_jsonl,
+    '.json': _parse_json,
+    '.xlsx': _parse_xlsx,
+}
+
+
+def fingerprint(observation: str, discussion: str, recommendation: str, occurrence: int = 0) -> str:
+    """
+    Identify a normalised row.  `occurrence` numbers repeated rows within one
+    file, so rows that legitimately repeat in an export are all kept while a
+    second import of the same rows is recognised.
+    """
+    payload = '\x1f'.join((observation, discussion, recommendation, str(occurrence)))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _digest(open_handle) -> str:
+    digest = hashlib.sha256()
+    with open_handle() as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_task(path: str, member: str | None, spool: str, batch_size: int) -> tuple[str, int, int]:
+    """
+    Parse one file (or one member of a zip archive) and write its normalised
+    ``(observation, discussion, recommendation, fingerprint)`` rows to the
+    file `spool`, pickled in lists of `batch_size` (see `read_spool`).
+    Returns the SHA-256 of the content, the number of rows and the number of
+    records skipped because they had no content.
+    """
+    name = member or path
+    parser = PARSERS[os.path.splitext(name)[1].lower()]
+    count, skipped = 0, 0
+    batch = []
+    # Occurrences of each distinct row, keyed by a digest rather than the text.
+    seen: Counter = Counter()
+    with ExitStack() as stack:
+        out = stack.enter_context(open(spool, 'wb'))
+        if member is None:
+            digest = _digest(lambda: open(path, 'rb'))
+            handle = stack.enter_context(open(path, 'rb'))
+        else:
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            digest = _digest(lambda: archive.open(member))
+            # Spreadsheets need random access, so read them into memory.
+            if name.lower().endswith('.xlsx'):
+                handle = io.BytesIO(archive.read(member))
+            else:
+                handle = stack.enter_context(archive.open(member))
+        for record in parser(handle):
+            row = _normalise(record) if isinstance(record, dict) else None
+            if row is None:
+                skipped += 1
+                continue
+            key = hashlib.blake2b('\x1f'.join(row).encode('utf-8'), digest_size=16).digest()
+            occurrence = seen[key]
+            seen[key] += 1
+            batch.append(row + (fingerprint(*row, occurrence),))
+            count += 1
+            if len(batch) >= batch_size:
+                pickle.dump(batch, out, pickle.HIGHEST_PROTOCOL)
+                batch = []
+        if batch:
+            pickle.dump(batch, out, pickle.HIGHEST_PROTOCOL)
+    return digest, count, skipped
+
+
+def read_spool(spool: str, skip: int = 0):
+    """Yield the batches of rows written by `parse_task`, leaving out the first `skip` rows."""
+    with open(spool, 'rb') as handle:
+        while True:
+            try:
+                batch = pickle.load(handle)
+            except EOFError:
+                return
+            if skip >= len(batch):
+                skip -= len(batch)
+                continue
+            yield batch[skip:]
+            skip = 0
+
+
+# -- staging and writing (runs in the calling process) -----------------------
+
+def _stage(uploaded_file, directory: str) -> str:
+    """Return a filesystem path holding the upload's content."""
+    if isinstance(uploaded_file, str):
+        return uploaded_file
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return uploaded_file.temporary_file_path()
+    # A unique name, so uploads that share a file name do not overwrite each other.
+    extension = os.path.splitext(uploaded_file.name or '')[1]
+    fd, path = tempfile.mkstemp(suffix=extension, prefix='upload-', dir=directory)
+    with os.fdopen(fd, 'wb') as handle:
+        for chunk in uploaded_file.chunks():
+            handle.write(chunk)
+    return path
+
+
+def expand_tasks(path: str, name: str) -> list[tuple[str, str | None, str]]:
+    """
+    Turn a staged file into ``(path, member, label)`` parse tasks, expanding
+    zip archives.  `label` names the file (or ``archive/member``) for the
+    user.
+    """
+    name = os.path.basename(name)
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.zip':
+        with zipfile.ZipFile(path) as archive:
+            return [
+                (path, info.filename, f'{name}/{info.filename}') for info in archive.infolist()
+                if not info.is_dir()
+                and os.path.splitext(info.filename)[1].lower() in SUPPORTED_EXTENSIONS
+                and not os.path.basename(info.filename).startswith('.')
+            ]
+    if extension in SUPPORTED_EXTENSIONS:
+        return [(path, None, name)]
+    raise ValueError(f"unsupported file type {extension or name!r}")
+
+
+def write_rows(event, user, upload, rows: list[tuple]) -> int:
+    """
+    Insert one batch of normalised rows and advance the upload's resume
+    point in a single transaction.  Rows whose fingerprint already exists on
+    the event are skipped; returns the number of comments created.
+    """
+    from django.db import transaction
+    from django.db.models import F
+    from django.utils import timezone
+    from .models import Comment, CommentUpload, Event
+    with transaction.atomic():
+        existing = set(
+            Comment.objects.filter(event=event, fingerprint__in=[row[3] for row in rows])
+            .values_list('fingerprint', flat=True)
+        )
+        new = [
+            Comment(user=user, event=event, observation=o, discussion=d, recommendation=r, fingerprint=fp)
+            for o, d, r, fp in rows if fp not in existing
+        ]
+        # ignore_conflicts covers a concurrent import of the same rows.
+        Comment.objects.bulk_create(new, ignore_conflicts=True)
+        if new:
+            # bulk_create sends no signals, so tell the search caches here.
+            Event.bump_comments_version(event.id)
+        CommentUpload.objects.filter(pk=upload.pk).update(
+            rows_committed=F('rows_committed') + len(rows), updated_at=timezone.now()
+        )
+    return len(new)
+
+
+def claim(upload) -> bool:
+    """
+    Mark `upload` as running if no other import is working on it.  Returns
+    whether the claim succeeded; `upload` is refreshed either way.
+    """
+    from datetime import timedelta
+    from django.conf import settings
+    from django.db.models import Q
+    from django.utils import timezone
+    from .models import CommentUpload
+    now = timezone.now()
+    abandoned = now - timedelta(seconds=getattr(settings, 'DART_INGEST_CLAIM_TIMEOUT', 600))
+    claimed = CommentUpload.objects.filter(
+        Q(status__in=[CommentUpload.PENDING, CommentUpload.FAILED])
+        | Q(status=CommentUpload.RUNNING, updated_at__lt=abandoned),
+        pk=upload.pk,
+    ).update(status=CommentUpload.RUNNING, updated_at=now)
+    upload.refresh_from_db()
+    return bool(claimed)
+
+
+def _remove(spool: str) -> None:
+    """Free a spool file's disk space as soon as its rows are written."""
+    try:
+        os.remove(spool)
+    except FileNotFoundError:
+        pass
+
+
+def ingest_files(event, user, uploaded_files, progress=None) -> IngestReport:
+    """
+    Parse `uploaded_files` (Django uploads, or paths of files already on
+    disk) in parallel and store their comments on `event`.
+    `progress`, if given, is called with the running `IngestReport` after
+    every written batch.
+
+    Each file is recorded as a `CommentUpload`: a file that was already
+    imported completely is skipped, and one whose import failed part way
+    resumes after its last committed batch.
+    """
+    from django.conf import settings
+    from .models import CommentUpload
+
+    batch_size = getattr(settings, 'DART_INGEST_BATCH_SIZE', 2000)
+    max_workers = getattr(settings, 'DART_INGEST_WORKERS', None) or os.cpu_count() or 1
+    report = IngestReport()
+    start = time.perf_counter()
+    staging = tempfile.mkdtemp(prefix='dart-ingest-')
+    try:
+        tasks = []
+        for uploaded_file in uploaded_files:
+            name = getattr(uploaded_file, 'name', uploaded_file)
+            try:
+                tasks.extend(expand_tasks(_stage(uploaded_file, staging), name))
+            except (OSError, ValueError, zipfile.BadZipFile) as e:
+                report.errors.append(f"{os.path.basename(name)}: {e}")
+        report.files = len(tasks)
+
+        def consume(result, label, spool):
+            digest, count, skipped = result
+            upload, _ = CommentUpload.objects.get_or_create(
+                event=event, sha256=digest,
+                defaults={'user': user, 'name': label[:255], 'rows_total': count},
+            )
+            if upload.status != CommentUpload.COMPLETE and not claim(upload) \
+                    and upload.status == CommentUpload.RUNNING:
+                report.errors.append(f"{label}: it is being imported by another request.")
+                return
+            if upload.status == CommentUpload.COMPLETE:
+                logger.info(f"Skipping {label} for event {event.id}: already imported as upload {upload.id}.")
+                report.duplicate_files += 1
+                return
+            if upload.rows_committed:
+                logger.info(f"Resuming {label} for event {event.id} after row {upload.rows_committed}.")
+                report.resumed_files += 1
+            report.skipped += skipped
+            try:
+                for batch in read_spool(spool, upload.rows_committed):
+                    created = write_rows(event, user, upload, batch)
+                    report.rows += created
+                    report.duplicate_rows += len(batch) - created
+                    report.seconds = time.perf_counter() - start
+                    logger.info(
+                        f"Ingest for event {event.id}: {report.rows} rows from {report.files} files "
+                        f"({report.rows_per_second:.0f} rows/s)."
+                    )
+                    if progress:
+                        progress(report)
+            except Exception:
+                CommentUpload.objects.filter(pk=upload.pk).update(status=CommentUpload.FAILED)
+                raise
+            CommentUpload.objects.filter(pk=upload.pk).update(status=CommentUpload.COMPLETE)
+
+        spools = [os.path.join(staging, f'task-{i}.rows') for i in range(len(tasks))]
+        if len(tasks) <= 1 or max_workers <= 1:
+            for (path, member, label), spool in zip(tasks, spools):
+                try:
+                    consume(parse_task(path, member, spool, batch_size), label, spool)
+                except Exception as e:
+                    report.errors.append(f"{label}: {e}")
+                finally:
+                    _remove(spool)
+        else:
+            context = get_context('spawn')
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks)), mp_context=context) as pool:
+                futures = {
+                    pool.submit(parse_task, path, member, spool, batch_size): (label, spool)
+                    for (path, member, label), spool in zip(tasks, spools)
+                }
+                for future in as_completed(futures):
+                    label, spool = futures[future]
+                    try:
+                        consume(future.result(), label, spool)
+                    except Exception as e:
+                        report.errors.append(f"{label}: {e}")
+                    finally:
+                        _remove(spool)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    report.seconds = time.perf_counter() - start
+    for error in report.errors:
+        logger.error(f"Ingest error for event {event.id}: {error}")
+    return report
@@ -0,0 +1,310 @@
+"""
+Lightweight performance instrumentation for DART.
+
+When a chat query is slow we want to know whether the time went to the
+database, the Python retrieval loop, the Ollama call or template rendering.
+This module provides the pieces needed to answer that question without any
+third party dependencies:
+
+* An in-process metrics registry (counters and histograms) that can be
+  rendered in the Prometheus text exposition format for the ``/metrics``
+  endpoint.  Metrics are per process; when several workers are running each
+  one exposes its own values.
+* Request-scoped timing spans.  ``span('retrieval')`` may be used anywhere in
+  the code base; durations are accumulated on the current request (tracked
+  with a context variable) and are also observed in a histogram.  The
+  middleware in ``base/middleware.py`` turns the accumulated spans into a
+  ``Server-Timing`` response header.
+* Helpers for recording LLM throughput (tokens per second) and
+  time-to-first-token from the statistics returned by Ollama.
+* A small sampling profiler which periodically captures the stack of the
+  request thread.  The output is written in the "folded" format understood by
+  flamegraph tools.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import logging
+import math
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class CounterMetric:
+    """A monotonically increasing counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in items]
+
+
+class HistogramMetric:
+    """A cumulative histogram with fixed bucket boundaries."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label key -> [bucket counts..., sum, count]
+        self._values: dict[tuple, list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(row)) for key, row in self._values.items()]
+        lines = []
+        for key, row in items:
+            for i, bound in enumerate(self.buckets):
+                labels = key + (('le', _format_value(bound)),)
+                lines.append(f'{self.name}_bucket{_format_labels(labels)} {_format_value(row[i])}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(row[-2])}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {_format_value(row[-1])}')
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric exposed on the ``/metrics`` endpoint."""
+
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str) -> CounterMetric:
+        return self._register(CounterMetric(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> HistogramMetric:
+        return self._register(HistogramMetric(name, documentation, buckets))
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'dart_http_requests_total', 'HTTP requests processed, by view, method and status.')
+HTTP_DURATION = REGISTRY.histogram(
+    'dart_http_request_duration_seconds', 'Wall clock time spent handling a request, by view.')
+PHASE_DURATION = REGISTRY.histogram(
+    'dart_phase_duration_seconds', 'Time spent in an instrumented phase (db, retrieval, llm, render, markdown).')
+DB_QUERIES = REGISTRY.counter(
+    'dart_db_queries_total', 'Database queries executed, by view.')
+DB_QUERIES_PER_REQUEST = REGISTRY.histogram(
+    'dart_db_queries_per_request', 'Number of database queries executed per request, by view.',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+LLM_REQUESTS = REGISTRY.counter(
+    'dart_llm_requests_total', 'LLM generation calls, by model and outcome.')
+LLM_TOKENS = REGISTRY.counter(
+    'dart_llm_generated_tokens_total', 'Tokens generated by the LLM, by model.')
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    'dart_llm_tokens_per_second', 'LLM generation throughput in tokens per second, by model.',
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500))
+LLM_TTFT = REGISTRY.histogram(
+    'dart_llm_time_to_first_token_seconds', 'Time until the LLM produced its first token, by model.')
+
+
+class RequestTimings:
+    """Accumulates span durations and counters for a single request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: dict[str, float] = defaultdict(float)
+        self.counts: dict[str, int] = defaultdict(int)
+
+    def add(self, name: str, seconds: float, count: int = 1) -> None:
+        self.spans[name] += seconds
+        self.counts[name] += count
+
+    def server_timing(self) -> str:
+        """Format the collected spans as a ``Server-Timing`` header value."""
+        entries = []
+        for name, seconds in self.spans.items():
+            entry = f'{name};dur={seconds * 1000:.1f}'
+            if name == 'db':
+                entry += f';desc="{self.counts[name]} queries"'
+            entries.append(entry)
+        total = time.perf_counter() - self.started
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(entries)
+
+
+_current: contextvars.ContextVar[RequestTimings | None] = contextvars.ContextVar(
+    'dart_request_timings', default=None)
+
+
+def start_request() -> tuple[RequestTimings, contextvars.Token]:
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _current.reset(token)
+
+
+def current_timings() -> RequestTimings | None:
+    return _current.get()
+
+
+def record(name: str, seconds: float, count: int = 1, observe: bool = True) -> None:
+    """Record a duration against the current request and the phase histogram."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds, count)
+    if observe:
+        PHASE_DURATION.observe(seconds, phase=name)
+
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block as the phase ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def record_llm_response(model: str, response, wall_seconds: float) -> None:
+    """
+    Record throughput and latency statistics for a completed generation.
+
+    Ollama reports durations in nanoseconds.  For non-streaming calls the time
+    to first token is the model load time plus the prompt evaluation time;
+    when those fields are missing we fall back to the wall clock duration.
+    """
+    def field(key):
+        try:
+            return response.get(key) or 0
+        except Exception:
+            return 0
+
+    eval_count = field('eval_count')
+    eval_duration = field('eval_duration') / 1e9
+    ttft = (field('load_duration') + field('prompt_eval_duration')) / 1e9 or wall_seconds
+    LLM_REQUESTS.inc(model=model, outcome='ok')
+    LLM_TTFT.observe(ttft, model=model)
+    if eval_count:
+        LLM_TOKENS.inc(eval_count, model=model)
+        if eval_duration > 0:
+            LLM_TOKENS_PER_SECOND.observe(eval_count / eval_duration, model=model)
+    timings = _current.get()
+    if timings is not None:
+        timings.add('llm_ttft', ttft)
+
+
+class SamplingProfiler:
+    """
+    Periodically sample the stack of one thread.
+
+    A background thread wakes up every ``interval`` seconds, grabs the target
+    thread's current frame via ``sys._current_frames`` and counts the
+    resulting stack.  Sampling keeps the overhead small and predictable
+    compared to a deterministic profiler, which makes it suitable for
+    switching on for a single slow request.
+    """
+
+    def __init__(self, thread_id: int | None = None, interval: float = 0.005):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self) -> 'SamplingProfiler':
+        self._thread = threading.Thread(target=self._sample, name='dart-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def folded(self) -> str:
+        """Return the samples in the folded stack format used by flamegraphs."""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
@@ -0,0 +1,119 @@
+"""
+Background jobs started from the admin.
+
+Admin actions over thousands of comments (rebuilding an event's index,
+recomputing sentiment, archiving) take far longer than a request should.
+The actions therefore only `submit` a job and return at once; jobs run one
+at a time (`DART_ADMIN_JOB_WORKERS`) on a thread pool in the process that
+received the request, and their progress and outcome are logged.  Each job
+is recorded as a `BackgroundJob` row naming the worker that runs it, so
+`recent`, which the admin shows above its change lists, lists the jobs of
+every worker.  Jobs are not resumed: a job still queued or running when its
+worker stops is left in that state and has to be started again.
+"""
+
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid: int | None = None
+_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _lock:
+        # Never reuse a pool inherited from a pre-fork parent: its threads do not exist here.
+        if _executor is None or _executor_pid != os.getpid():
+            _executor_pid = os.getpid()
+            workers = getattr(settings, 'DART_ADMIN_JOB_WORKERS', 1)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dart-job')
+        return _executor
+
+
+def submit(name: str, user, func, *args):
+    """Queue `func(*args)`; its return value, if any, is recorded as the job's result."""
+    from .models import BackgroundJob
+    job = BackgroundJob.objects.create(name=name, user=str(user), worker=f'{socket.gethostname()}:{os.getpid()}')
+
+    def run():
+        job.state, job.started = BackgroundJob.RUNNING, timezone.now()
+        job.save(update_fields=['state', 'started'])
+        logger.info(f"Job {job.id} ({job.name}) started by {job.user}.")
+        try:
+            job.result = str(func(*args) or '')
+            job.state = BackgroundJob.DONE
+            logger.info(f"Job {job.id} ({job.name}) finished in {job.seconds:.1f}s. {job.result}")
+        except Exception as e:
+            job.result, job.state = str(e), BackgroundJob.FAILED
+            logger.exception(f"Job {job.id} ({job.name}) failed: {e}")
+        finally:
+            job.finished = timezone.now()
+            try:
+                job.save(update_fields=['state', 'result', 'finished'])
+            except Exception as e:
+                logger.error(f"Could not record the outcome of job {job.id}: {e}")
+            connections.close_all()
+
+    _get_executor().submit(run)
+    _prune()
+    return job
+
+
+def _prune() -> None:
+    """Forget all but the `DART_ADMIN_JOB_HISTORY` most recent jobs."""
+    from .models import BackgroundJob
+    keep = getattr(settings, 'DART_ADMIN_JOB_HISTORY', 100)
+    oldest = list(BackgroundJob.objects.order_by('-id').values_list('id', flat=True)[keep:keep + 1])
+    if oldest:
+        BackgroundJob.objects.filter(id__lte=oldest[0]).delete()
+
+
+def recent(limit: int = 20) -> list:
+    from .models import BackgroundJob
+    return list(BackgroundJob.objects.order_by('-id')[:limit])
+
+
+# -- the admin's jobs -----------------------------------------------------------
+
+def reindex_events(event_ids: list[int]) -> str:
+    from . import search
+    indexes = search.rebuild_indexes(event_ids)
+    return f"Rebuilt {len(indexes)} indexes covering {sum(len(index) for index in indexes.values())} comments."
+
+
+def recompute_sentiment(event_ids: list[int]) -> str:
+    """Rebuild the indexes (and so each comment's sentiment), then regenerate the prepared sentiment summaries."""
+    from . import precompute
+    from .models import PrecomputedAnswer
+    summary = reindex_events(event_ids)
+    regenerated = 0
+    if precompute.enabled():
+        for event_id in event_ids:
+            for sentiment in precompute.SENTIMENTS[1:]:
+                if precompute.compute(event_id, PrecomputedAnswer.SUMMARY, sentiment) is not None:
+                    regenerated += 1
+    return f"{summary} Regenerated {regenerated} sentiment summaries."
+
+
+def archive_events(event_ids: list[int]) -> str:
+    from .archive import ArchiveError, archive_event
+    from .models import Event
+    archived, failed = 0, []
+    for event in Event.objects.filter(pk__in=event_ids, archived_at__isnull=True):
+        try:
+            archive_event(event)
+            archived += 1
+        except ArchiveError as e:
+            logger.error(f"Could not archive event {event.id}: {e}")
+            failed.append(event.name)
+    return f"Archived {archived} events." + (f" Failed: {', '.join(failed)}." if failed else '')
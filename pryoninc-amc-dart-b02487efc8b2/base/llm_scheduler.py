@@ -0,0 +1,296 @@
+"""
+Scheduling for LLM generation calls.
+
+All generations go to a single local Ollama instance, which can only run a
+small number of them at once.  Without coordination every request that asks
+for an answer or a summary starts its own call, identical calls are
+duplicated when several invitees press the same button, and excess requests
+simply pile up until worker threads time out.  `LLMScheduler` sits under
+`OllamaClient.generate` and provides:
+
+* Single-flight coalescing: while a call for a given (model, prompt) is in
+  flight, identical calls wait for it and share its result instead of
+  starting their own.
+* A per-model concurrency limit (`DART_LLM_CONCURRENCY`).  Callers beyond
+  the limit wait in a priority queue, so interactive chat answers are served
+  ahead of batch work such as event summaries.
+* Load shedding.  When the queue is full (`DART_LLM_MAX_QUEUE`) or a caller
+  has waited longer than `DART_LLM_MAX_WAIT` seconds, `SchedulerBusy` is
+  raised so the view can tell the user to retry.  An interactive caller
+  arriving at a full queue displaces the least urgent queued caller if that
+  one has lower priority.
+
+The scheduler is per process; with several workers the effective limit is
+the per-process limit times the number of workers.  Idleness is shared,
+though: each process records in `DART_LLM_ACTIVITY_DIR` whether it has
+generations running and when its last one finished, and `idle_seconds`
+counts the generations of every process on the host.
+"""
+
+import hashlib
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BATCH = 10
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch'}
+
+LLM_COALESCED = instrumentation.REGISTRY.counter(
+    'dart_llm_coalesced_total', 'LLM calls answered by an identical call already in flight, by model.')
+LLM_SHED = instrumentation.REGISTRY.counter(
+    'dart_llm_shed_total', 'LLM calls rejected because the model was busy, by model and priority.')
+LLM_QUEUE_WAIT = instrumentation.REGISTRY.histogram(
+    'dart_llm_queue_wait_seconds', 'Time LLM calls spent waiting for a free slot, by model and priority.')
+
+
+# A busy marker this old was left by a process that died mid-generation
+# (and whose pid has since been reused); the markers of exited processes are
+# removed once they are this old.
+_STALE_SECONDS = 600.0
+
+
+def activity_dir() -> str | None:
+    directory = getattr(settings, 'DART_LLM_ACTIVITY_DIR', os.path.join(settings.BASE_DIR, 'llm-activity'))
+    return str(directory) if directory else None
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _other_processes_idle_seconds() -> float | None:
+    """
+    Seconds since another process on this host last had a generation
+    running, 0 while one has, or None if no other process has recorded any.
+    """
+    directory = activity_dir()
+    if not directory or not os.path.isdir(directory):
+        return None
+    idle = None
+    now = time.time()
+    for entry in os.scandir(directory):
+        if not entry.name.isdigit() or int(entry.name) == os.getpid():
+            continue
+        try:
+            with open(entry.path, encoding='utf-8') as handle:
+                busy = handle.read().strip() == '1'
+            seconds = max(now - entry.stat().st_mtime, 0.0)
+        except FileNotFoundError:
+            continue
+        alive = _process_alive(int(entry.name))
+        if not alive and seconds >= _STALE_SECONDS:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            continue
+        if busy and alive and seconds < _STALE_SECONDS:
+            return 0.0
+        idle = seconds if idle is None else min(idle, seconds)
+    return idle
+
+
+class SchedulerBusy(Exception):
+    """Raised when a generation cannot be scheduled in time."""
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'event', 'granted', 'shed')
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.event = threading.Event()
+        self.granted = False
+        self.shed = False
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _ModelSlots:
+    __slots__ = ('limit', 'active', 'waiting')
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting: list[_Waiter] = []
+
+
+class LLMScheduler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: dict[str, _ModelSlots] = {}
+        self._inflight: dict[tuple, Future] = {}
+        self._seq = itertools.count()
+        self._last_active = time.monotonic()
+        self._published_busy = False
+
+    # -- configuration -----------------------------------------------------
+    def limit(self, model: str) -> int:
+        """The number of generations allowed to run at once on `model`."""
+        return self._limit(model)
+
+    def _limit(self, model: str) -> int:
+        limits = getattr(settings, 'DART_LLM_CONCURRENCY', {'default': 1})
+        if isinstance(limits, int):
+            return max(1, limits)
+        return max(1, limits.get(model, limits.get('default', 1)))
+
+    def _max_queue(self) -> int:
+        return getattr(settings, 'DART_LLM_MAX_QUEUE', 8)
+
+    def _max_wait(self) -> float:
+        return getattr(settings, 'DART_LLM_MAX_WAIT', 15.0)
+
+    # -- slots -------------------------------------------------------------
+    def _slots(self, model: str) -> _ModelSlots:
+        slots = self._models.get(model)
+        if slots is None:
+            slots = self._models[model] = _ModelSlots(self._limit(model))
+        return slots
+
+    def _acquire(self, model: str, priority: int) -> None:
+        start = time.perf_counter()
+        with self._lock:
+            slots = self._slots(model)
+            if slots.active < slots.limit and not slots.waiting:
+                slots.active += 1
+                return
+            if len(slots.waiting) >= self._max_queue():
+                # Full queue: shed the least urgent waiter if the newcomer
+                # is more urgent, otherwise shed the newcomer.
+                worst = max(slots.waiting)
+                if worst.priority <= priority:
+                    raise SchedulerBusy(model)
+                slots.waiting.remove(worst)
+                heapq.heapify(slots.waiting)
+                worst.shed = True
+                worst.event.set()
+            waiter = _Waiter(priority, next(self._seq))
+            heapq.heappush(slots.waiting, waiter)
+
+        waiter.event.wait(self._max_wait())
+        with self._lock:
+            if not waiter.granted:
+                if not waiter.shed:
+                    slots.waiting.remove(waiter)
+                    heapq.heapify(slots.waiting)
+                raise SchedulerBusy(model)
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - start, model=model,
+                               priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def _release(self, model: str) -> None:
+        with self._lock:
+            slots = self._slots(model)
+            if slots.waiting:
+                # Hand the slot straight to the most urgent waiter.
+                waiter = heapq.heappop(slots.waiting)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                slots.active -= 1
+
+    def queue_depth(self, model: str | None = None) -> int:
+        """Number of callers running or waiting, for one model or overall."""
+        with self._lock:
+            if model is not None:
+                slots = self._models.get(model)
+                return slots.active + len(slots.waiting) if slots else 0
+            return sum(s.active + len(s.waiting) for s in self._models.values())
+
+    def is_idle(self) -> bool:
+        return self.queue_depth() == 0
+
+    def idle_seconds(self) -> float:
+        """
+        Seconds since the last generation of any process finished, or 0 while
+        any is running or waiting.
+        """
+        if not self.is_idle():
+            return 0.0
+        idle = time.monotonic() - self._last_active
+        others = _other_processes_idle_seconds()
+        return idle if others is None else min(idle, others)
+
+    def _publish_activity(self) -> None:
+        """Record for other processes whether this one is generating; called with the lock held."""
+        directory = activity_dir()
+        if not directory:
+            return
+        busy = bool(self._inflight)
+        if busy and self._published_busy:
+            return
+        path = os.path.join(directory, str(os.getpid()))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as handle:
+                handle.write('1' if busy else '0')
+            os.replace(f'{path}.tmp', path)
+            self._published_busy = busy
+        except OSError as e:
+            logger.warning(f"Could not record LLM activity in {directory}: {e}")
+
+    # -- public API --------------------------------------------------------
+    def run(self, model: str, prompt: str, func, priority: int = INTERACTIVE, key_extra: tuple = ()):
+        """
+        Run `func()` for a generation of `prompt` on `model`, coalescing with
+        an identical in-flight call and respecting the model's concurrency
+        limit.  Raises `SchedulerBusy` when the call is shed.
+        """
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        key = (model, digest) + tuple(key_extra)
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Future()
+                self._publish_activity()
+
+        if not leader:
+            # The leader always resolves the future (with a result, an error
+            # or SchedulerBusy), so followers can simply wait for it.
+            LLM_COALESCED.inc(model=model)
+            return flight.result()
+
+        try:
+            try:
+                self._acquire(model, priority)
+            except SchedulerBusy:
+                LLM_SHED.inc(model=model, priority=PRIORITY_NAMES.get(priority, str(priority)))
+                logger.warning(f"Shedding LLM call for model {model}: the model is busy.")
+                raise
+            try:
+                result = func()
+            finally:
+                self._release(model)
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._last_active = time.monotonic()
+                self._publish_activity()
+
+
+scheduler = LLMScheduler()
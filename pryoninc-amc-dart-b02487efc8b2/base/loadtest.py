@@ -0,0 +1,422 @@
+"""
+End-to-end load testing of a DART deployment.
+
+`manage.py loadtest` simulates a live decision event: N participants log in
+and, with a random think time between actions, open the event page, submit
+ODR comments, upload small CSV exports, open the chat, toggle its filters
+and ask questions.  The number of participants is raised in stages and the
+harness reports, per stage and per endpoint, the throughput and the
+p50/p95/p99 latency, and the stage at which the deployment saturated.
+
+The pieces are:
+
+* `StubOllama`, a small HTTP server speaking the subset of the Ollama API
+  that DART uses (`/api/tags`, `/api/generate`, `/api/embed`, ...).  Each
+  generation takes a configurable time to first token plus the time to
+  "evaluate" the prompt and "generate" the response at the configured
+  token rates, and at most `parallel` generations run at once, like
+  `OLLAMA_NUM_PARALLEL`.  No model is needed, so the results measure DART
+  rather than the GPU.
+* `SimulatedUser`, a cookie-aware HTTP client that logs in through the
+  login form and sends CSRF-protected form posts.  Redirects are not
+  followed, so every sample is the latency of one endpoint.
+* `run_stage`, which runs the participants on threads for a fixed time and
+  collects a `Sample` per request, and `summarise`/`saturation`, which turn
+  the samples into the report.
+
+A stage is saturated when its throughput grew by less than
+`saturation_gain` over the previous stage, its p99 latency exceeded
+`p99_limit`, or more than `max_error_rate` of its requests failed.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import math
+import random
+import socket
+import statistics
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS = (
+    "What were the main communication problems?",
+    "What went well during the exercise?",
+    "Were there any equipment failures?",
+    "What do participants recommend for training?",
+    "How was the coordination between units?",
+    "What slowed the decision process down?",
+)
+WORDS = (
+    'radio', 'network', 'schedule', 'training', 'equipment', 'logistics', 'coordination',
+    'briefing', 'fuel', 'generator', 'convoy', 'medical', 'planning', 'reporting', 'weather',
+)
+SENTIMENTS = ('All', 'Positive', 'Negative', 'Neutral')
+
+
+# -- stub Ollama ------------------------------------------------------------
+
+class StubOllama:
+    """A local stand-in for the Ollama server with configurable latency."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.5,
+                 prompt_tokens_per_second: float = 1000.0, tokens_per_second: float = 40.0,
+                 response_tokens: int = 60, parallel: int = 1,
+                 models: tuple[str, ...] = ('stub-small:latest', 'stub-large:latest')):
+        self.latency = latency
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.models = models
+        self.generations = 0
+        self._slots = threading.BoundedSemaphore(parallel)
+        self._count_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+    def start(self) -> 'StubOllama':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='stub-ollama', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def generate(self, payload: dict) -> dict:
+        prompt = payload.get('prompt') or ''
+        if not prompt:
+            # An empty prompt only loads the model.
+            return {'model': payload.get('model'), 'created_at': _now(), 'response': '', 'done': True,
+                    'done_reason': 'load'}
+        prompt_tokens = max(1, len(prompt) // 4)
+        with self._slots:
+            start = time.perf_counter()
+            prompt_seconds = prompt_tokens / self.prompt_tokens_per_second
+            eval_seconds = self.response_tokens / self.tokens_per_second
+            time.sleep(self.latency + prompt_seconds + eval_seconds)
+            total = time.perf_counter() - start
+        with self._count_lock:
+            self.generations += 1
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+        return {
+            'model': payload.get('model'),
+            'created_at': _now(),
+            'response': f"Stub answer {digest}: " + ' '.join(random.choices(WORDS, k=self.response_tokens // 2)),
+            'done': True,
+            'done_reason': 'stop',
+            'context': list(payload.get('context') or []) + [1] * 8,
+            'total_duration': int(total * 1e9),
+            'load_duration': 0,
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': int(prompt_seconds * 1e9),
+            'eval_count': self.response_tokens,
+            'eval_duration': int(eval_seconds * 1e9),
+        }
+
+    def embed(self, payload: dict) -> dict:
+        inputs = payload.get('input') or payload.get('prompt') or []
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        embeddings = []
+        for text in inputs:
+            seed = hashlib.sha256(text.encode('utf-8')).digest()
+            embeddings.append([(byte - 128) / 128 for byte in seed * 2])
+        return {'model': payload.get('model'), 'embeddings': embeddings}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, body: dict, status: int = 200):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self._reply({'models': [
+                        {'name': name, 'model': name, 'modified_at': _now(), 'size': (i + 1) * 2_000_000_000,
+                         'digest': hashlib.sha256(name.encode()).hexdigest(), 'details': {}}
+                        for i, name in enumerate(stub.models)
+                    ]})
+                elif self.path == '/api/ps':
+                    self._reply({'models': []})
+                elif self.path == '/api/version':
+                    self._reply({'version': 'stub'})
+                else:
+                    self._reply({'error': 'not found'}, 404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if self.path == '/api/generate':
+                    self._reply(stub.generate(payload))
+                elif self.path in ('/api/embed', '/api/embeddings'):
+                    self._reply(stub.embed(payload))
+                elif self.path == '/api/show':
+                    self._reply({'details': {}, 'model_info': {}})
+                else:
+                    self._reply({'error': 'not found'}, 404)
+
+        return Handler
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+# -- simulated participants ---------------------------------------------------
+
+class _NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+@dataclass
+class Sample:
+    endpoint: str
+    started: float
+    seconds: float
+    status: int
+    ok: bool
+
+
+class SimulatedUser:
+    """One participant: a logged-in HTTP session against the DART server."""
+
+    def __init__(self, base_url: str, username: str, password: str, timeout: float = 60.0):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), _NoRedirect)
+
+    def _csrf_token(self) -> str:
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(self, method: str, path: str, fields: dict | None = None,
+                files: dict[str, tuple[str, bytes]] | None = None) -> tuple[int, bytes]:
+        headers = {}
+        data = None
+        if method == 'POST':
+            fields = {**(fields or {}), 'csrfmiddlewaretoken': self._csrf_token()}
+            headers['Referer'] = self.base_url + path
+            if files:
+                data, headers['Content-Type'] = _multipart(fields, files)
+            else:
+                data = urlencode(fields).encode('utf-8')
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except HTTPError as e:
+            # Redirects (not followed) and error statuses both end up here.
+            body = e.read()
+            e.close()
+            return e.code, body
+
+    def login(self) -> None:
+        self.request('GET', '/login/')
+        status, _ = self.request('POST', '/login/', {'username': self.username, 'password': self.password})
+        if status != 302:
+            raise RuntimeError(f"Login failed for {self.username} (HTTP {status}).")
+
+
+def _multipart(fields: dict, files: dict[str, tuple[str, bytes]]) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: text/csv\r\n\r\n'.encode())
+        body.write(content)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+def random_comment(rng: random.Random) -> dict[str, str]:
+    topic, other = rng.sample(WORDS, 2)
+    tone = rng.choice(('worked well', 'was a problem', 'was slow', 'was effective', 'needs review'))
+    return {
+        'observation': f"The {topic} {tone} during phase {rng.randint(1, 5)}.",
+        'discussion': f"Teams reported that {other} affected the {topic} at site {rng.randint(1, 20)}.",
+        'recommendation': f"Review the {topic} procedures before the next exercise.",
+    }
+
+
+def random_csv(rng: random.Random, rows: int) -> bytes:
+    lines = ['observation,discussion,recommendation']
+    for _ in range(rows):
+        comment = random_comment(rng)
+        lines.append(','.join(f'"{comment[key]}"' for key in ('observation', 'discussion', 'recommendation')))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+@dataclass
+class Scenario:
+    """The event under test and the mix of actions participants perform."""
+    event_id: int
+    think_time: float = 2.0
+    csv_rows: int = 20
+    weights: dict[str, int] = field(default_factory=lambda: {
+        'event_page': 20,
+        'submit_comment': 25,
+        'upload_csv': 3,
+        'chat_page': 15,
+        'chat_filter': 10,
+        'chat_question': 27,
+    })
+
+    def perform(self, user: SimulatedUser, action: str, rng: random.Random) -> tuple[str, int]:
+        """Run one action and return its endpoint label and HTTP status."""
+        event_path = f'/event/{self.event_id}/'
+        chat_path = f'/event/{self.event_id}/chat/'
+        if action == 'event_page':
+            return 'GET event', user.request('GET', event_path)[0]
+        if action == 'submit_comment':
+            fields = {'submit-comments': '', **random_comment(rng)}
+            return 'POST event (comment)', user.request('POST', event_path, fields)[0]
+        if action == 'upload_csv':
+            files = {'comments_file': (f'export-{uuid.uuid4().hex[:8]}.csv', random_csv(rng, self.csv_rows))}
+            return 'POST event (upload)', user.request('POST', event_path, {'upload-comments': ''}, files)[0]
+        if action == 'chat_page':
+            return 'GET chat', user.request('GET', chat_path)[0]
+        if action == 'chat_filter':
+            fields = rng.choice((
+                {'sentiment_filter': rng.choice(SENTIMENTS)},
+                {'update-n-results': '', 'selected-n': str(rng.randint(2, 8))},
+                {'search-mode': rng.choice(('fuzzy', 'hybrid'))},
+            ))
+            return 'POST chat (filter)', user.request('POST', chat_path, fields)[0]
+        if action == 'chat_question':
+            return 'POST chat (question)', user.request('POST', chat_path, {'query': rng.choice(QUESTIONS)})[0]
+        raise ValueError(f"Unknown action {action}")
+
+
+def _participant(user: SimulatedUser, scenario: Scenario, deadline: float, samples: list,
+                 lock: threading.Lock, seed: int) -> None:
+    rng = random.Random(seed)
+    actions, weights = zip(*scenario.weights.items())
+    # Stagger the start so participants do not act in lock step.
+    time.sleep(rng.uniform(0, scenario.think_time))
+    while time.monotonic() < deadline:
+        action = rng.choices(actions, weights)[0]
+        started = time.monotonic()
+        try:
+            endpoint, status = scenario.perform(user, action, rng)
+        except (URLError, socket.timeout, ConnectionError, RuntimeError) as e:
+            logger.warning(f"{user.username}: {action} failed: {e}")
+            endpoint, status = action, 0
+        seconds = time.monotonic() - started
+        with lock:
+            samples.append(Sample(endpoint, started, seconds, status, 200 <= status < 400))
+        time.sleep(rng.expovariate(1 / scenario.think_time) if scenario.think_time > 0 else 0)
+
+
+def run_stage(users: list[SimulatedUser], scenario: Scenario, seconds: float, seed: int = 0) -> list[Sample]:
+    """Run `users` against the server for `seconds` and return the samples that started in the stage."""
+    samples: list[Sample] = []
+    lock = threading.Lock()
+    start = time.monotonic()
+    deadline = start + seconds
+    threads = [
+        threading.Thread(target=_participant, args=(user, scenario, deadline, samples, lock, seed + i),
+                         name=f'loadtest-{user.username}', daemon=True)
+        for i, user in enumerate(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+# -- reporting ------------------------------------------------------------------
+
+def percentile(values: list[float], q: float) -> float:
+    """The `q`-th percentile (0-100) of `values` by the nearest-rank method."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(q * len(ordered) / 100)))
+    return ordered[rank - 1]
+
+
+def summarise(samples: list[Sample], seconds: float) -> dict:
+    """Throughput, error rate and latency percentiles, overall and per endpoint."""
+    def stats(group: list[Sample]) -> dict:
+        latencies = [s.seconds for s in group]
+        return {
+            'requests': len(group),
+            'errors': sum(1 for s in group if not s.ok),
+            'throughput': len(group) / seconds if seconds else 0.0,
+            'mean': statistics.fmean(latencies) if latencies else 0.0,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+        }
+    endpoints: dict[str, list[Sample]] = {}
+    for sample in samples:
+        endpoints.setdefault(sample.endpoint, []).append(sample)
+    return {
+        'overall': stats(samples),
+        'endpoints': {name: stats(group) for name, group in sorted(endpoints.items())},
+    }
+
+
+def saturation(stages: list[dict], saturation_gain: float = 0.1, p99_limit: float = 5.0,
+               max_error_rate: float = 0.01) -> dict | None:
+    """
+    The first stage at which the deployment saturated and why, or None.
+    `stages` are ``{'users': n, 'overall': {...}}`` dictionaries in order.
+    """
+    previous = None
+    for stage in stages:
+        overall = stage['overall']
+        error_rate = overall['errors'] / overall['requests'] if overall['requests'] else 1.0
+        if error_rate > max_error_rate:
+            return {'users': stage['users'], 'reason': f"{error_rate:.1%} of requests failed"}
+        if overall['p99'] > p99_limit:
+            return {'users': stage['users'], 'reason': f"p99 latency {overall['p99']:.2f}s exceeded {p99_limit:.2f}s"}
+        if previous is not None and previous['overall']['throughput'] > 0:
+            gain = overall['throughput'] / previous['overall']['throughput'] - 1
+            if gain < saturation_gain:
+                return {'users': stage['users'],
+                        'reason': f"throughput grew only {gain:.0%} from {previous['users']} users",
+                        'last_unsaturated': previous['users']}
+        previous = stage
+    return None
+
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from base.archive import ArchiveError, archive_event, eligible_events, rehydrate_event
+from base.models import Event
+
+
+class Command(BaseCommand):
+    help = "Move the comments and chats of finished events into compressed archive files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-days', type=int, default=None,
+                            help="Archive events that ended more than this many days ago "
+                                 "(default DART_ARCHIVE_GRACE_DAYS).")
+        parser.add_argument('--event', type=int, action='append', dest='events',
+                            help="Archive only this event (may be repeated).")
+        parser.add_argument('--rehydrate', type=int, action='append', default=[],
+                            help="Restore this archived event into the database instead (may be repeated).")
+        parser.add_argument('--dry-run', action='store_true', help="List the events that would be archived.")
+        parser.add_argument('--vacuum', action='store_true',
+                            help="Run VACUUM afterwards so SQLite returns the freed space to the filesystem.")
+
+    def handle(self, *args, **options):
+        if options['rehydrate']:
+            for event in Event.objects.filter(pk__in=options['rehydrate']):
+                restored = rehydrate_event(event)
+                self.stdout.write(f"{event.name}: restored {restored} comments")
+            return
+
+        events = eligible_events(options['grace_days'])
+        if options['events']:
+            events = events.filter(pk__in=options['events'])
+        for event in events.order_by('end_date'):
+            if options['dry_run']:
+                self.stdout.write(f"Would archive {event.name} (ended {event.end_date})")
+                continue
+            try:
+                result = archive_event(event)
+            except ArchiveError as e:
+                raise CommandError(str(e))
+            self.stdout.write(
+                f"{event.name}: {result['comments']} comments, {result['chats']} chats, "
+                f"{result['raw_bytes']} bytes -> {result['bytes']} bytes"
+            )
+        if options['vacuum'] and not options['dry_run'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+        self.stdout.write(self.style.SUCCESS("Archival complete."))
@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from base.ingest import ingest_files
+from base.models import Event
+
+
+class Command(BaseCommand):
+    help = "Import comments for an event from CSV, JSON Lines, JSON, XLSX or zip files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_id', type=int, help="The event to import comments into.")
+        parser.add_argument('paths', nargs='+', help="Files to import.")
+        parser.add_argument('--user', required=True, help="Username recorded as the author of the comments.")
+
+    def handle(self, *args, **options):
+        try:
+            event = Event.objects.get(pk=options['event_id'])
+            user = User.objects.get(username=options['user'])
+        except (Event.DoesNotExist, User.DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        def progress(report):
+            self.stdout.write(f"{report.rows} rows written ({report.rows_per_second:.0f} rows/s)")
+
+        report = ingest_files(event, user, options['paths'], progress=progress)
+        for error in report.errors:
+            self.stderr.write(f"Skipped {error}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.rows} comments from {report.files} files in {report.seconds:.1f}s "
+            f"({report.rows_per_second:.0f} rows/s, {report.skipped} empty records skipped)."
+        ))
+        if report.duplicate_files or report.duplicate_rows or report.resumed_files:
+            self.stdout.write(
+                f"{report.duplicate_files} files and {report.duplicate_rows} rows had already been imported; "
+                f"{report.resumed_files} files resumed an earlier import."
+            )
@@ -0,0 +1,134 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from base import model_registry
+
+
+class Command(BaseCommand):
+    help = "List, verify and tidy the local models catalogued in llm/manifest.json."
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help="Limit to these models (default: all).")
+        parser.add_argument('--scan', action='store_true',
+                            help="Rebuild the manifest from the llm/models directory.")
+        parser.add_argument('--verify', action='store_true',
+                            help="Check every weight file against its SHA-256, without network access.")
+        parser.add_argument('--prune', action='store_true',
+                            help="Delete weight files in other formats once the safetensors weights verify.")
+        parser.add_argument('--dry-run', action='store_true', help="With --prune, only list what would be deleted.")
+        parser.add_argument('--convert', action='store_true',
+                            help="Write model.safetensors from pytorch_model.bin (needs torch and safetensors).")
+        parser.add_argument('--download', metavar='REPO_ID',
+                            help="Download a model from the Hugging Face hub (needs huggingface_hub and "
+                                 "network access) and add it to the manifest.")
+
+    def handle(self, *args, **options):
+        if options['download']:
+            self._download(options['download'])
+            options['scan'] = True
+        if options['scan']:
+            models = model_registry.scan(model_registry.load_manifest())
+            model_registry.save_manifest(models)
+            self.stdout.write(f"Catalogued {len(models)} models in {model_registry.manifest_path()}.")
+        models = model_registry.load_manifest()
+        if options['models']:
+            unknown = set(options['models']) - set(models)
+            if unknown:
+                raise CommandError(f"Unknown models: {', '.join(sorted(unknown))}.")
+            models = {name: models[name] for name in options['models']}
+
+        if options['convert']:
+            for model in models.values():
+                self._convert(model)
+            models = {name: model_registry.get_model(name) for name in models}
+        if options['verify'] or options['prune']:
+            self._verify(models.values(), prune=options['prune'], dry_run=options['dry_run'])
+        else:
+            self._list(models.values())
+
+    def _list(self, models):
+        for model in models:
+            self.stdout.write(self.style.MIGRATE_HEADING(model.name))
+            self.stdout.write(f"  repository: {model.repo_id or '-'}  task: {model.task or '-'}  "
+                              f"architecture: {model.architecture or '-'}")
+            preferred = model.weights()
+            for model_file in model.files:
+                path = model_registry.resolve(os.path.join(model.directory, model_file.path))
+                size = f"{model_file.size / 1e6:.1f} MB" if model_file.size else "size unknown"
+                state = 'present' if path else 'not fetched'
+                marker = ' (loaded)' if model_file is preferred else (' (redundant)' if preferred else '')
+                self.stdout.write(f"  {model_file.format:<12} {model_file.path:<20} {size:<14} {state}{marker}")
+            if preferred is None and model.files:
+                self.stdout.write(self.style.WARNING("  no safetensors weights; convert with --convert"))
+
+    def _verify(self, models, prune: bool, dry_run: bool):
+        failed = False
+        for model in models:
+            results = model_registry.verify(model)
+            for model_file, status in results:
+                style = self.style.SUCCESS if status == 'ok' else self.style.ERROR
+                self.stdout.write(f"{model.name}/{model_file.path}: {style(status)}")
+                failed = failed or status == 'mismatch'
+            preferred = model.weights()
+            if not prune or preferred is None:
+                continue
+            if dict((f.path, s) for f, s in results).get(preferred.path) != 'ok':
+                self.stdout.write(self.style.WARNING(
+                    f"{model.name}: not pruning, the safetensors weights did not verify."
+                ))
+                continue
+            for model_file in model.redundant():
+                path = os.path.join(model.directory, model_file.path)
+                if dry_run:
+                    self.stdout.write(f"Would delete {path}")
+                    continue
+                os.remove(path)
+                model.files.remove(model_file)
+                self.stdout.write(f"Deleted {path}")
+            if not dry_run:
+                manifest = model_registry.load_manifest()
+                manifest[model.name] = model
+                model_registry.save_manifest(manifest)
+        if failed:
+            raise CommandError("Some weight files do not match their recorded checksums.")
+
+    def _convert(self, model):
+        if model.weights() is not None:
+            self.stdout.write(f"{model.name} already has safetensors weights.")
+            return
+        source = model.weights('pytorch')
+        path = model_registry.resolve(os.path.join(model.directory, source.path)) if source else None
+        if path is None:
+            raise CommandError(f"{model.name} has no fetched pytorch_model.bin to convert.")
+        try:
+            import torch
+            from safetensors.torch import save_file
+        except ImportError:
+            raise CommandError("Converting weights needs the torch and safetensors packages.")
+        state_dict = torch.load(path, map_location='cpu', weights_only=True)
+        # safetensors refuses tensors that share storage (tied weights).
+        state_dict = {name: tensor.contiguous().clone() for name, tensor in state_dict.items()}
+        save_file(state_dict, os.path.join(model.directory, 'model.safetensors'), metadata={'format': 'pt'})
+        manifest = model_registry.load_manifest()
+        model_registry.save_manifest(model_registry.scan(manifest))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {model.name}/model.safetensors."))
+
+    def _download(self, repo_id: str):
+        try:
+            from huggingface_hub import snapshot_download
+        except ImportError:
+            raise CommandError("Downloading models needs the huggingface_hub package.")
+        local_dir = os.path.join(model_registry.models_dir(), repo_id.split('/')[-1])
+        # Prefer safetensors; the other formats only duplicate the weights.
+        snapshot_download(repo_id=repo_id, local_dir=local_dir,
+                          ignore_patterns=['*.bin', '*.h5', '*.ot', '*.msgpack'])
+        name = os.path.basename(local_dir)
+        manifest = model_registry.scan(model_registry.load_manifest())
+        if not manifest[name].files:
+            # No safetensors in the repository; fetch the PyTorch weights to convert.
+            snapshot_download(repo_id=repo_id, local_dir=local_dir, allow_patterns=['pytorch_model.bin'])
+            manifest = model_registry.scan(manifest)
+        manifest[name].repo_id = repo_id
+        model_registry.save_manifest(manifest)
+        self.stdout.write(self.style.SUCCESS(f"Downloaded {repo_id} to {local_dir}."))
@@ -0,0 +1,236 @@
+import itertools
+import json
+import os
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from base import loadtest
+from base.models import Chat, Comment, Event, batched_comment_versions
+
+USER_PREFIX = 'loadtest-'
+
+
+class Command(BaseCommand):
+    help = ("Simulate a live event: N participants submit comments, upload CSVs, use the chat and ask "
+            "questions, in stages of increasing N, against a stub Ollama.  Reports throughput, "
+            "p50/p95/p99 latency per endpoint and the saturation point.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', default='5,10,20,40',
+                            help="Comma-separated participant counts, one stage each (default 5,10,20,40).")
+        parser.add_argument('--stage-seconds', type=float, default=30.0, help="Length of each stage.")
+        parser.add_argument('--think-time', type=float, default=2.0,
+                            help="Mean pause between a participant's actions, in seconds.")
+        parser.add_argument('--url', help="Test this running server instead of starting one.  It must "
+                                          "reach the stub Ollama (see --ollama-port) or a real one.")
+        parser.add_argument('--server', choices=('runserver', 'gunicorn'), default='runserver',
+                            help="How to start the server under test (default runserver).")
+        parser.add_argument('--port', type=int, default=8765, help="Port of the server under test.")
+        parser.add_argument('--event', type=int,
+                            help="Seed the load-test event with a copy of this event's comments.  The "
+                                 "event itself is not touched.")
+        parser.add_argument('--seed-comments', type=int, default=1000,
+                            help="Random comments to seed the load-test event with, unless --event is given.")
+        parser.add_argument('--no-summarize', action='store_true',
+                            help="Leave chat summarisation off, so questions do not call the LLM.")
+        parser.add_argument('--no-stub', action='store_true', help="Use the real Ollama instead of the stub.")
+        parser.add_argument('--ollama-port', type=int, default=0, help="Port of the stub Ollama (default: any).")
+        parser.add_argument('--llm-latency', type=float, default=0.5,
+                            help="Stub time to first token, in seconds.")
+        parser.add_argument('--llm-tokens-per-second', type=float, default=40.0, help="Stub generation speed.")
+        parser.add_argument('--llm-prompt-tokens-per-second', type=float, default=1000.0,
+                            help="Stub prompt evaluation speed.")
+        parser.add_argument('--llm-response-tokens', type=int, default=60, help="Tokens per stub answer.")
+        parser.add_argument('--llm-parallel', type=int, default=1,
+                            help="Generations the stub runs at once, like OLLAMA_NUM_PARALLEL.")
+        parser.add_argument('--p99-limit', type=float, default=5.0,
+                            help="A stage whose p99 latency exceeds this many seconds is saturated.")
+        parser.add_argument('--saturation-gain', type=float, default=0.1,
+                            help="A stage whose throughput grew by less than this fraction is saturated.")
+        parser.add_argument('--json', metavar='PATH', help="Also write the results to this JSON file.")
+        parser.add_argument('--keep', action='store_true', help="Keep the load-test users and event afterwards.")
+
+    def handle(self, *args, **options):
+        try:
+            stages = [int(n) for n in options['users'].split(',') if n.strip()]
+        except ValueError:
+            raise CommandError("--users must be a comma-separated list of numbers.")
+        if not stages or min(stages) < 1:
+            raise CommandError("--users needs at least one positive participant count.")
+
+        stub = None
+        if not options['no_stub']:
+            stub = loadtest.StubOllama(
+                port=options['ollama_port'],
+                latency=options['llm_latency'],
+                tokens_per_second=options['llm_tokens_per_second'],
+                prompt_tokens_per_second=options['llm_prompt_tokens_per_second'],
+                response_tokens=options['llm_response_tokens'],
+                parallel=options['llm_parallel'],
+            ).start()
+            self.stdout.write(f"Stub Ollama listening on {stub.address}.")
+
+        password = secrets.token_urlsafe(16)
+        usernames = self._create_users(max(stages), password)
+        event = self._prepare_event(options, usernames)
+        server = log = None
+        try:
+            if options['url']:
+                base_url = options['url']
+            else:
+                base_url = f"http://127.0.0.1:{options['port']}"
+                server, log = self._start_server(options, stub)
+                self._wait_for(base_url, server, log)
+            self.stdout.write(f"Testing {base_url}, event {event.id} ({event.name}).")
+
+            participants = []
+            for username in usernames:
+                user = loadtest.SimulatedUser(base_url, username, password)
+                user.login()
+                participants.append(user)
+
+            scenario = loadtest.Scenario(event_id=event.id, think_time=options['think_time'])
+            results = []
+            for n in stages:
+                self.stdout.write(self.style.MIGRATE_HEADING(
+                    f"Stage: {n} participants for {options['stage_seconds']:.0f}s"
+                ))
+                samples = loadtest.run_stage(participants[:n], scenario, options['stage_seconds'], seed=n)
+                summary = loadtest.summarise(samples, options['stage_seconds'])
+                results.append({'users': n, **summary})
+                self._print_stage(summary)
+
+            saturated = loadtest.saturation(results, options['saturation_gain'], options['p99_limit'])
+            if saturated is None:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Not saturated: {stages[-1]} participants were served within the limits."
+                ))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"Saturated at {saturated['users']} participants: {saturated['reason']}."
+                ))
+            if stub is not None:
+                self.stdout.write(f"The stub Ollama served {stub.generations} generations.")
+            if options['json']:
+                with open(options['json'], 'w', encoding='utf-8') as handle:
+                    json.dump({'stages': results, 'saturation': saturated}, handle, indent=2)
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+                log.close()
+            if stub is not None:
+                stub.stop()
+            if not options['keep']:
+                self._clean_up(event)
+
+    def _create_users(self, count: int, password: str) -> list[str]:
+        # Hash once: the same password for every participant keeps set-up quick.
+        hashed = make_password(password)
+        usernames = [f'{USER_PREFIX}{i}' for i in range(count)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        User.objects.filter(username__in=existing).update(password=hashed)
+        User.objects.bulk_create([User(username=name, password=hashed) for name in usernames if name not in existing])
+        return usernames
+
+    def _prepare_event(self, options, usernames):
+        users = list(User.objects.filter(username__in=usernames))
+        source = None
+        if options['event']:
+            try:
+                source = Event.objects.get(pk=options['event'])
+            except Event.DoesNotExist:
+                raise CommandError(f"Event {options['event']} does not exist.")
+            if source.archived_at is not None:
+                raise CommandError(f"Event {source.id} is archived; restore it first.")
+        # Participants post comments and chat into the event, so they always
+        # get one of their own, deleted afterwards.
+        name = f"Load test {time.strftime('%Y-%m-%d %H:%M')}"
+        event = Event.objects.create(
+            user=users[0], name=f"{name} (copy of {source.name})" if source else name,
+            start_date=date.today(), end_date=date.today() + timedelta(days=1),
+            vectordb_collection_key=Event()._generate_key(),
+        )
+        event._create_collection()
+        rng = random.Random(0)
+        if source is not None:
+            comments = (
+                Comment(user=rng.choice(users), event=event, **values)
+                for values in Comment.objects.filter(event=source)
+                .values('observation', 'discussion', 'recommendation', 'fingerprint').iterator()
+            )
+        else:
+            comments = (
+                Comment(user=rng.choice(users), event=event, **loadtest.random_comment(rng))
+                for _ in range(options['seed_comments'])
+            )
+        while batch := list(itertools.islice(comments, 500)):
+            Comment.objects.bulk_create(batch)
+        Event.bump_comments_version(event.id)
+        event.invitees.add(*users)
+        # `_create_collection` made the event's one chat; a second would make
+        # the chat page fail with MultipleObjectsReturned.
+        Chat.objects.filter(event=event).update(query_dict={'summarize': not options['no_summarize']})
+        return event
+
+    def _start_server(self, options, stub):
+        env = dict(os.environ)
+        if stub is not None:
+            env['OLLAMA_HOST'] = stub.address
+        bind = f"127.0.0.1:{options['port']}"
+        if options['server'] == 'gunicorn':
+            if shutil.which('gunicorn') is None:
+                raise CommandError("gunicorn is not installed (pip install gunicorn).")
+            env['DART_BIND'] = bind
+            command = ['gunicorn']
+        else:
+            command = [sys.executable, 'manage.py', 'runserver', '--noreload', bind]
+        log = tempfile.NamedTemporaryFile('w+', prefix='dart-loadtest-', suffix='.log', delete=False)
+        self.stdout.write(f"Starting {' '.join(command)} (log: {log.name}).")
+        server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        return server, log
+
+    def _wait_for(self, base_url: str, server, log, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                log.seek(0)
+                raise CommandError(f"The server exited during start-up:\n{log.read()[-2000:]}")
+            try:
+                with urlopen(f'{base_url}/login/', timeout=2):
+                    return
+            except (URLError, ConnectionError, OSError):
+                time.sleep(0.5)
+        raise CommandError(f"The server did not answer within {timeout:.0f}s.")
+
+    def _print_stage(self, summary: dict) -> None:
+        overall = summary['overall']
+        self.stdout.write(f"  {'endpoint':<24}{'requests':>9}{'req/s':>8}{'errors':>8}"
+                          f"{'p50':>9}{'p95':>9}{'p99':>9}")
+        rows = list(summary['endpoints'].items()) + [('all', overall)]
+        for name, stats in rows:
+            self.stdout.write(
+                f"  {name:<24}{stats['requests']:>9}{stats['throughput']:>8.1f}{stats['errors']:>8}"
+                f"{stats['p50']:>8.3f}s{stats['p95']:>8.3f}s{stats['p99']:>8.3f}s"
+            )
+
+    def _clean_up(self, event) -> None:
+        with batched_comment_versions():
+            event.delete()
+            User.objects.filter(username__startswith=USER_PREFIX).delete()
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from base import precompute
+from base.ollama_client import OllamaClient
+
+
+class Command(BaseCommand):
+    help = "Generate the summaries and standard answers of active events that are missing or out of date."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', dest='events',
+                            help="Only this event (may be repeated; default: all active events).")
+        parser.add_argument('--dry-run', action='store_true', help="List what would be generated.")
+        parser.add_argument('--force', action='store_true',
+                            help="Regenerate stale items even if they were generated recently "
+                                 "(DART_PRECOMPUTE_MIN_AGE).")
+
+    def handle(self, *args, **options):
+        precompute.prune_questions()
+        work = precompute.pending_work(options['events'], force=options['force'])
+        if options['dry_run']:
+            for event_id, kind, key in work:
+                self.stdout.write(f"Would generate {kind} '{key}' for event {event_id}")
+            return
+        client = OllamaClient()
+        if work and (not client.client or not client.models):
+            raise CommandError("Ollama is not available; nothing was generated.")
+        generated = 0
+        for event_id, kind, key in work:
+            row = precompute.compute(event_id, kind, key, client)
+            if row is None:
+                self.stdout.write(self.style.WARNING(f"Event {event_id}: no {kind} '{key}' was generated."))
+                continue
+            generated += 1
+            self.stdout.write(f"Event {event_id}: {kind} '{key}' in {row.generation_seconds:.1f}s")
+        self.stdout.write(self.style.SUCCESS(f"Generated {generated} of {len(work)} items."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from base.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = "Load heavy dependencies, build search indexes for active events and preload the default LLM."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-indexes', action='store_true', help="Do not build search indexes.")
+        parser.add_argument('--skip-llm', action='store_true', help="Do not ask Ollama to load the default model.")
+
+    def handle(self, *args, **options):
+        report = warm_up(indexes=not options['skip_indexes'], llm=not options['skip_llm'])
+        for key, value in report.items():
+            if isinstance(value, float):
+                value = f"{value:.3f}s"
+            self.stdout.write(f"{key}: {value}")
+        self.stdout.write(self.style.SUCCESS("Warm-up complete."))
@@ -0,0 +1,92 @@
+"""
+Middleware for the DART application.
+
+``PerformanceMiddleware`` wraps every request in an instrumentation scope
+(see ``base/instrumentation.py``).  It counts and times the database queries
+issued while the request is handled, records request level metrics for the
+``/metrics`` endpoint and reports the collected phase timings to the browser
+in a ``Server-Timing`` header so they show up in the developer tools.
+
+A sampling profiler can be switched on for a single request by adding
+``?profile=1`` to the URL (or sending an ``X-DART-Profile: 1`` header).  This
+is only honoured for staff users and when ``DART_PROFILING_ENABLED`` is set;
+the folded stacks are written to ``DART_PROFILE_DIR``.
+"""
+
+import logging
+import os
+import time
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _query_timer(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            instrumentation.record('db', time.perf_counter() - start, observe=False)
+
+    def __call__(self, request):
+        timings, token = instrumentation.start_request()
+        request._dart_profiler = None
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self._query_timer))
+                response = self.get_response(request)
+        finally:
+            profiler = request._dart_profiler
+            if profiler is not None:
+                profiler.stop()
+            instrumentation.end_request(token)
+
+        view = getattr(getattr(request, 'resolver_match', None), 'url_name', None) or 'unresolved'
+        elapsed = time.perf_counter() - timings.started
+        queries = timings.counts.get('db', 0)
+        instrumentation.HTTP_REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        instrumentation.HTTP_DURATION.observe(elapsed, view=view)
+        instrumentation.DB_QUERIES.inc(queries, view=view)
+        instrumentation.DB_QUERIES_PER_REQUEST.observe(queries, view=view)
+        if queries:
+            instrumentation.PHASE_DURATION.observe(timings.spans['db'], phase='db')
+        response['Server-Timing'] = timings.server_timing()
+
+        if profiler is not None:
+            path = self._write_profile(profiler, view)
+            if path:
+                response['X-DART-Profile'] = path.name
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(settings, 'DART_PROFILING_ENABLED', False):
+            return None
+        wanted = request.GET.get('profile') == '1' or request.headers.get('X-DART-Profile') == '1'
+        user = getattr(request, 'user', None)
+        if wanted and user is not None and user.is_staff:
+            interval = getattr(settings, 'DART_PROFILING_INTERVAL', 0.005)
+            request._dart_profiler = instrumentation.SamplingProfiler(interval=interval).start()
+        return None
+
+    def _write_profile(self, profiler, view: str) -> Path | None:
+        try:
+            directory = Path(getattr(settings, 'DART_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+            os.makedirs(directory, exist_ok=True)
+            path = directory / f'{time.strftime("%Y%m%d-%H%M%S")}-{view}-{os.getpid()}.folded'
+            path.write_text(profiler.folded())
+            logger.info(f"Wrote sampling profile for view {view} to {path}")
+            return path
+        except Exception as e:
+            logger.error(f"Failed to write sampling profile: {e}")
+            return None
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_event_archived_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='comments_rewrites',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='comments_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_event_comments_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('summary', 'Summary'), ('question', 'Question')], max_length=10)),
+                ('key', models.CharField(max_length=255)),
+                ('text', models.TextField()),
+                ('text_html', models.TextField(blank=True, default='')),
+                ('sources', models.JSONField(blank=True, default=list)),
+                ('model_name', models.CharField(blank=True, default='', max_length=100)),
+                ('comments_stamp', models.CharField(max_length=64)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+                ('generation_seconds', models.FloatField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_answers', to='base.event')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='precomputedanswer',
+            constraint=models.UniqueConstraint(fields=('event', 'kind', 'key'), name='unique_precomputed_answer'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_precomputed_answer'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='commentupload',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('complete', 'Complete'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def drop_comment_texts(apps, schema_editor):
+    # Sources keep the comment id and best passage; the full comment text
+    # was stored as well and is not shown anywhere.
+    PrecomputedAnswer = apps.get_model('base', 'PrecomputedAnswer')
+    for answer in PrecomputedAnswer.objects.exclude(sources=[]).only('sources'):
+        sources = [{k: v for k, v in source.items() if k != 'text'} for source in answer.sources]
+        if sources != answer.sources:
+            answer.sources = sources
+            answer.save(update_fields=['sources'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_commentupload_running'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_comment_texts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,384 @@
+"""
+Registry of the model weights kept under `llm/models`.
+
+Models fetched from the Hugging Face hub arrive with the same weights in up
+to four formats (`pytorch_model.bin`, `tf_model.h5`, `rust_model.ot` and
+`model.safetensors`), and nothing told the application which one to load.
+`llm/manifest.json` catalogues every local model instead: its hub repository,
+task and architecture, and for each weight file its format, size and SHA-256.
+
+* `manage.py llm_models` lists the catalogue, rebuilds it from the
+  directory (`--scan`), verifies the checksums without any network access
+  (`--verify`) and deletes weight copies made redundant by a verified
+  safetensors file (`--prune`).
+* Weights are loaded through `open_weights`, which only reads safetensors
+  files.  The file is memory-mapped and tensors are returned as read-only
+  views of the mapped pages (NumPy arrays when NumPy is installed), so
+  nothing is unpickled or copied: the cold load reads only the JSON header,
+  pages are faulted in as tensors are used, and every worker process maps
+  the same pages from the operating system's page cache.  Models listed in
+  `DART_LLM_PRELOAD_WEIGHTS` are mapped during warm-up, before gunicorn
+  forks its workers.
+
+Checkouts sometimes contain Hugging Face cache pointers instead of weights:
+small text files holding the relative path of a blob under
+``~/.cache/huggingface/hub`` whose name is the SHA-256 of the weights.  The
+registry follows such a pointer when the blob exists and otherwise reports
+the weights as not fetched, keeping the digest from the pointer so a later
+download can be verified.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from dataclasses import asdict, dataclass, field
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+WEIGHT_FORMATS = {
+    'model.safetensors': 'safetensors',
+    'pytorch_model.bin': 'pytorch',
+    'tf_model.h5': 'tensorflow',
+    'rust_model.ot': 'rust',
+    'flax_model.msgpack': 'flax',
+}
+SAFETENSORS = 'safetensors'
+_POINTER_RE = re.compile(r'^(?:\.\./)*\.cache/huggingface/hub/models--(?P<repo>[^/]+)/blobs/(?P<digest>[0-9a-f]{64})$')
+_POINTER_MAX_BYTES = 1024
+
+
+class RegistryError(Exception):
+    """Raised when a model is unknown or its weights cannot be loaded."""
+
+
+def llm_dir() -> str:
+    return str(getattr(settings, 'DART_LLM_DIR', os.path.join(settings.BASE_DIR, 'llm')))
+
+
+def models_dir() -> str:
+    return os.path.join(llm_dir(), 'models')
+
+
+def manifest_path() -> str:
+    return os.path.join(llm_dir(), 'manifest.json')
+
+
+@dataclass
+class ModelFile:
+    path: str
+    format: str
+    sha256: str
+    size: int | None = None
+
+
+@dataclass
+class LocalModel:
+    name: str
+    repo_id: str | None = None
+    task: str | None = None
+    architecture: str | None = None
+    files: list[ModelFile] = field(default_factory=list)
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(models_dir(), self.name)
+
+    def weights(self, fmt: str | None = None) -> ModelFile | None:
+        """The weight file in `fmt`, by default the preferred (safetensors) one."""
+        for model_file in self.files:
+            if model_file.format == (fmt or SAFETENSORS):
+                return model_file
+        return None
+
+    def redundant(self) -> list[ModelFile]:
+        """Weight files in other formats, made redundant by a safetensors file."""
+        if self.weights() is None:
+            return []
+        return [model_file for model_file in self.files if model_file.format != SAFETENSORS]
+
+
+# -- files ---------------------------------------------------------------
+
+def read_pointer(path: str) -> dict | None:
+    """The repository and digest of a Hugging Face cache pointer, or None for real files."""
+    if os.path.islink(path) or os.path.getsize(path) > _POINTER_MAX_BYTES:
+        return None
+    with open(path, 'rb') as handle:
+        content = handle.read().strip()
+    match = _POINTER_RE.match(content.decode('utf-8', 'replace'))
+    if match is None:
+        return None
+    return {
+        'repo_id': match['repo'].replace('--', '/'),
+        'digest': match['digest'],
+        'target': os.path.normpath(os.path.join(os.path.dirname(path), content.decode('utf-8'))),
+    }
+
+
+def resolve(path: str) -> str | None:
+    """The file holding the weights for `path`, or None if they were never fetched."""
+    if not os.path.exists(path):
+        return None
+    pointer = read_pointer(path)
+    if pointer is None:
+        return path
+    return pointer['target'] if os.path.exists(pointer['target']) else None
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        while chunk := handle.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# -- manifest ------------------------------------------------------------
+
+def load_manifest() -> dict[str, LocalModel]:
+    try:
+        with open(manifest_path(), encoding='utf-8') as handle:
+            data = json.load(handle)
+    except FileNotFoundError:
+        return {}
+    models = {}
+    for entry in data.get('models', []):
+        files = [ModelFile(**model_file) for model_file in entry.pop('files', [])]
+        models[entry['name']] = LocalModel(files=files, **entry)
+    return models
+
+
+def save_manifest(models: dict[str, LocalModel]) -> None:
+    data = {'models': [asdict(model) for _, model in sorted(models.items())]}
+    tmp_path = f'{manifest_path()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as handle:
+        json.dump(data, handle, indent=2)
+        handle.write('\n')
+    os.replace(tmp_path, manifest_path())
+
+
+def get_model(name: str) -> LocalModel:
+    try:
+        return load_manifest()[name]
+    except KeyError:
+        raise RegistryError(f"Model {name!r} is not in {manifest_path()}; run `manage.py llm_models --scan`.")
+
+
+def _infer_task(directory: str, architecture: str | None) -> str | None:
+    try:
+        with open(os.path.join(directory, 'README.md'), encoding='utf-8') as handle:
+            readme = handle.read()
+    except OSError:
+        readme = ''
+    # The model card's YAML front matter sits between the first two '---' lines.
+    front_matter = readme.split('---')[1] if readme.startswith('---') and readme.count('---') >= 2 else ''
+    match = re.search(r'^pipeline_tag:\s*(\S+)', front_matter, re.M)
+    if match:
+        return match[1]
+    if 'library_name: sentence-transformers' in front_matter:
+        return 'sentence-similarity'
+    if 'sentiment-analysis' in front_matter or (architecture or '').endswith('ForSequenceClassification'):
+        return 'text-classification'
+    if (architecture or '').endswith('ForConditionalGeneration'):
+        return 'text2text-generation'
+    return 'feature-extraction' if architecture else None
+
+
+def scan(known: dict[str, LocalModel] | None = None) -> dict[str, LocalModel]:
+    """
+    Catalogue every model directory under `llm/models`.  Repository ids and
+    tasks already in `known` are kept; checksums are recomputed from the
+    files (or taken from their cache pointers).
+    """
+    known = known or {}
+    models = {}
+    root = models_dir()
+    for name in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        directory = os.path.join(root, name)
+        if not os.path.isdir(directory):
+            continue
+        architecture = None
+        try:
+            with open(os.path.join(directory, 'config.json'), encoding='utf-8') as handle:
+                architecture = (json.load(handle).get('architectures') or [None])[0]
+        except (OSError, ValueError):
+            pass
+        previous = known.get(name)
+        model = LocalModel(
+            name=name,
+            repo_id=previous.repo_id if previous else None,
+            task=(previous.task if previous else None) or _infer_task(directory, architecture),
+            architecture=architecture,
+        )
+        for filename, fmt in WEIGHT_FORMATS.items():
+            path = os.path.join(directory, filename)
+            if not os.path.exists(path):
+                continue
+            pointer = read_pointer(path)
+            if pointer is not None:
+                model.repo_id = model.repo_id or pointer['repo_id']
+                target = resolve(path)
+                model.files.append(ModelFile(
+                    filename, fmt, pointer['digest'], os.path.getsize(target) if target else None,
+                ))
+            else:
+                model.files.append(ModelFile(filename, fmt, sha256_file(path), os.path.getsize(path)))
+        models[name] = model
+    return models
+
+
+def verify(model: LocalModel) -> list[tuple[ModelFile, str]]:
+    """
+    Check each weight file against its recorded SHA-256, offline.  Statuses
+    are ``ok``, ``mismatch`` and ``not fetched`` (a cache pointer whose blob
+    is missing, or a missing file).
+    """
+    results = []
+    for model_file in model.files:
+        path = resolve(os.path.join(model.directory, model_file.path))
+        if path is None:
+            results.append((model_file, 'not fetched'))
+        elif sha256_file(path) != model_file.sha256:
+            results.append((model_file, 'mismatch'))
+        else:
+            results.append((model_file, 'ok'))
+    return results
+
+
+# -- loading -------------------------------------------------------------
+
+# Safetensors dtypes and the `memoryview` formats of their elements.  Half
+# precision floats have no memoryview format; they are exposed as raw 16-bit
+# words (NumPy reads F16 natively).
+_DTYPES = {
+    'F64': 'd', 'F32': 'f', 'F16': 'H', 'BF16': 'H',
+    'I64': 'q', 'I32': 'i', 'I16': 'h', 'I8': 'b', 'U8': 'B', 'BOOL': '?',
+}
+_NUMPY_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'uint16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool',
+}
+_HEADER_LENGTH = struct.Struct('<Q')
+
+
+class SafetensorsFile:
+    """
+    A memory-mapped safetensors file.  Only the JSON header is parsed when
+    the file is opened; tensors are views of the mapping.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER_LENGTH.size:
+            raise RegistryError(f"{path} is not a safetensors file.")
+        (header_length,) = _HEADER_LENGTH.unpack_from(self._mmap)
+        start = _HEADER_LENGTH.size
+        try:
+            header = json.loads(self._mmap[start:start + header_length])
+        except ValueError as e:
+            raise RegistryError(f"{path} has an unreadable safetensors header: {e}")
+        self.metadata = header.pop('__metadata__', {}) or {}
+        self._tensors = header
+        self._data_start = start + header_length
+        self._view = memoryview(self._mmap)
+
+    def keys(self) -> list[str]:
+        return list(self._tensors)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tensors
+
+    def __len__(self) -> int:
+        return len(self._tensors)
+
+    def info(self, name: str) -> dict:
+        """The dtype and shape of a tensor."""
+        entry = self._tensors[name]
+        return {'dtype': entry['dtype'], 'shape': entry['shape']}
+
+    def tensor(self, name: str):
+        """
+        A read-only view of a tensor: a NumPy array of its shape when NumPy
+        is installed, otherwise a flat `memoryview`.
+        """
+        try:
+            entry = self._tensors[name]
+        except KeyError:
+            raise RegistryError(f"{self.path} has no tensor {name!r}.")
+        begin, end = entry['data_offsets']
+        raw = self._view[self._data_start + begin:self._data_start + end]
+        dtype = entry['dtype']
+        if dtype not in _DTYPES:
+            return raw
+        if np is not None:
+            return np.frombuffer(raw, dtype=_NUMPY_DTYPES[dtype]).reshape(entry['shape'])
+        return raw.cast(_DTYPES[dtype])
+
+    __getitem__ = tensor
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mmap) - self._data_start
+
+    def advise_willneed(self) -> None:
+        """Ask the kernel to read the whole file ahead, where supported."""
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self._mmap.madvise(mmap.MADV_WILLNEED)
+
+
+_open_files: dict[str, SafetensorsFile] = {}
+_open_lock = threading.Lock()
+
+
+def open_weights(name: str) -> SafetensorsFile:
+    """
+    Map the safetensors weights of the registered model `name`, once per
+    process.  Raises `RegistryError` if the model has no safetensors weights
+    or they have not been fetched.
+    """
+    with _open_lock:
+        weights = _open_files.get(name)
+    if weights is not None:
+        return weights
+    model = get_model(name)
+    model_file = model.weights()
+    if model_file is None:
+        formats = ', '.join(f.format for f in model.files) or 'none'
+        raise RegistryError(
+            f"Model {name!r} has no safetensors weights (available: {formats}); "
+            f"run `manage.py llm_models --convert {name}`."
+        )
+    path = resolve(os.path.join(model.directory, model_file.path))
+    if path is None:
+        raise RegistryError(f"The weights of {name!r} have not been fetched; run `manage.py llm_models --download`.")
+    weights = SafetensorsFile(path)
+    with _open_lock:
+        weights = _open_files.setdefault(name, weights)
+    logger.info(f"Mapped {weights.nbytes} bytes of {name} weights ({len(weights)} tensors) from {path}.")
+    return weights
+
+
+def preload_weights() -> list[str]:
+    """Map the models in `DART_LLM_PRELOAD_WEIGHTS`, e.g. in the gunicorn master before it forks."""
+    loaded = []
+    for name in getattr(settings, 'DART_LLM_PRELOAD_WEIGHTS', []):
+        try:
+            open_weights(name).advise_willneed()
+            loaded.append(name)
+        except RegistryError as e:
+            logger.error(f"Cannot preload weights of {name}: {e}")
+    return loaded
@@ -0,0 +1,212 @@
+"""
+Latency-aware routing across the available Ollama models.
+
+Which model answers should depend on how fast each one actually is on this
+machine, not on its name.  `ModelRouter` keeps a rolling window of the last
+`DART_ROUTER_WINDOW` generations per (model, task), recording the time to
+first token and the generation throughput that Ollama reports, and predicts
+the latency of a new request as::
+
+    time to first token + expected output tokens / tokens per second
+
+Each task is configured in `DART_MODEL_ROUTER`:
+
+* `chat` uses the ``fastest`` strategy: short answers go to the model with
+  the lowest predicted latency.
+* `summary` uses the ``largest`` strategy: long summaries go to the largest
+  model (by size on disk) predicted to finish within the task's `deadline`,
+  or to the fastest model if none is.
+
+Models whose names contain one of the `exclude` patterns (embedding models,
+by default) and models smaller than `min_size_gb` are not considered
+adequate.  A model without measurements is assumed to meet the deadline, so
+each model is tried once and then judged on its numbers.  The ``fastest``
+strategy sends a request to each unmeasured model, smallest first, before
+comparing predictions; while that trial request is running (for up to the
+task's `deadline`) other requests are routed among the measured models.
+`choose(..., record_trial=False)` answers the same question without
+registering a trial, for callers such as the chat preload that do not
+generate anything themselves.
+
+Selecting "Auto" in a model dropdown (the `AUTO` model name) routes every
+request, and a request for a model that is not installed is routed instead
+of silently falling back to the first model.  Statistics are kept per
+process.
+"""
+
+import logging
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+AUTO = 'auto'
+CHAT = 'chat'
+SUMMARY = 'summary'
+
+DEFAULTS = {
+    CHAT: {'strategy': 'fastest', 'deadline': 10.0, 'expected_tokens': 200},
+    SUMMARY: {'strategy': 'largest', 'deadline': 60.0, 'expected_tokens': 600},
+    'exclude': ['embed'],
+    'min_size_gb': 0.0,
+}
+
+
+def router_config() -> dict:
+    config = {key: (dict(value) if isinstance(value, dict) else value) for key, value in DEFAULTS.items()}
+    for key, value in getattr(settings, 'DART_MODEL_ROUTER', {}).items():
+        if isinstance(value, dict):
+            config.setdefault(key, {}).update(value)
+        else:
+            config[key] = value
+    return config
+
+
+class _Sample:
+    __slots__ = ('ttft', 'tokens_per_second', 'wall')
+
+    def __init__(self, ttft: float, tokens_per_second: float | None, wall: float):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.wall = wall
+
+
+class ModelRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: dict[tuple[str, str], deque] = defaultdict(self._new_window)
+        # (model, task) -> time.monotonic() at which its trial request was routed.
+        self._trials: dict[tuple[str, str], float] = {}
+
+    @staticmethod
+    def _new_window() -> deque:
+        return deque(maxlen=getattr(settings, 'DART_ROUTER_WINDOW', 50))
+
+    # -- measurements ------------------------------------------------------
+    def record(self, model: str, task: str, response, wall_seconds: float) -> None:
+        """Record a completed generation (Ollama reports durations in nanoseconds)."""
+        def field(key):
+            try:
+                return response.get(key) or 0
+            except Exception:
+                return 0
+
+        ttft = (field('load_duration') + field('prompt_eval_duration')) / 1e9 or wall_seconds
+        eval_count, eval_duration = field('eval_count'), field('eval_duration') / 1e9
+        tokens_per_second = eval_count / eval_duration if eval_count and eval_duration > 0 else None
+        with self._lock:
+            self._samples[(model, task)].append(_Sample(ttft, tokens_per_second, wall_seconds))
+            self._trials.pop((model, task), None)
+
+    def stats(self, model: str, task: str | None = None) -> dict | None:
+        """
+        Median time to first token, median throughput and median latency of
+        `model` for `task` (or across all tasks), or None if it has no
+        measurements.
+        """
+        with self._lock:
+            if task is not None and self._samples.get((model, task)):
+                samples = list(self._samples[(model, task)])
+            else:
+                samples = [s for (m, _), window in self._samples.items() if m == model for s in window]
+        if not samples:
+            return None
+        rates = [s.tokens_per_second for s in samples if s.tokens_per_second]
+        return {
+            'count': len(samples),
+            'ttft': statistics.median(s.ttft for s in samples),
+            'tokens_per_second': statistics.median(rates) if rates else None,
+            'latency': statistics.median(s.wall for s in samples),
+        }
+
+    def predict(self, model: str, task: str) -> float | None:
+        """Predicted seconds to complete a typical `task` request on `model`."""
+        stats = self.stats(model, task)
+        if stats is None:
+            return None
+        if not stats['tokens_per_second']:
+            return stats['latency']
+        expected = router_config().get(task, {}).get('expected_tokens', 200)
+        return stats['ttft'] + expected / stats['tokens_per_second']
+
+    # -- routing -----------------------------------------------------------
+    def candidates(self, models: list[str], sizes: dict[str, int]) -> list[str]:
+        config = router_config()
+        min_size = config.get('min_size_gb', 0.0) * 1e9
+        adequate = [
+            m for m in models
+            if not any(pattern in m.lower() for pattern in config.get('exclude', []))
+            and sizes.get(m, 0) >= min_size
+        ]
+        return adequate or list(models)
+
+    def choose(self, task: str, models: list[str], sizes: dict[str, int] | None = None,
+               record_trial: bool = True) -> str | None:
+        """
+        Pick the model for a `task` request among the installed `models`.
+        With `record_trial` false an unmeasured model is picked without
+        being marked as under trial.
+        """
+        sizes = sizes or {}
+        candidates = self.candidates(models, sizes)
+        if not candidates:
+            return None
+        config = router_config().get(task, DEFAULTS[CHAT])
+        predicted = {m: self.predict(m, task) for m in candidates}
+
+        if config.get('strategy') == 'largest':
+            deadline = config.get('deadline', 60.0)
+            by_size = sorted(candidates, key=lambda m: sizes.get(m, 0), reverse=True)
+            for model in by_size:
+                if predicted[model] is None or predicted[model] <= deadline:
+                    choice = model
+                    break
+            else:
+                choice = min(candidates, key=lambda m: predicted[m])
+        else:
+            choice = self._fastest(task, candidates, predicted, sizes, config.get('deadline', 10.0), record_trial)
+        logger.info(f"Routed {task} request to {choice} (predicted {predicted[choice]}).")
+        return choice
+
+    def _fastest(self, task: str, candidates: list[str], predicted: dict, sizes: dict, deadline: float,
+                 record_trial: bool = True) -> str:
+        """
+        An unmeasured model that is not already being tried, smallest first;
+        otherwise the measured model with the lowest predicted latency.
+        """
+        unmeasured = sorted((m for m in candidates if predicted[m] is None), key=lambda m: sizes.get(m, 0))
+        measured = [m for m in candidates if predicted[m] is not None]
+        now = time.monotonic()
+        with self._lock:
+            for model in unmeasured:
+                started = self._trials.get((model, task))
+                if started is None or now - started > deadline:
+                    if record_trial:
+                        self._trials[(model, task)] = now
+                    return model
+        if measured:
+            return min(measured, key=lambda m: predicted[m])
+        return unmeasured[0]
+
+    def describe(self, model: str, task: str) -> str:
+        """A short label for the model dropdowns, e.g. "llama3 · 0.4s to first token · 38 tok/s"."""
+        stats = self.stats(model, task)
+        if stats is None:
+            return f"{model} · not measured yet"
+        parts = [model, f"{stats['ttft']:.1f}s to first token"]
+        if stats['tokens_per_second']:
+            parts.append(f"{stats['tokens_per_second']:.0f} tok/s")
+        return ' · '.join(parts)
+
+    def options(self, models: list[str], task: str) -> list[dict]:
+        """Dropdown entries: "Auto" followed by each model with its measured stats."""
+        return [{'value': AUTO, 'label': f"Auto (routed by measured speed for {task})"}] + [
+            {'value': model, 'label': self.describe(model, task)} for model in models
+        ]
+
+
+router = ModelRouter()
@@ -26,10 +26,22 @@ Python/Django install without any network connectivity.
 """
 
 from django.db import models
+from django.utils import timezone
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 import uuid
 from .ollama_client import OllamaClient
+from .llm_scheduler import BATCH, INTERACTIVE
+from .model_router import SUMMARY
+from . import instrumentation
+from .rendering import render_markdown
+from . import passages, search, trigrams
+from .search import estimate_sentiment
+from .retrieval import hybrid_search
 import logging
+import threading
+from contextlib import contextmanager
 from difflib import SequenceMatcher
 import re
 
@@ -56,6 +68,14 @@ class Event(models.Model):
     vectordb_collection_key = models.CharField(max_length=100, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set while the event's comments and chats live in its archive file
+    # rather than the database (see `base.archive`).
+    archived_at = models.DateTimeField(blank=True, null=True)
+    # Bumped on every comment write; edits and deletions also bump
+    # `comments_rewrites`.  The search indexes and the corpus cache use the
+    # pair to tell whether they can append new comments or must reload.
+    comments_version = models.PositiveIntegerField(default=0, editable=False)
+    comments_rewrites = models.PositiveIntegerField(default=0, editable=False)
 
     # Basic positive and negative lexicons for naive sentiment analysis.
     POSITIVE_WORDS = {
@@ -85,6 +105,36 @@ class Event(models.Model):
         self.db_client = None
         self.embedding_model = None
 
+    COMMENT_VERSION_FIELDS = ('comments_version', 'comments_rewrites')
+
+    def save(self, *args, **kwargs):
+        # The comment version stamps only change through F() updates; a full
+        # save of an instance loaded earlier must not write stale values back.
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COMMENT_VERSION_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def bump_comments_version(event_id: int, rewrite: bool = False) -> None:
+        """Record a change to the event's comments for the search caches."""
+        fields = {'comments_version': models.F('comments_version') + 1}
+        if rewrite:
+            fields['comments_rewrites'] = models.F('comments_rewrites') + 1
+        Event.objects.filter(pk=event_id).update(**fields)
+
+    @property
+    def is_archived(self) -> bool:
+        return self.archived_at is not None
+
+    def _rehydrate(self) -> None:
+        """Bring an archived event's comments and chats back into the database before it is edited."""
+        if self.is_archived:
+            from .archive import rehydrate_event
+            rehydrate_event(self)
+
     def _generate_key(self) -> str:
         """Generate a unique UUID for this event."""
         return str(uuid.uuid4())
@@ -116,48 +166,40 @@ class Event(models.Model):
             return text.strip()
         return ' '.join(sentences[:3]).strip()
 
-    def _summarize_texts(self, collection_name: str, model_name: str = 'llama3') -> str:
+    def _summarize_texts(self, collection_name: str, model_name: str = 'llama3',
+                         sentiment: str | None = None) -> str:
         """
-        Create a summary of all comments associated with this event.  The
-        `collection_name` argument is ignored but kept for API compatibility.
+        Create a summary of all comments associated with this event, or only
+        of those of the given `sentiment`.  The `collection_name` argument is
+        ignored but kept for API compatibility.
 
         If an Ollama server is reachable, it will be used to summarise the
         content.  Otherwise we fall back to a very simple extractive summary.
         """
         try:
-            # Gather all comment text for this event.
-            comment_qs = Comment.objects.filter(event=self)
-            documents: list[str] = []
-            for comment in comment_qs:
-                parts = []
-                if comment.observation:
-                    parts.append(comment.observation)
-                if comment.discussion:
-                    parts.append(comment.discussion)
-                if comment.recommendation:
-                    parts.append(comment.recommendation)
-                documents.append(' '.join(parts))
+            # Gather all comment text for this event (from its archive if
+            # the event has been archived).
+            documents = [doc for _, doc in search.load_event_rows([self.id])[self.id]]
+            if sentiment and sentiment != 'All':
+                documents = [doc for doc in documents if estimate_sentiment(doc) == sentiment]
             if not documents:
                 return "Not enough content to summarize."
 
             full_text = ' '.join(documents)
             max_length = 15000  # Ensure prompts do not become unmanageable
             truncated_text = full_text[:max_length]
+            described = f"{sentiment.lower()} " if sentiment and sentiment != 'All' else ""
             prompt = (
-                "Please provide a concise, professional summary of the following comments:\n\n"
+                f"Please provide a concise, professional summary of the following {described}comments:\n\n"
                 f"{truncated_text}"
             )
-            # Attempt to use Ollama if available.
+            # Attempt to use Ollama if available.  Event summaries are batch
+            # work, so interactive chat answers are scheduled ahead of them.
             ollama_client = OllamaClient()
-            summary = ollama_client.generate(model_name=model_name, prompt=prompt)
+            summary = ollama_client.generate(model_name=model_name, prompt=prompt, priority=BATCH, task=SUMMARY)
             # The Ollama client returns a string even when it fails.  Detect
             # failure messages and fall back to a local summary.
-            fallback_msgs = [
-                "Ollama client is not available",
-                "No Ollama models found",
-                "An error occurred while generating the response."
-            ]
-            if any(msg in summary for msg in fallback_msgs):
+            if OllamaClient.is_fallback(summary):
                 return self._simple_summarise(truncated_text)
             return summary
         except Exception as e:
@@ -168,47 +210,72 @@ class Event(models.Model):
             except Exception:
                 return "An error occurred during summarization."
 
-    def _upload_comments_to_collection(self, request, collection_name: str) -> None:
+    def _answer_question(self, query: str, documents: list[str], model_name: str = 'llama3',
+                         priority: int = INTERACTIVE) -> str:
+        """
+        Answer `query` from the retrieved `documents` with Ollama, falling
+        back to an extractive summary of the context when no model can be
+        used.  Shared by the chat view and the batch question API.
+        """
+        context = ' '.join(documents)
+        prompt = (
+            "Based on the following context, answer the user's question.\n\n"
+            f"Context:\n{context}\n\nQuestion: {query}\n\nAnswer:"
+        )
+        ollama_client = OllamaClient()
+        answer = ollama_client.generate(model_name=model_name, prompt=prompt, priority=priority)
+        # Fallback to simple summary if necessary
+        if OllamaClient.is_fallback(answer):
+            answer = self._simple_summarise(context)
+        return answer
+
+    def _upload_comments_to_collection(self, request, collection_name: str):
         """
-        Upload a structured CSV file containing comments for this event.
+        Import comments for this event from the uploaded files.
 
-        The expected CSV has headers `observation`, `discussion` and
-        `recommendation`.  For each row a new `Comment` object is created
-        associated with the uploading user and this event.  Fields are
-        optional; missing values default to empty strings.  Additional
-        columns in the CSV are ignored.
+        Any number of CSV, JSON Lines, JSON or XLSX files (or zip archives of
+        them) may be uploaded in the `comments_file` field.  Each record is
+        normalised to `observation`, `discussion` and `recommendation` (common
+        aliases such as `obs` or `recs` are accepted), and a `Comment` is
+        created for it associated with the uploading user and this event.
+        Missing fields default to empty strings; additional columns are
+        ignored.  Parsing runs in parallel and rows are written in batches;
+        see `base.ingest`.  Returns the `IngestReport`, or None when nothing
+        was uploaded or the import failed.
         """
         try:
-            uploaded_file = request.FILES.get('comments_file')
-            if not uploaded_file:
+            uploaded_files = request.FILES.getlist('comments_file')
+            if not uploaded_files:
                 logger.warning(f"No file provided for upload on event {self.id}.")
-                return
-            # Read and decode the uploaded CSV.  We assume UTF‑8; strip any
-            # BOM if present using utf‑8‑sig.
-            import csv
-            import io
-            file_data = uploaded_file.read().decode('utf-8-sig')
-            reader = csv.DictReader(io.StringIO(file_data))
-            count = 0
-            for row in reader:
-                observation = row.get('observation', '') or ''
-                discussion = row.get('discussion', '') or ''
-                recommendation = row.get('recommendation', '') or ''
-                Comment.objects.create(
-                    user=request.user,
-                    event=self,
-                    observation=observation,
-                    discussion=discussion,
-                    recommendation=recommendation
-                )
-                count += 1
-            logger.info(f"Uploaded {count} comments for event {self.id} from CSV.")
+                return None
+            from .ingest import ingest_files
+            report = ingest_files(self, request.user, uploaded_files)
+            logger.info(
+                f"Uploaded {report.rows} comments for event {self.id} from {report.files} files "
+                f"in {report.seconds:.1f}s ({report.rows_per_second:.0f} rows/s)."
+            )
+            return report
         except Exception as e:
             logger.error(f"Error uploading comments for event {self.id}: {e}")
+            return None
 
     def __str__(self) -> str:
         return self.name
 
+class CommentQuerySet(models.QuerySet):
+    def delete(self):
+        """
+        Delete the comments and bump the comment versions of their events.
+        There is no `post_delete` receiver for comments, so Django deletes
+        them with a single query instead of loading each row to signal it.
+        """
+        event_ids = set(self.order_by().values_list('event_id', flat=True).distinct())
+        result = super().delete()
+        for event_id in event_ids:
+            _bump(event_id, rewrite=True)
+        return result
+
+
 class Comment(models.Model):
     """
     A comment attached to an event.  Comments comprise an observation,
@@ -221,9 +288,29 @@ class Comment(models.Model):
     observation = models.TextField()
     discussion = models.TextField(blank=True, null=True)
     recommendation = models.TextField()
+    # Set for imported comments only: a hash of the row's content (see
+    # `base.ingest.fingerprint`), unique per event so re-imported rows are
+    # recognised and skipped.
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['event', 'fingerprint'],
+                condition=~models.Q(fingerprint=''),
+                name='unique_comment_fingerprint_per_event',
+            ),
+        ]
+
+    objects = CommentQuerySet.as_manager()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        _bump(self.event_id, rewrite=True)
+        return result
+
     def _load_comment_to_collection(self, collection_name: str) -> None:
         """
         Placeholder method retained for API compatibility.  In the absence of
@@ -238,6 +325,39 @@ class Comment(models.Model):
     def __str__(self) -> str:
         return f'Comment by {self.user.username} on {self.event.name}'
 
+class CommentUpload(models.Model):
+    """
+    One imported file (or zip archive member), identified by the SHA-256 of
+    its content.  Re-uploading a file whose import completed is a no-op, and
+    an import that failed part way resumes after `rows_committed`, which is
+    updated in the same transaction as each batch of comments.  An import
+    claims the upload by moving it to `RUNNING`, so a concurrent retry of
+    the same file does not process it twice.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (COMPLETE, 'Complete'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='uploads')
+    sha256 = models.CharField(max_length=64)
+    name = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_committed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'sha256'], name='unique_upload_per_event'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.status}) on {self.event.name}'
+
 class Chat(models.Model):
     """
     A chat session for an event.  Queries are stored in a JSON structure on
@@ -262,14 +382,7 @@ class Chat(models.Model):
         overlap with predefined lexicons.  This method can be replaced with a
         more sophisticated sentiment analyser if desired.
         """
-        words = re.findall(r"\b\w+\b", text.lower())
-        pos_count = sum(1 for w in words if w in self.event.POSITIVE_WORDS)
-        neg_count = sum(1 for w in words if w in self.event.NEGATIVE_WORDS)
-        if pos_count > neg_count:
-            return "Positive"
-        if neg_count > pos_count:
-            return "Negative"
-        return "Neutral"
+        return estimate_sentiment(text)
 
     def _similarity_score(self, query: str, text: str) -> float:
         """
@@ -282,68 +395,82 @@ class Chat(models.Model):
         except Exception:
             return 0.0
 
-    def _query_collection(self, query: str, model_name: str = 'llama3') -> None:
+    def _fuzzy_search(self, query: str, sentiment_filter: str) -> list[tuple[str, str, float]]:
+        """
+        Find the comments of the event that are trigram-similar to the query
+        at the chat's sensitivity (see `base/trigrams.py`), score each by its
+        best passage (see `base/passages.py`) and return ``(snippet,
+        sentiment, score)`` tuples sorted by descending similarity.
+        """
+        sensitivity = self.query_dict.get('sensitivity', 0.8)
+        with instrumentation.span('retrieval'):
+            candidates = trigrams.candidates(self.event_id, query, sensitivity, sentiment_filter)
+            scored = []
+            for doc, sentiment in candidates:
+                span, score = passages.best_passage(doc, query)
+                scored.append((passages.snippet(doc, span), sentiment, score))
+            # Sort by descending similarity
+            scored.sort(key=lambda x: x[2], reverse=True)
+        return scored
+
+    def _query_collection(self, query: str, model_name: str = 'llama3', commit: bool = True) -> None:
         """
         Perform a search over all comments for this event, applying
         sentiment filtering and returning the top N results sorted by
         similarity.  The results are stored in `query_dict` for display in the
         chat interface.
+
+        Two search modes are available, chosen by `query_dict['search_mode']`:
+        `fuzzy` (the default) scores every comment with `_similarity_score`,
+        while `hybrid` fuses lexical and vector retrieval and reranks the
+        fused head (see `base/retrieval.py`).
+
+        With `commit=False` the history is updated on this instance only;
+        the chat view uses this for archived events, which are read only.
         """
         try:
             sentiment_filter = self.query_dict.get('sentiment_filter', 'All')
             n_results = int(self.query_dict.get('n_results_filter', 4))
-            # Retrieve all comments for this event
-            comment_qs = Comment.objects.filter(event=self.event)
-            scored = []
-            for comment in comment_qs:
-                parts = []
-                if comment.observation:
-                    parts.append(comment.observation)
-                if comment.discussion:
-                    parts.append(comment.discussion)
-                if comment.recommendation:
-                    parts.append(comment.recommendation)
-                doc = ' '.join(parts)
-                sentiment = self._estimate_sentiment(doc)
-                if sentiment_filter != 'All' and sentiment != sentiment_filter:
-                    continue
-                score = self._similarity_score(query, doc)
-                scored.append((doc, sentiment, score))
-            # Sort by descending similarity
-            scored.sort(key=lambda x: x[2], reverse=True)
-            # Select top n_results
-            top = scored[:n_results]
+            search_mode = self.query_dict.get('search_mode', 'fuzzy')
+            timings = None
+            if search_mode == 'hybrid':
+                index = search.get_indexes([self.event_id])[self.event_id]
+                with instrumentation.span('retrieval'):
+                    hits, timings = hybrid_search(index, query, n_results, sentiment_filter)
+                    top = []
+                    for i, score in hits:
+                        document = index.documents[i]
+                        span, _ = passages.best_passage(document, query, index)
+                        top.append((passages.snippet(document, span), index.sentiments[i], score))
+            else:
+                top = self._fuzzy_search(query, sentiment_filter)[:n_results]
             responses = []
             for doc, sentiment, score in top:
-                # Represent distance as (1 - score) to align with previous API
-                responses.append((doc, sentiment, f"{(1 - score):.2f}"))
+                # Represent distance as (1 - score) to align with previous API.
+                # Only the best passage is stored, with the HTML (query terms
+                # highlighted) alongside so the chat page does not re-parse
+                # the history on every load.
+                responses.append((doc, sentiment, f"{(1 - score):.2f}", passages.highlight(doc, query)))
             # Optionally summarise the context
             summary = None
             if self.query_dict.get('summarize', False) and responses:
-                context = ' '.join([doc for doc, _, _ in top])
-                prompt = (
-                    "Based on the following context, answer the user's question.\n\n"
-                    f"Context:\n{context}\n\nQuestion: {query}\n\nAnswer:"
-                )
-                ollama_client = OllamaClient()
-                summary = ollama_client.generate(model_name=model_name, prompt=prompt)
-                # Fallback to simple summary if necessary
-                fallback_msgs = [
-                    "Ollama client is not available",
-                    "No Ollama models found",
-                    "An error occurred while generating the response."
-                ]
-                if any(msg in summary for msg in fallback_msgs):
-                    # Use the event summarisation fallback on the context
-                    summary = self.event._simple_summarise(context)
+                # Answered as the next turn of the chat's conversation, so
+                # follow-ups reuse the model's context (see base/chat_sessions.py).
+                from . import chat_sessions
+                summary = chat_sessions.answer(self, query, [doc for doc, _, _ in top], model_name)
             # Insert the query at the beginning of the history
             self.query_dict.setdefault('queries', [])
             self.query_dict['queries'].insert(0, {
                 'query': query,
+                'query_html': render_markdown(query),
                 'responses': responses,
-                'summary': summary
+                'summary': summary,
+                'summary_html': render_markdown(summary) if summary else None,
+                'search_mode': search_mode,
+                'timings': timings,
             })
-            self.save()
+            if commit:
+                self.save()
         except Exception as e:
             logger.error(f"Error querying comments for event {self.event.id}: {e}")
             self.query_dict.setdefault('queries', [])
@@ -352,7 +479,126 @@ class Chat(models.Model):
                 'responses': [("An error occurred while processing your query.", "Error", "N/A")],
                 'summary': "Error processing request."
             })
-            self.save()
+            if commit:
+                self.save()
 
     def __str__(self) -> str:
         return f'Chat for {self.event.name}'
+
+class PrecomputedAnswer(models.Model):
+    """
+    A summary or standard-question answer generated ahead of time for an
+    event (see `base.precompute`).  `key` is the sentiment of a summary
+    ('All', 'Positive', 'Negative' or 'Neutral') or the text of a question.
+    `comments_stamp` records the version of the event's comments it was
+    generated from, so a change to the comments marks it stale.
+    """
+    SUMMARY = 'summary'
+    QUESTION = 'question'
+    KIND_CHOICES = [(SUMMARY, 'Summary'), (QUESTION, 'Question')]
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='precomputed_answers')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    key = models.CharField(max_length=255)
+    text = models.TextField()
+    text_html = models.TextField(blank=True, default='')
+    # The retrieved comments a question was answered from.
+    sources = models.JSONField(blank=True, default=list)
+    model_name = models.CharField(max_length=100, blank=True, default='')
+    comments_stamp = models.CharField(max_length=64)
+    comment_count = models.PositiveIntegerField(default=0)
+    generation_seconds = models.FloatField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'kind', 'key'], name='unique_precomputed_answer'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.get_kind_display()} "{self.key}" for {self.event.name}'
+
+
+class BackgroundJob(models.Model):
+    """
+    An admin job (see `base.jobs`).  Jobs run in the worker process that
+    received the request; recording them here lets every worker list them.
+    `worker` names the host and process that runs the job.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATE_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=200)
+    user = models.CharField(max_length=150)
+    worker = models.CharField(max_length=100)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=QUEUED)
+    submitted = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    result = models.TextField(blank=True, default='')
+
+    def __str__(self) -> str:
+        return f'Job {self.id}: {self.name}'
+
+    @property
+    def seconds(self) -> float | None:
+        if self.started is None:
+            return None
+        return ((self.finished or timezone.now()) - self.started).total_seconds()
+
+
+_batched_bumps = threading.local()
+
+
+@contextmanager
+def batched_comment_versions():
+    """
+    Collect the comment version bumps of a bulk change (saving many comments,
+    or deleting them in several batches) and apply them once per event at
+    the end, instead of one UPDATE per comment or batch.
+    """
+    if getattr(_batched_bumps, 'events', None) is not None:
+        yield
+        return
+    _batched_bumps.events = {}
+    try:
+        yield
+        events = _batched_bumps.events
+    finally:
+        _batched_bumps.events = None
+    for event_id, rewrite in events.items():
+        Event.bump_comments_version(event_id, rewrite=rewrite)
+
+
+def _bump(event_id: int, rewrite: bool) -> None:
+    events = getattr(_batched_bumps, 'events', None)
+    if events is None:
+        Event.bump_comments_version(event_id, rewrite=rewrite)
+    else:
+        events[event_id] = events.get(event_id, False) or rewrite
+
+
+@receiver(post_save, sender=Comment)
+def _comment_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        _bump(instance.event_id, rewrite=not created)
+
+
+# Deleting a user cascades to their comments on every event; those events'
+# caches must reload.  (Deleting an event takes its caches with it.)  A
+# receiver on `Comment` itself would stop Django from deleting comments with
+# one query, so `CommentQuerySet.delete` bumps the versions instead.
+@receiver(pre_delete, sender=User)
+def _user_deleting(sender, instance, **kwargs):
+    instance._dart_comment_events = set(
+        Comment.objects.filter(user=instance).order_by().values_list('event_id', flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=User)
+def _user_deleted(sender, instance, **kwargs):
+    for event_id in getattr(instance, '_dart_comment_events', ()):
+        _bump(event_id, rewrite=True)
@@ -1,14 +1,34 @@
-import ollama
+import hashlib
 import logging
+import time
+from . import instrumentation
+from .llm_scheduler import INTERACTIVE, SchedulerBusy, scheduler
+from .model_router import AUTO, CHAT, router
 
 logger = logging.getLogger(__name__)
 
 class OllamaClient:
     """
     A client to interact with the Ollama API.
+
+    The `ollama` package (and the HTTP stack it pulls in) is imported when a
+    client is first constructed rather than at module import time, so
+    management commands and workers that never talk to a model do not pay
+    for it.
     """
+    NOT_AVAILABLE_MESSAGE = "Ollama client is not available. Please make sure Ollama is running."
+    NO_MODELS_MESSAGE = "No Ollama models found. Please pull a model (e.g., 'ollama pull llama3')."
+    ERROR_MESSAGE = "An error occurred while generating the response."
+    BUSY_MESSAGE = "The language model is busy right now. Please try again in a moment."
+
+    # Messages returned instead of a generation when no model could be used.
+    # Callers fall back to a local extractive summary when they see one.
+    FALLBACK_MESSAGES = (NOT_AVAILABLE_MESSAGE, NO_MODELS_MESSAGE, ERROR_MESSAGE)
+
     def __init__(self):
+        self.model_sizes = {}
         try:
+            import ollama
             self.client = ollama.Client()
             self.models = self._get_models()
         except Exception as e:
@@ -21,26 +41,108 @@ class OllamaClient:
         if not self.client:
             return []
         try:
-            models_data = self.client.list()
+            with instrumentation.span('llm_models'):
+                models_data = self.client.list()
             # The Ollama API now returns 'models': [{'model': '...', 'modified_at': ...}, ...]
-            return [model.get('model') or model.get('name') for model in models_data.get('models', [])]
+            entries = models_data.get('models', [])
+            names = [model.get('model') or model.get('name') for model in entries]
+            # Sizes on disk let the router tell large models from small ones.
+            self.model_sizes = {name: model.get('size') or 0 for name, model in zip(names, entries)}
+            return names
         except Exception as e:
             logger.error(f"Failed to fetch Ollama models: {e}")
             return []
 
-    def generate(self, model_name, prompt):
-        """Generates a response from a given model and prompt."""
+    def resolve_model(self, model_name, task=CHAT, record_trial=True):
+        """
+        The installed model to use for a `task` request on `model_name`.
+        "auto", and models that are not installed, are routed by measured
+        speed (see base/model_router.py).  Pass `record_trial=False` when no
+        generation follows, so that an unmeasured model is not marked as
+        under trial.
+        """
+        if model_name in self.models:
+            return model_name
+        routed = router.choose(task, self.models, self.model_sizes, record_trial=record_trial)
+        if model_name != AUTO:
+            logger.warning(f"Model '{model_name}' not found. Routing to {routed}.")
+        return routed
+
+    def generate(self, model_name, prompt, priority=INTERACTIVE, task=CHAT):
+        """
+        Generates a response from a given model and prompt.  The call goes
+        through the LLM scheduler: identical concurrent prompts share one
+        generation, and `priority` (interactive or batch) decides the order in
+        which waiting calls get a slot.  Returns `BUSY_MESSAGE` if the call
+        was shed.  `task` ('chat' or 'summary') is used to route "auto"
+        requests and to file the call's latency statistics.
+        """
+        text, _ = self._generate(model_name, prompt, priority, task)
+        return text
+
+    def converse(self, model_name, prompt, context=None, keep_alive=None, priority=INTERACTIVE, task=CHAT):
+        """
+        Generate one turn of a conversation.  `context` is the token context
+        returned by the previous turn; passing it back lets Ollama reuse the
+        evaluated conversation so only the new prompt is processed.
+        `keep_alive` (e.g. '30m') keeps the model loaded after the call.
+        Returns the response text and the context for the next turn, which is
+        None when no generation took place.
+        """
+        return self._generate(model_name, prompt, priority, task, context=context, keep_alive=keep_alive)
+
+    def _generate(self, model_name, prompt, priority, task, context=None, keep_alive=None):
         if not self.client:
-            return "Ollama client is not available. Please make sure Ollama is running."
+            return self.NOT_AVAILABLE_MESSAGE, None
         if not self.models:
-             return "No Ollama models found. Please pull a model (e.g., 'ollama pull llama3')."
-        if model_name not in self.models:
-            logger.warning(f"Model '{model_name}' not found. Defaulting to {self.models[0]}.")
-            model_name = self.models[0]
-        
+            return self.NO_MODELS_MESSAGE, None
+        model_name = self.resolve_model(model_name, task)
+
+        options = {}
+        if context:
+            options['context'] = context
+        if keep_alive is not None:
+            options['keep_alive'] = keep_alive
+
+        def call():
+            start = time.perf_counter()
+            with instrumentation.span('llm'):
+                response = self.client.generate(model=model_name, prompt=prompt, stream=False, **options)
+            wall = time.perf_counter() - start
+            instrumentation.record_llm_response(model_name, response, wall)
+            router.record(model_name, task, response, wall)
+            return response.get('response', 'No response from model.'), response.get('context')
+
+        # Calls continuing different conversations must not be coalesced.
+        key_extra = (hashlib.sha256(repr(context).encode()).hexdigest(),) if context else ()
         try:
-            response = self.client.generate(model=model_name, prompt=prompt, stream=False)
-            return response.get('response', 'No response from model.')
+            return scheduler.run(model_name, prompt, call, priority=priority, key_extra=key_extra)
+        except SchedulerBusy:
+            return self.BUSY_MESSAGE, None
         except Exception as e:
             logger.error(f"Error during Ollama generation: {e}")
-            return "An error occurred while generating the response."
+            instrumentation.LLM_REQUESTS.inc(model=model_name, outcome='error')
+            return self.ERROR_MESSAGE, None
+
+    def preload(self, model_name, keep_alive=None):
+        """
+        Ask Ollama to load `model_name` without generating anything (an
+        empty prompt only loads the model), so the
+        next real request does not pay for a cold load.  Returns True if the
+        request succeeded.
+        """
+        if not self.client or model_name not in self.models:
+            return False
+        options = {} if keep_alive is None else {'keep_alive': keep_alive}
+        try:
+            with instrumentation.span('llm_preload'):
+                self.client.generate(model=model_name, prompt='', **options)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to preload Ollama model {model_name}: {e}")
+            return False
+
+    @classmethod
+    def is_fallback(cls, text) -> bool:
+        """True if `text` is one of the messages returned when no model could be used."""
+        return any(msg in text for msg in cls.FALLBACK_MESSAGES)
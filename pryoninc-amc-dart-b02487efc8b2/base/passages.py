@@ -0,0 +1,153 @@
+"""
+Best-passage extraction for search results and LLM context.
+
+A comment joins its observation, discussion and recommendation into one
+document, often several paragraphs long, while a question is usually about
+one sentence of it.  Showing, storing and prompting with whole documents
+made the chat history, the chat page and the prompts many times larger than
+the text that actually matched.  Retrieval therefore still ranks comments,
+but every hit is cut down to its best passage:
+
+* `split` segments a document into passages: sentences (split after ``.``,
+  ``!`` or ``?`` and at line breaks), merged while they fit in
+  `DART_PASSAGE_MAX_CHARS` characters, with overlong sentences cut at a word
+  boundary.  Passages are character spans of the document, so nothing is
+  copied until a snippet is made.
+* `best_passage` picks the passage of a hit that best matches the query:
+  by TF-IDF cosine with the event index's IDF weights for index-backed
+  searches, and otherwise by the share of the query's trigrams it contains
+  (as `base.trigrams` selects fuzzy candidates).  The fuzzy chat mode ranks
+  comments by the `SequenceMatcher` ratio of their best passage, which also
+  keeps the quadratic `SequenceMatcher` working on short strings.
+* `snippet` returns the passage, with an ellipsis where it was cut from a
+  longer comment, and `highlight` renders it as HTML with the query terms
+  wrapped in ``<mark>`` (misspelt query words are matched by trigram
+  similarity, as in `base.trigrams`).
+
+Only the snippets are stored in the chat history and sent to the model.
+"""
+
+import math
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+
+from django.conf import settings
+
+from .rendering import render_markdown
+from .search import TOKEN_RE, tokenize
+from .trigrams import trigrams
+
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+|\s*\n\s*')
+# Words too common to be worth highlighting.
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'did', 'do', 'for', 'from', 'how', 'in', 'is',
+    'it', 'of', 'on', 'or', 'that', 'the', 'there', 'this', 'to', 'was', 'were', 'what', 'when',
+    'where', 'which', 'who', 'why', 'with',
+})
+ELLIPSIS = '…'
+
+
+def max_chars() -> int:
+    return getattr(settings, 'DART_PASSAGE_MAX_CHARS', 320)
+
+
+def _sentences(text: str) -> list[tuple[int, int]]:
+    spans, start = [], 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def split(text: str, limit: int | None = None) -> list[tuple[int, int]]:
+    """The ``(start, end)`` character spans of the passages of `text`."""
+    limit = limit or max_chars()
+    passages = []
+    for start, end in _sentences(text):
+        # Cut overlong sentences at the last space within the limit.
+        while end - start > limit:
+            cut = text.rfind(' ', start, start + limit)
+            cut = cut if cut > start else start + limit
+            passages.append((start, cut))
+            start = cut + 1 if text[cut:cut + 1] == ' ' else cut
+        if passages and end - passages[-1][0] <= limit:
+            passages[-1] = (passages[-1][0], end)
+        else:
+            passages.append((start, end))
+    return passages or [(0, len(text))]
+
+
+def _tfidf_score(query_vector: dict[str, float], passage: str, idf: dict[str, float]) -> float:
+    counts = Counter(term for term in tokenize(passage) if term in idf)
+    weights = {term: (1.0 + math.log(tf)) * idf[term] for term, tf in counts.items()}
+    norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+    return sum(q_weight * weights.get(term, 0.0) for term, q_weight in query_vector.items()) / norm
+
+
+def best_passage(document: str, query: str, index=None) -> tuple[tuple[int, int], float]:
+    """
+    The span of the passage of `document` that best matches `query` and its
+    score.  With an `EventIndex` passages are scored by TF-IDF cosine.
+    Without one, or when no passage shares a term with the query, the
+    passage sharing most trigrams with the query is chosen and scored by
+    its `SequenceMatcher` ratio.
+    """
+    spans = split(document)
+    if len(spans) == 1:
+        span = spans[0]
+        if index is not None:
+            return span, _tfidf_score(index.query_vector(query), document, index.idf)
+        return span, SequenceMatcher(None, query.lower(), document.lower()).ratio()
+    if index is not None:
+        query_vector = index.query_vector(query)
+        if query_vector:
+            scored = [(_tfidf_score(query_vector, document[s:e], index.idf), (s, e)) for s, e in spans]
+            score, span = max(scored, key=lambda item: item[0])
+            if score > 0:
+                return span, score
+    # Choose by the share of the query's trigrams each passage contains (as
+    # the fuzzy candidates are chosen), then score the chosen passage.
+    query_grams = trigrams(query)
+    span = max(spans, key=lambda se: len(query_grams & trigrams(document[se[0]:se[1]])))
+    start, end = span
+    return span, SequenceMatcher(None, query.lower(), document[start:end].lower()).ratio()
+
+
+def snippet(document: str, span: tuple[int, int]) -> str:
+    """The text of `span`, with an ellipsis on each side where the comment continues."""
+    start, end = span
+    text = document[start:end].strip()
+    if document[:start].strip():
+        text = ELLIPSIS + text
+    if document[end:].strip():
+        text = text + ELLIPSIS
+    return text
+
+
+def _query_terms(query: str) -> tuple[set[str], list[set[str]]]:
+    words = {word for word in tokenize(query) if word not in STOPWORDS}
+    grams = [trigrams(word) for word in words if len(word) >= 4]
+    return words, grams
+
+
+def highlight(text: str, query: str) -> str:
+    """`text` rendered as HTML with the words matching `query` in ``<mark>``."""
+    words, grams = _query_terms(query)
+
+    def matches(word: str) -> bool:
+        lowered = word.lower()
+        if lowered in words:
+            return True
+        if len(lowered) < 4:
+            return False
+        word_grams = trigrams(lowered)
+        return any(len(word_grams & g) / len(word_grams | g) >= 0.5 for g in grams)
+
+    # `render_markdown` sanitises the result; `mark` is on its allowlist.
+    if words:
+        text = TOKEN_RE.sub(lambda m: f'<mark>{m.group(0)}</mark>' if matches(m.group(0)) else m.group(0), text)
+    return render_markdown(text)
@@ -0,0 +1,276 @@
+"""
+Speculative precomputation of event summaries and standard answers.
+
+Opening an event is nearly always followed by the same few requests: the
+overall summary, summaries of the positive, negative and neutral comments,
+and questions such as "What were the main problems?".  Each of these used to
+be generated while the user waited.  This module generates them ahead of
+time, while the language model has nothing else to do, and stores them as
+`PrecomputedAnswer` rows:
+
+* For every active event (see `base.warmup.active_event_ids`) a summary per
+  sentiment (`SENTIMENTS`) and an answer to each of the standard questions
+  in `DART_PRECOMPUTE_QUESTIONS` are kept.
+* Each row records the ``(comments_version, comments_rewrites)`` stamp of the
+  comments it was generated from.  When the event's comments change the row
+  is stale; it is still shown, flagged as out of date, until it has been
+  regenerated.  An item is regenerated at most every
+  `DART_PRECOMPUTE_MIN_AGE` seconds, so a live exercise does not keep the
+  model busy summarising after every comment.
+* A background thread polls for stale items every
+  `DART_PRECOMPUTE_INTERVAL` seconds and generates one at a time, only once
+  the LLM scheduler has been idle for `DART_PRECOMPUTE_IDLE_SECONDS`.
+  Generations are sent with batch priority, so a user request arriving in
+  the meantime is served first, and an identical user request shares the
+  generation in flight.
+* With several workers only the one holding the lock file
+  `DART_PRECOMPUTE_LOCK` precomputes; the lock is released when the process
+  exits.  Nothing is generated while Ollama is unreachable, so the local
+  extractive fallback is not stored in place of a real summary.
+
+`manage.py precompute` runs the same work once, without waiting for idle
+time.
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+SENTIMENTS = ('All', 'Positive', 'Negative', 'Neutral')
+DEFAULT_QUESTIONS = [
+    "What were the main problems?",
+    "What went well?",
+    "What are the key recommendations?",
+]
+
+
+def enabled() -> bool:
+    return getattr(settings, 'DART_PRECOMPUTE_ENABLED', True)
+
+
+def standard_questions() -> list[str]:
+    return list(getattr(settings, 'DART_PRECOMPUTE_QUESTIONS', DEFAULT_QUESTIONS))
+
+
+def stamp(version: tuple) -> str:
+    """The string form of an event's comment version stamps, as stored on `PrecomputedAnswer`."""
+    return ':'.join(str(part) for part in version)
+
+
+def current_stamps(event_ids) -> dict[int, str]:
+    from .search import event_versions
+    return {event_id: stamp(version) for event_id, version in event_versions(event_ids).items()}
+
+
+def for_event(event) -> dict:
+    """
+    The precomputed summaries (by sentiment) and answers of an event, each
+    annotated with `stale` and, for stale rows of events in the database,
+    `new_comments`: how many comments were added since it was generated.
+    """
+    from .models import PrecomputedAnswer
+    rows = list(PrecomputedAnswer.objects.filter(event=event))
+    current = current_stamps([event.id])[event.id]
+    comment_count = None
+    for row in rows:
+        row.stale = row.comments_stamp != current
+        row.new_comments = None
+        if row.stale and not event.is_archived:
+            if comment_count is None:
+                comment_count = event.comment_set.count()
+            row.new_comments = max(comment_count - row.comment_count, 0)
+    summaries = {row.key: row for row in rows if row.kind == PrecomputedAnswer.SUMMARY}
+    answers = {row.key: row for row in rows if row.kind == PrecomputedAnswer.QUESTION}
+    return {
+        'summaries': [summaries[s] for s in SENTIMENTS if s in summaries],
+        'answers': [answers[q] for q in standard_questions() if q in answers],
+    }
+
+
+def fresh_summary(event, model_name: str | None = None):
+    """The precomputed overall summary if it is up to date and was generated by `model_name` (any model for auto)."""
+    from .model_router import AUTO
+    from .models import PrecomputedAnswer
+    row = PrecomputedAnswer.objects.filter(event=event, kind=PrecomputedAnswer.SUMMARY, key='All').first()
+    if row is None or row.comments_stamp != current_stamps([event.id])[event.id]:
+        return None
+    if model_name and model_name != AUTO and model_name != row.model_name:
+        return None
+    return row
+
+
+def pending_work(event_ids=None, force: bool = False) -> list[tuple[int, str, str]]:
+    """
+    The ``(event_id, kind, key)`` items that are missing or stale (and old
+    enough to regenerate, unless `force`), overall summaries first.
+    """
+    from .models import PrecomputedAnswer
+    from .warmup import active_event_ids
+    event_ids = list(event_ids) if event_ids is not None else active_event_ids()
+    if not event_ids:
+        return []
+    stamps = current_stamps(event_ids)
+    min_age = 0 if force else getattr(settings, 'DART_PRECOMPUTE_MIN_AGE', 300)
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    existing = {
+        (event_id, kind, key): (comments_stamp, computed_at)
+        for event_id, kind, key, comments_stamp, computed_at in PrecomputedAnswer.objects.filter(
+            event_id__in=event_ids
+        ).values_list('event_id', 'kind', 'key', 'comments_stamp', 'computed_at')
+    }
+    wanted = [(PrecomputedAnswer.SUMMARY, 'All')]
+    wanted += [(PrecomputedAnswer.QUESTION, question) for question in standard_questions()]
+    wanted += [(PrecomputedAnswer.SUMMARY, sentiment) for sentiment in SENTIMENTS[1:]]
+    work = []
+    for kind, key in wanted:
+        for event_id in event_ids:
+            row = existing.get((event_id, kind, key))
+            if row is None or (row[0] != stamps[event_id] and row[1] <= cutoff):
+                work.append((event_id, kind, key))
+    return work
+
+
+def prune_questions() -> int:
+    """Delete the answers to questions that are no longer standard."""
+    from .models import PrecomputedAnswer
+    deleted, _ = PrecomputedAnswer.objects.filter(kind=PrecomputedAnswer.QUESTION).exclude(
+        key__in=standard_questions()
+    ).delete()
+    return deleted
+
+
+def compute(event_id: int, kind: str, key: str, client=None):
+    """
+    Generate one summary or answer and store it.  Returns the
+    `PrecomputedAnswer`, or None if no model produced it.
+    """
+    from . import reports, search
+    from .model_router import AUTO, CHAT, SUMMARY
+    from .models import Event, PrecomputedAnswer
+    from .ollama_client import OllamaClient
+    from .rendering import render_markdown
+    client = client or OllamaClient()
+    if not client.client or not client.models:
+        return None
+    event = Event.objects.get(pk=event_id)
+    # Read the stamp before generating: comments arriving meanwhile leave the row stale.
+    current = current_stamps([event_id])[event_id]
+    comment_count = len(search.get_indexes([event_id])[event_id].comment_ids)
+    start = time.perf_counter()
+    sources = []
+    if kind == PrecomputedAnswer.SUMMARY:
+        model_name = client.resolve_model(AUTO, SUMMARY)
+        text = event._summarize_texts(event.vectordb_collection_key, model_name=model_name,
+                                      sentiment=None if key == 'All' else key)
+    else:
+        model_name = client.resolve_model(AUTO, CHAT)
+        result = next(reports.answer_questions(event, [key], model_name=model_name, n_results=4))
+        sources = result['responses']
+        text = result['answer'] if sources else "No comments address this question yet."
+    if not text or text in (OllamaClient.BUSY_MESSAGE, OllamaClient.ERROR_MESSAGE) or OllamaClient.is_fallback(text):
+        logger.info(f"No precomputed {kind} '{key}' for event {event_id}: the model did not answer.")
+        return None
+    row, _ = PrecomputedAnswer.objects.update_or_create(
+        event_id=event_id, kind=kind, key=key,
+        defaults={
+            'text': text,
+            'text_html': render_markdown(text),
+            'sources': sources,
+            'model_name': model_name,
+            'comments_stamp': current,
+            'comment_count': comment_count,
+            'generation_seconds': time.perf_counter() - start,
+        },
+    )
+    logger.info(f"Precomputed {kind} '{key}' for event {event_id} in {row.generation_seconds:.1f}s.")
+    return row
+
+
+class Precomputer:
+    """The background thread that precomputes while the LLM scheduler is idle."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self._lock_handle = None
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='dart-precompute', daemon=True)
+        self._thread.start()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _is_leader(self) -> bool:
+        """Hold the precompute lock for the life of the process; only its holder precomputes."""
+        if self._lock_handle is not None:
+            return True
+        import fcntl
+        path = str(getattr(settings, 'DART_PRECOMPUTE_LOCK', os.path.join(settings.BASE_DIR, 'precompute.lock')))
+        handle = open(path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_handle = handle
+        logger.info(f"Process {self.pid} is precomputing summaries and answers.")
+        return True
+
+    def _idle(self, wait: bool = False) -> bool:
+        """True once no generation has run for `DART_PRECOMPUTE_IDLE_SECONDS`, optionally waiting that long first."""
+        from .llm_scheduler import scheduler
+        idle_seconds = getattr(settings, 'DART_PRECOMPUTE_IDLE_SECONDS', 5.0)
+        if wait:
+            time.sleep(max(idle_seconds - scheduler.idle_seconds(), 0))
+        return scheduler.idle_seconds() >= idle_seconds
+
+    def _run(self) -> None:
+        interval = getattr(settings, 'DART_PRECOMPUTE_INTERVAL', 30)
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                if self._is_leader():
+                    self._work()
+            except Exception as e:
+                logger.error(f"Precomputation failed: {e}")
+            finally:
+                connections.close_all()
+
+    def _work(self) -> None:
+        from .ollama_client import OllamaClient
+        if not self._idle():
+            return
+        prune_questions()
+        work = pending_work()
+        if not work:
+            return
+        client = OllamaClient()
+        if not client.client or not client.models:
+            return
+        for event_id, kind, key in work:
+            # Stop as soon as users need the model; the rest waits for the next idle spell.
+            if not self._idle(wait=True):
+                return
+            compute(event_id, kind, key, client)
+
+
+_precomputer: Precomputer | None = None
+_precomputer_lock = threading.Lock()
+
+
+def ensure_started() -> None:
+    """Start this process's precompute thread, if enabled and not already running."""
+    global _precomputer
+    if not enabled():
+        return
+    with _precomputer_lock:
+        if _precomputer is None or _precomputer.pid != os.getpid():
+            _precomputer = Precomputer()
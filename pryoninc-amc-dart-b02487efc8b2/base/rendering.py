@@ -0,0 +1,73 @@
+"""
+Markdown rendering for chat history and summaries.
+
+Queries, retrieved comments and LLM generated summaries are written in
+markdown and displayed as HTML.  Rendering is relatively expensive and the
+content is user (or model) supplied, so this module takes care of both
+concerns in one place:
+
+* The generated HTML is sanitised with `bleach`, allowing only the tags that
+  python-markdown produces for ordinary documents.  Any raw HTML in the
+  source is escaped rather than passed through to the page.
+* Results are kept in a small LRU cache keyed by the SHA-256 of the source
+  text, so the same document is parsed at most once per process.
+
+`Chat._query_collection` renders new entries when they are stored and saves
+the HTML alongside the markdown in `query_dict`; the `markdown` template
+filter is only a fallback for older history entries and the event summary.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import instrumentation
+
+# bleach's default allowlist plus the block level tags produced by markdown.
+# `bleach` and `markdown` themselves are imported on first use so that
+# importing the models does not pull them in.
+ALLOWED_TAGS = frozenset({
+    'a', 'abbr', 'acronym', 'b', 'blockquote', 'code', 'em', 'i', 'li', 'ol',
+    'strong', 'ul', 'p', 'br', 'hr', 'pre', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td', 'mark',
+})
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'abbr': ['title'],
+    'acronym': ['title'],
+    'code': ['class'],
+}
+
+_cache: OrderedDict[str, str] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_size() -> int:
+    return getattr(settings, 'DART_MARKDOWN_CACHE_SIZE', 2048)
+
+
+def render_markdown(text: str) -> str:
+    """Return sanitised HTML for the markdown `text`, using the LRU cache."""
+    if not text:
+        return ''
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with _cache_lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+            return html
+    import bleach
+    import markdown as md
+    with instrumentation.span('markdown'):
+        html = bleach.clean(
+            md.markdown(text, extensions=['markdown.extensions.fenced_code']),
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRIBUTES,
+        )
+    with _cache_lock:
+        _cache[key] = html
+        while len(_cache) > _cache_size():
+            _cache.popitem(last=False)
+    return html
@@ -0,0 +1,106 @@
+"""
+Batch question answering for after-action reports.
+
+An after-action report asks an event the same 20-50 standard questions.
+Sending them one at a time through the chat view runs retrieval and
+generation serially and rewrites the chat history for every question.
+`answer_questions` instead:
+
+* runs retrieval for every question in one pass over the event's TF-IDF
+  index (`EventIndex.search_many` walks each posting list once for all
+  questions that share the term), and
+* sends the generations through a worker pool so they run concurrently, up
+  to the LLM scheduler's concurrency limit for the model.  Generations are
+  submitted with batch priority, so interactive chat is still served first,
+  and a call shed as busy is retried with a short back-off.
+
+Results are yielded as each question completes, which lets the view stream
+them, and carry the question's position so callers can restore the order.
+Each retrieved comment carries only its id and best passage (see
+`base.passages`), not the whole comment, and only the passages are sent to
+the model.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connections
+
+from . import instrumentation, search
+from .passages import best_passage, snippet
+from .llm_scheduler import BATCH, scheduler
+from .ollama_client import OllamaClient
+
+logger = logging.getLogger(__name__)
+
+
+def _answer(event, question: str, documents: list[str], model_name: str) -> tuple[str, float]:
+    retries = getattr(settings, 'DART_REPORT_BUSY_RETRIES', 3)
+    start = time.perf_counter()
+    try:
+        for attempt in range(retries + 1):
+            answer = event._answer_question(question, documents, model_name=model_name, priority=BATCH)
+            if answer != OllamaClient.BUSY_MESSAGE or attempt == retries:
+                return answer, time.perf_counter() - start
+            time.sleep(min(2 ** attempt, 10))
+    finally:
+        connections.close_all()
+
+
+def answer_questions(event, questions: list[str], model_name: str | None = None, n_results: int = 4,
+                     sentiment: str | None = None, generate: bool = True):
+    """
+    Answer each of `questions` about `event`.  Yields one result dictionary
+    per question, in completion order.
+    """
+    index = search.get_indexes([event.id])[event.id]
+    with instrumentation.span('retrieval'):
+        hits = index.search_many(questions, n_results, sentiment)
+
+    results = []
+    for position, (question, question_hits) in enumerate(zip(questions, hits)):
+        results.append({
+            'position': position,
+            'question': question,
+            'responses': [
+                {
+                    'comment_id': index.comment_ids[doc_idx],
+                    'passage': snippet(index.documents[doc_idx],
+                                       best_passage(index.documents[doc_idx], question, index)[0]),
+                    'sentiment': index.sentiments[doc_idx],
+                    'distance': f"{(1 - score):.2f}",
+                }
+                for score, doc_idx in question_hits
+            ],
+            'answer': None,
+        })
+
+    if not generate:
+        yield from results
+        return
+
+    pending = [r for r in results if r['responses']]
+    yield from (r for r in results if not r['responses'])
+    if not pending:
+        return
+
+    model_name = model_name or ''
+    client = OllamaClient()
+    if client.models and model_name not in client.models:
+        model_name = client.models[0]
+    workers = getattr(settings, 'DART_REPORT_WORKERS', None) or scheduler.limit(model_name)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dart-report') as pool:
+        futures = {
+            pool.submit(_answer, event, r['question'], [resp['passage'] for resp in r['responses']], model_name): r
+            for r in pending
+        }
+        for future in as_completed(futures):
+            result = futures[future]
+            try:
+                result['answer'], result['generation_seconds'] = future.result()
+            except Exception as e:
+                logger.error(f"Error answering report question for event {event.id}: {e}")
+                result['answer'] = OllamaClient.ERROR_MESSAGE
+            yield result
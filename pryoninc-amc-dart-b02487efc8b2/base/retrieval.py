@@ -0,0 +1,179 @@
+"""
+Hybrid lexical + semantic retrieval for the chat view.
+
+Military feedback is full of acronyms and jargon, which exact keyword
+matching handles well, but the same problem is often described in different
+words, which only a semantic retriever will find.  The hybrid mode of
+`Chat._query_collection` therefore runs both and merges them:
+
+1. Lexical retrieval: the TF-IDF index of the event (see `base/search.py`).
+2. Vector retrieval: cosine similarity over document embeddings (see
+   `base/embeddings.py`).
+   Both retrievers run in parallel on the search thread pool, each with its
+   own latency budget.  A retriever that misses its budget is dropped from
+   this query and the other one's ranking is used on its own.
+3. Reciprocal rank fusion: every document scores ``sum(1 / (k + rank))``
+   over the rankings it appears in.  RRF needs no score calibration between
+   retrievers, which is why it is used here.
+4. Optional reranking of the fused top `rerank_depth` (50 by default) with a
+   heavier scorer, stopping when the rerank budget runs out.  `embedding`
+   reranks with the Ollama model named in `DART_EMBEDDING_MODEL`, embedding
+   the candidates in batches; `sequence` uses the difflib `SequenceMatcher`
+   ratio of the classic fuzzy mode.  Reranking is off by default.
+
+Every result is reported with its fused score divided by the best score
+possible (ranked first by every retriever that answered), so scores are on
+one scale in [0, 1] whichever retrievers answered.  Reranking changes the
+order only.  Embeddings are computed once per index, and an index refreshed
+with new comments reuses the embeddings of the previous one (see
+`EventIndex.inherit_embeddings`).
+
+The time spent in each stage is recorded as an instrumentation span and
+returned so the chat view can show it next to the answer.  All knobs live in
+`DART_HYBRID_SEARCH` in `dart/settings.py`.
+"""
+
+import logging
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+from difflib import SequenceMatcher
+
+from django.conf import settings
+
+from . import instrumentation, search
+from .embeddings import EmbeddingMatrix, OllamaEmbedder, get_embedder
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'candidates': 100,
+    'rrf_k': 60,
+    'rerank': 'none',
+    'rerank_depth': 50,
+    'budgets_ms': {'lexical': 250, 'vector': 750, 'rerank': 500},
+}
+
+
+def hybrid_config() -> dict:
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'DART_HYBRID_SEARCH', {}))
+    config['budgets_ms'] = {**DEFAULTS['budgets_ms'], **config.get('budgets_ms', {})}
+    return config
+
+
+def _lexical(index, query: str, depth: int, sentiment: str | None) -> list[tuple[float, int]]:
+    return index.search(query, depth, sentiment)
+
+
+def _vector(index, query: str, depth: int, sentiment: str | None) -> list[tuple[float, int]]:
+    embedder = get_embedder()
+    matrix = index.embedding_matrix(embedder)
+    query_vector = embedder.embed([query])[0]
+    scored = [
+        (score, doc_idx)
+        for doc_idx, score in enumerate(matrix.similarities(query_vector))
+        if not sentiment or sentiment == 'All' or index.sentiments[doc_idx] == sentiment
+    ]
+    scored.sort(reverse=True)
+    return scored[:depth]
+
+
+def reciprocal_rank_fusion(rankings: list[list[int]], k: int = 60) -> list[tuple[float, int]]:
+    """Fuse several rankings of document indices into one, best first."""
+    fused: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_idx in enumerate(ranking, start=1):
+            fused[doc_idx] = fused.get(doc_idx, 0.0) + 1.0 / (k + rank)
+    return sorted(((score, doc_idx) for doc_idx, score in fused.items()), reverse=True)
+
+
+def _rerank(index, query: str, candidates: list[int], method: str, deadline: float) -> dict[int, float]:
+    """Score candidates with the heavier reranker until `deadline` passes."""
+    scores: dict[int, float] = {}
+    if method == 'embedding':
+        embedder = get_embedder()
+        if not isinstance(embedder, OllamaEmbedder):
+            # No embedding model configured, or Ollama is down.
+            return scores
+        query_vector = embedder.embed([query])[0]
+        matrix = index.cached_embedding_matrix(embedder)
+        if matrix is not None:
+            return dict(zip(candidates, matrix.similarities(query_vector, candidates)))
+        for start in range(0, len(candidates), embedder.batch_size):
+            if time.perf_counter() > deadline:
+                break
+            batch = candidates[start:start + embedder.batch_size]
+            vectors = EmbeddingMatrix(embedder.embed([index.documents[doc_idx] for doc_idx in batch]))
+            scores.update(zip(batch, vectors.similarities(query_vector)))
+        return scores
+    lowered = query.lower()
+    for doc_idx in candidates:
+        if time.perf_counter() > deadline:
+            break
+        scores[doc_idx] = SequenceMatcher(None, lowered, index.documents[doc_idx].lower()).ratio()
+    return scores
+
+
+def hybrid_search(index, query: str, n_results: int, sentiment: str | None = None) -> tuple[list, dict]:
+    """
+    Run the hybrid pipeline over `index`.  Returns ``(results, timings)``
+    where results are ``(doc_idx, score)`` pairs, best first, with the
+    normalised fused score described above, and timings maps each stage to its duration in milliseconds.
+    """
+    config = hybrid_config()
+    budgets = config['budgets_ms']
+    depth = max(config['candidates'], n_results)
+    timings: dict[str, float] = {}
+    rankings = []
+
+    start = time.perf_counter()
+    futures = {
+        'lexical': search._in_pool(_lexical, index, query, depth, sentiment),
+        'vector': search._in_pool(_vector, index, query, depth, sentiment),
+    }
+    for stage, future in futures.items():
+        remaining = budgets[stage] / 1000 - (time.perf_counter() - start)
+        try:
+            ranked = future.result(timeout=max(0.0, remaining))
+        except FutureTimeout:
+            future.cancel()
+            logger.warning(f"Hybrid search dropped the {stage} retriever: over its {budgets[stage]}ms budget.")
+            timings[stage] = None
+            continue
+        except Exception as e:
+            logger.error(f"Hybrid search {stage} retriever failed: {e}")
+            timings[stage] = None
+            continue
+        elapsed = time.perf_counter() - start
+        instrumentation.record(f'retrieval_{stage}', elapsed)
+        timings[stage] = elapsed * 1000
+        rankings.append([doc_idx for _, doc_idx in ranked])
+
+    stage_start = time.perf_counter()
+    fused = reciprocal_rank_fusion(rankings, k=config['rrf_k'])
+    order = [doc_idx for _, doc_idx in fused]
+    best = len(rankings) / (config['rrf_k'] + 1)
+    similarities = {doc_idx: score / best for score, doc_idx in fused}
+    fusion_elapsed = time.perf_counter() - stage_start
+    instrumentation.record('retrieval_fusion', fusion_elapsed)
+    timings['fusion'] = fusion_elapsed * 1000
+
+    if config['rerank'] and config['rerank'] != 'none' and order:
+        stage_start = time.perf_counter()
+        head = order[:config['rerank_depth']]
+        try:
+            reranked = _rerank(index, query, head, config['rerank'],
+                               deadline=stage_start + budgets['rerank'] / 1000)
+        except Exception as e:
+            logger.error(f"Hybrid search rerank failed, keeping fused order: {e}")
+            reranked = {}
+        # Reranked documents first, by their new score; anything the budget
+        # did not reach keeps its fused order behind them.
+        scored_head = sorted((d for d in head if d in reranked), key=lambda d: reranked[d], reverse=True)
+        order = scored_head + [d for d in order if d not in reranked]
+        rerank_elapsed = time.perf_counter() - stage_start
+        instrumentation.record('retrieval_rerank', rerank_elapsed)
+        timings['rerank'] = rerank_elapsed * 1000
+
+    results = [(doc_idx, similarities.get(doc_idx, 0.0)) for doc_idx in order[:n_results]]
+    return results, timings
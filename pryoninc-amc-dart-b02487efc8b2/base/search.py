@@ -0,0 +1,606 @@
+"""
+Per-event search indexes and cross-event search.
+
+The chat interface searches the comments of a single event.  Analysts who
+look for a recurring issue across many exercises need to search every event
+they are invited to at once, and the cost of that search must not grow with
+the total number of comments.  This module keeps a small inverted index per
+event in process memory:
+
+* Each comment is turned into a TF-IDF vector (log-scaled term frequency,
+  smoothed inverse document frequency, L2 normalised).  A query is scored by
+  walking only the postings of its own terms, so the work per event is
+  proportional to the number of matching postings rather than the number of
+  comments.  Scores are cosine similarities in [0, 1], which keeps them
+  comparable between events and lets us report a distance of ``1 - score``
+  just like the chat view.
+* Indexes are cached per event and tagged with the event's
+  ``comments_version`` and ``comments_rewrites`` stamps, which comment
+  writes bump.  The versions of every event a user can see are read from the
+  event table in a single query; stale indexes are rebuilt from the cached
+  per-event corpora (see `base.corpus`), which only fetch the comments added
+  since they were loaded.  Unless `DART_SEGMENT_DIR` is unset, the indexes
+  themselves live in segment files mapped by every worker process (see
+  `base.segments`).
+* Archived events are read from their archive files, which also carry the
+  precomputed index (see `base.archive`).
+* Indexes are rebuilt on their own thread pool, one event per task.  Each
+  process keeps indexes up to an estimated `DART_CORPUS_CACHE_BYTES` in
+  total; the least recently used are dropped beyond that.
+* ``search_events`` fans the query out over the per-event indexes on a
+  thread pool and merges the per-event top-k lists into a global top-k.
+  ``DART_SEARCH_DEADLINE`` covers the whole search, index builds included:
+  events whose index is not ready in time are reported as skipped and
+  searched once their rebuild, which carries on in the background, has
+  finished; events that do not answer in time are skipped too, and their
+  searches stop at the next query term.  Events whose search failed are
+  reported separately.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import heapq
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, connections
+from . import corpus as corpus_cache
+from . import instrumentation
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\b\w+\b")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lower-case word tokens."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def estimate_sentiment(text: str) -> str:
+    """
+    Classify text as Positive, Negative or Neutral by counting words from the
+    lexicons on `Event`.  Shared by the chat view and the search indexes.
+    """
+    from .models import Event
+    words = tokenize(text)
+    pos_count = sum(1 for w in words if w in Event.POSITIVE_WORDS)
+    neg_count = sum(1 for w in words if w in Event.NEGATIVE_WORDS)
+    if pos_count > neg_count:
+        return "Positive"
+    if neg_count > pos_count:
+        return "Negative"
+    return "Neutral"
+
+
+def join_comment_text(observation, discussion, recommendation) -> str:
+    """Join the populated ODR fields of a comment into one document."""
+    return ' '.join(part for part in (observation, discussion, recommendation) if part)
+
+
+class DeadlineExceeded(Exception):
+    """A search gave up because its deadline passed."""
+
+
+# Rough bytes per posting: a (doc_idx, weight) tuple and its list slot.
+_POSTING_BYTES = 88
+
+
+def _estimate_nbytes(postings, documents) -> int:
+    """Approximate memory held by `postings` (lists by term) and `documents`."""
+    return (sum(len(entries) for entries in postings.values()) * _POSTING_BYTES
+            + sum(len(doc) for doc in documents))
+
+
+class EventIndex:
+    """An in-memory TF-IDF inverted index over one event's comments."""
+
+    def __init__(self, event_id: int, version: tuple, rows: list[tuple[int, str]]):
+        self.event_id = event_id
+        self.version = version
+        self.comment_ids = [comment_id for comment_id, _ in rows]
+        self.documents = [doc for _, doc in rows]
+        self.sentiments = [estimate_sentiment(doc) for doc in self.documents]
+
+        term_counts = [Counter(tokenize(doc)) for doc in self.documents]
+        doc_freq: Counter = Counter()
+        for counts in term_counts:
+            doc_freq.update(counts.keys())
+        n_docs = len(self.documents)
+        self.idf = {term: math.log((1 + n_docs) / (1 + df)) + 1.0 for term, df in doc_freq.items()}
+
+        postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+        for doc_idx, counts in enumerate(term_counts):
+            weights = {term: (1.0 + math.log(tf)) * self.idf[term] for term, tf in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, weight in weights.items():
+                postings[term].append((doc_idx, weight / norm))
+        self.postings = dict(postings)
+        self.nbytes = _estimate_nbytes(self.postings, self.documents)
+        self._embeddings: dict[str, object] = {}
+        # Embeddings of a previous version of the index: see `inherit_embeddings`.
+        self._inherited: dict[str, object] = {}
+        self._embeddings_lock = threading.Lock()
+        self._trigrams = None
+
+    @classmethod
+    def from_corpus(cls, corpus: corpus_cache.EventCorpus) -> 'EventIndex':
+        """
+        Build an index from a cached corpus, reusing its token ids instead of
+        tokenising the documents again.
+        """
+        terms = corpus_cache.vocabulary.terms
+        term_counts = [corpus.term_counts(doc_idx) for doc_idx in range(len(corpus))]
+        doc_freq: Counter = Counter()
+        for counts in term_counts:
+            doc_freq.update(counts.keys())
+        n_docs = len(corpus)
+        idf_by_id = {term_id: math.log((1 + n_docs) / (1 + df)) + 1.0 for term_id, df in doc_freq.items()}
+
+        postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+        for doc_idx, counts in enumerate(term_counts):
+            weights = {term_id: (1.0 + math.log(tf)) * idf_by_id[term_id] for term_id, tf in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term_id, weight in weights.items():
+                postings[terms[term_id]].append((doc_idx, weight / norm))
+
+        index = cls.__new__(cls)
+        index.event_id = corpus.event_id
+        index.version = (corpus.version, corpus.rewrites)
+        index.comment_ids = corpus.comment_ids
+        index.documents = corpus.texts
+        index.sentiments = [corpus.sentiment(doc_idx) for doc_idx in range(n_docs)]
+        index.idf = {terms[term_id]: value for term_id, value in idf_by_id.items()}
+        index.postings = dict(postings)
+        index.nbytes = _estimate_nbytes(index.postings, index.documents)
+        index._embeddings = {}
+        index._inherited = {}
+        index._embeddings_lock = threading.Lock()
+        index._trigrams = None
+        return index
+
+    @classmethod
+    def from_parts(cls, event_id: int, version: tuple, rows: list[tuple[int, str]], parts: dict) -> 'EventIndex':
+        """Rebuild an index from precomputed parts, as stored by `base.archive`."""
+        index = cls.__new__(cls)
+        index.event_id = event_id
+        index.version = version
+        index.comment_ids = [comment_id for comment_id, _ in rows]
+        index.documents = [doc for _, doc in rows]
+        index.sentiments = parts['sentiments']
+        index.idf = parts['idf']
+        index.postings = parts['postings']
+        index.nbytes = _estimate_nbytes(index.postings, index.documents)
+        index._embeddings = {}
+        index._inherited = {}
+        index._embeddings_lock = threading.Lock()
+        index._trigrams = None
+        return index
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def query_vector(self, query: str) -> dict[str, float]:
+        counts = Counter(term for term in tokenize(query) if term in self.idf)
+        weights = {term: (1.0 + math.log(tf)) * self.idf[term] for term, tf in counts.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {term: weight / norm for term, weight in weights.items()}
+
+    def inherit_embeddings(self, previous: 'EventIndex') -> None:
+        """
+        Keep the embeddings of `previous`, an older index of the same event,
+        if this index only appends comments to it, so that `embedding_matrix`
+        embeds just the new comments.
+        """
+        count = len(previous)
+        if (previous.version[1:] != self.version[1:] or count > len(self)
+                or (count and previous.comment_ids[count - 1] != self.comment_ids[count - 1])):
+            return
+        with previous._embeddings_lock:
+            self._inherited = {**previous._inherited, **previous._embeddings}
+
+    def _embed_tail(self, embedder, start: int, stop: int):
+        """Embeddings of documents `start` to `stop`, reusing inherited ones where possible."""
+        prefix = self._inherited.get(embedder.name)
+        known = min(prefix.rows, stop) if prefix is not None and prefix.rows > start else start
+        parts = [prefix.vectors(start, known)] if known > start else []
+        if known < stop:
+            parts.append(embedder.embed(self.documents[known:stop]))
+        return parts
+
+    def cached_embedding_matrix(self, embedder):
+        """The embeddings for `embedder` if they have been computed, else None."""
+        with self._embeddings_lock:
+            return self._embeddings.get(embedder.name)
+
+    def embedding_matrix(self, embedder):
+        """Embeddings of every document for `embedder`, computed once per index."""
+        from .embeddings import EmbeddingMatrix
+        with self._embeddings_lock:
+            matrix = self._embeddings.get(embedder.name)
+            if matrix is None:
+                matrix = EmbeddingMatrix.concat(self._embed_tail(embedder, 0, len(self)))
+                self._embeddings[embedder.name] = matrix
+                self._inherited.pop(embedder.name, None)
+            return matrix
+
+    def trigram_index(self):
+        """The character-trigram index of the documents, built on first use."""
+        from .trigrams import TrigramIndex
+        with self._embeddings_lock:
+            if self._trigrams is None:
+                with instrumentation.span('trigram_build'):
+                    self._trigrams = TrigramIndex(self.documents)
+            return self._trigrams
+
+    def search(self, query: str, k: int, sentiment: str | None = None,
+               deadline: float | None = None) -> list[tuple[float, int]]:
+        """
+        Return up to `k` ``(score, doc_idx)`` pairs, best first.  Raises
+        `DeadlineExceeded` if `time.perf_counter()` passes `deadline` before
+        every query term has been scored.
+        """
+        scores: dict[int, float] = defaultdict(float)
+        for term, q_weight in self.query_vector(query).items():
+            if deadline is not None and time.perf_counter() > deadline:
+                raise DeadlineExceeded
+            for doc_idx, d_weight in self.postings[term]:
+                scores[doc_idx] += q_weight * d_weight
+        if sentiment and sentiment != 'All':
+            scores = {i: s for i, s in scores.items() if self.sentiments[i] == sentiment}
+        return heapq.nlargest(k, ((score, doc_idx) for doc_idx, score in scores.items()))
+
+    def search_many(self, queries: list[str], k: int, sentiment: str | None = None) -> list[list[tuple[float, int]]]:
+        """
+        Score several queries in one pass over the postings.  Each term's
+        posting list is walked once for all queries that contain it, instead
+        of once per query.
+        """
+        by_term: dict[str, list[tuple[int, float]]] = defaultdict(list)
+        for query_idx, query in enumerate(queries):
+            for term, q_weight in self.query_vector(query).items():
+                by_term[term].append((query_idx, q_weight))
+        scores: list[dict[int, float]] = [defaultdict(float) for _ in queries]
+        for term, weighted_queries in by_term.items():
+            postings = self.postings[term]
+            for query_idx, q_weight in weighted_queries:
+                query_scores = scores[query_idx]
+                for doc_idx, d_weight in postings:
+                    query_scores[doc_idx] += q_weight * d_weight
+        filtered = sentiment and sentiment != 'All'
+        return [
+            heapq.nlargest(k, (
+                (score, doc_idx) for doc_idx, score in query_scores.items()
+                if not filtered or self.sentiments[doc_idx] == sentiment
+            ))
+            for query_scores in scores
+        ]
+
+
+_indexes: OrderedDict[int, EventIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+# Rebuilds in progress: event id -> (version, future).  Guarded by _indexes_lock.
+_building: dict[int, tuple[tuple, Future]] = {}
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executor_pid: int | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(pool: str = 'search') -> ThreadPoolExecutor:
+    global _executor_pid
+    with _executor_lock:
+        # Pools inherited from the pre-fork master (see base/warmup.py) have
+        # no threads in this process, so each process starts its own.
+        if _executor_pid != os.getpid():
+            _executor_pid = os.getpid()
+            _executors.clear()
+        if pool not in _executors:
+            workers = getattr(settings, 'DART_SEARCH_WORKERS', min(8, (os.cpu_count() or 1) + 4))
+            _executors[pool] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'dart-{pool}')
+        return _executors[pool]
+
+
+def _in_pool(func, *args, pool: str = 'search'):
+    """
+    Run `func` on a thread pool (searches and index builds each have their
+    own, so a burst of rebuilds does not hold up searches of ready indexes)
+    with the caller's context, so spans are attributed to the current
+    request, and release any database connection the worker thread opened.
+    """
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            return context.run(func, *args)
+        finally:
+            connections.close_all()
+
+    return _get_executor(pool).submit(run)
+
+
+def archived_event_ids(event_ids) -> set[int]:
+    from .models import Event
+    return set(Event.objects.filter(id__in=list(event_ids), archived_at__isnull=False).values_list('id', flat=True))
+
+
+def event_versions(event_ids) -> dict[int, tuple]:
+    """
+    Read the ``(comments_version, comments_rewrites)`` stamps of each event
+    in a single query.  Archived events (see `base.archive`) are versioned by
+    their archive.
+    """
+    from .models import Event
+    from .archive import ArchiveError, open_archive
+    versions = {event_id: (0, 0) for event_id in event_ids}
+    rows = Event.objects.filter(id__in=list(event_ids)).values_list(
+        'id', 'comments_version', 'comments_rewrites', 'archived_at'
+    )
+    for event_id, version, rewrites, archived_at in rows:
+        versions[event_id] = (version, rewrites)
+        if archived_at is not None:
+            try:
+                versions[event_id] = open_archive(event_id).version
+            except ArchiveError as e:
+                logger.error(f"Cannot read archive of event {event_id}: {e}")
+    return versions
+
+
+def _is_archived_version(version: tuple) -> bool:
+    return version[0] == 'archived'
+
+
+def load_event_rows(event_ids, versions: dict[int, tuple] | None = None) -> dict[int, list[tuple[int, str]]]:
+    """
+    Load ``(comment_id, document)`` pairs for the given events from their
+    cached corpora, reading archived events from their archive files.
+    """
+    from .archive import ArchiveError, open_archive
+    versions = versions if versions is not None else event_versions(event_ids)
+    rows: dict[int, list[tuple[int, str]]] = {event_id: [] for event_id in event_ids}
+    live = {}
+    for event_id in event_ids:
+        if _is_archived_version(versions[event_id]):
+            try:
+                rows[event_id] = open_archive(event_id).rows()
+            except ArchiveError as e:
+                logger.error(f"Cannot read archive of event {event_id}: {e}")
+        else:
+            live[event_id] = versions[event_id]
+    from . import segments
+    if segments.enabled():
+        for event_id, index in get_indexes(live).items():
+            rows[event_id] = list(zip(index.comment_ids, index.documents))
+    else:
+        for event_id, corpus in corpus_cache.get_corpora(live).items():
+            rows[event_id] = corpus.rows()
+    return rows
+
+
+def get_indexes(event_ids) -> dict[int, EventIndex]:
+    """
+    Return an up to date index for each event, rebuilding stale ones.  An
+    index that takes over `DART_INDEX_BUILD_TIMEOUT` seconds to rebuild is
+    replaced by the event's previous index; without one, `TimeoutError` is
+    raised.  The rebuild carries on in the background either way.
+    """
+    futures, previous = _index_futures(event_ids)
+    timeout = getattr(settings, 'DART_INDEX_BUILD_TIMEOUT', 120)
+    if not all(future.done() for future in futures.values()):
+        with instrumentation.span('index_build'):
+            wait(futures.values(), timeout=timeout)
+    indexes = {}
+    for event_id, future in futures.items():
+        if future.done():
+            # Waiters wake before the future's callbacks run; store the
+            # index now so that it is cached when this returns.
+            _built(event_id, future)
+            indexes[event_id] = future.result()
+        elif previous[event_id] is not None:
+            logger.error(f"Rebuilding the index of event {event_id} took over {timeout}s; "
+                         "using the previous index.")
+            indexes[event_id] = previous[event_id]
+        else:
+            raise FutureTimeout(f"Building the index of event {event_id} took over {timeout}s.")
+    return indexes
+
+
+def _index_futures(event_ids) -> tuple[dict[int, Future], dict[int, EventIndex | None]]:
+    """
+    A future of the up to date index of each event, already resolved unless
+    the index has to be rebuilt, and the index this process held before.
+    """
+    event_ids = list(event_ids)
+    versions = event_versions(event_ids)
+    with _indexes_lock:
+        current = {i: _indexes.get(i) for i in event_ids}
+        for event_id, index in current.items():
+            if index is not None:
+                _indexes.move_to_end(event_id)
+    futures = {}
+    for event_id, index in current.items():
+        if index is not None and index.version == versions[event_id]:
+            futures[event_id] = Future()
+            futures[event_id].set_result(index)
+        else:
+            futures[event_id] = _start_build(event_id, versions[event_id], index)
+    return futures, current
+
+
+def _build(event_id: int, version: tuple, previous: EventIndex | None) -> EventIndex:
+    if _is_archived_version(version):
+        # Archives carry their index; no need to rebuild it.
+        from .archive import open_archive
+        archive = open_archive(event_id)
+        index = EventIndex.from_parts(event_id, version, archive.rows(), archive.index_parts())
+    else:
+        from . import segments
+        if segments.enabled():
+            # Indexes are mapped from segment files shared by all processes.
+            index = segments.load_index(event_id, version)
+        else:
+            index = EventIndex.from_corpus(corpus_cache.get_corpora({event_id: version})[event_id])
+        if previous is not None:
+            index.inherit_embeddings(previous)
+    return index
+
+
+def _start_build(event_id: int, version: tuple, previous: EventIndex | None) -> Future:
+    """Rebuild an index on the build pool, joining a rebuild of the same version already under way."""
+    # The pool's connections cannot see the writes of a transaction the
+    # caller has open, so inside one the index is built in this thread.
+    inline = connection.in_atomic_block
+    with _indexes_lock:
+        building = _building.get(event_id)
+        if building is not None and building[0] == version:
+            return building[1]
+        future = Future() if inline else _in_pool(_build, event_id, version, previous, pool='index-build')
+        _building[event_id] = (version, future)
+    future.add_done_callback(partial(_built, event_id))
+    if inline:
+        try:
+            future.set_result(_build(event_id, version, previous))
+        except Exception as e:
+            future.set_exception(e)
+    return future
+
+
+def _built(event_id: int, future: Future) -> None:
+    """
+    Store a finished rebuild, unless a rebuild of a newer version has
+    superseded it or it was already stored.
+    """
+    error = future.exception()
+    budget = getattr(settings, 'DART_CORPUS_CACHE_BYTES', 256 * 1024 * 1024)
+    with _indexes_lock:
+        building = _building.get(event_id)
+        if building is None or building[1] is not future:
+            return
+        # Stored in the same step as the rebuild is retired, so that no
+        # caller in between finds neither and starts another.
+        del _building[event_id]
+        if error is not None:
+            logger.error(f"Rebuilding the index of event {event_id} failed: {error}")
+            return
+        _indexes[event_id] = future.result()
+        _indexes.move_to_end(event_id)
+        total = sum(index.nbytes for index in _indexes.values())
+        while total > budget and len(_indexes) > 1:
+            _, evicted = _indexes.popitem(last=False)
+            total -= evicted.nbytes
+
+
+def _drop_index(event_id: int) -> None:
+    with _indexes_lock:
+        _indexes.pop(event_id, None)
+
+
+def rebuild_indexes(event_ids) -> dict[int, EventIndex]:
+    """
+    Discard the cached corpora, indexes and segment files of the events and
+    build them again from the comments (recomputing each comment's terms and
+    sentiment).  Other processes keep their current, equivalent, indexes
+    until the event's comments next change.
+    """
+    from . import segments
+    event_ids = list(event_ids)
+    archived = archived_event_ids(event_ids)
+    for event_id in event_ids:
+        if event_id not in archived:
+            segments.remove_event(event_id)
+        corpus_cache.discard(event_id)
+        _drop_index(event_id)
+    return get_indexes(event_ids)
+
+
+corpus_cache.on_evict(_drop_index)
+
+
+def search_events(user, query: str, k: int = 10, sentiment: str | None = None,
+                  events: dict[int, str] | None = None) -> dict:
+    """
+    Search every event `user` is invited to and merge the results.
+
+    Returns a dictionary with the global top-k ``results`` (each carrying
+    the event, comment id, best passage, sentiment and distance), the number
+    of events searched, the names of any events ``skipped`` because their
+    index or their search was not ready by the deadline and the names of
+    any whose search ``failed``.  `events` (``{event_id: name}``) saves
+    looking up the user's invitations when the caller already has them.
+    """
+    start = time.perf_counter()
+    if events is None:
+        events = dict(user.invited_events.values_list('id', 'name'))
+    if not events or not query.strip():
+        return {'results': [], 'events_searched': 0, 'skipped': [], 'failed': [], 'elapsed': 0.0}
+
+    deadline = getattr(settings, 'DART_SEARCH_DEADLINE', 2.0)
+    deadline_at = start + deadline
+    indexes, candidates, skipped, failed = {}, [], [], []
+    searched = 0
+    with instrumentation.span('retrieval'):
+        # Each event is searched as soon as its index is ready; stale indexes
+        # are rebuilt on the build pool meanwhile.
+        builds = {future: event_id for event_id, future in _index_futures(events)[0].items()}
+        searches = {}
+        while builds or searches:
+            remaining = deadline_at - time.perf_counter()
+            if remaining <= 0:
+                break
+            done, _ = wait([*builds, *searches], timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in builds:
+                    event_id = builds.pop(future)
+                    if future.exception() is not None:
+                        failed.append(event_id)
+                    elif len(index := future.result()):
+                        indexes[event_id] = index
+                        searches[_in_pool(index.search, query, k, sentiment, deadline_at)] = event_id
+                    continue
+                event_id = searches.pop(future)
+                error = future.exception()
+                if isinstance(error, DeadlineExceeded):
+                    skipped.append(event_id)
+                elif error is not None:
+                    logger.error(f"Searching event {event_id} failed: {error}")
+                    failed.append(event_id)
+                else:
+                    searched += 1
+                    candidates.extend((score, event_id, doc_idx) for score, doc_idx in future.result())
+        for future in searches:
+            # Queued searches are cancelled; running ones stop at their next term.
+            future.cancel()
+        # Rebuilds still running carry on in the background.
+        skipped += [*builds.values(), *searches.values()]
+        top = heapq.nlargest(k, candidates)
+
+    from .passages import best_passage, snippet
+    results = []
+    for score, event_id, doc_idx in top:
+        index = indexes[event_id]
+        document = index.documents[doc_idx]
+        results.append({
+            'event_id': event_id,
+            'event_name': events[event_id],
+            'comment_id': index.comment_ids[doc_idx],
+            'passage': snippet(document, best_passage(document, query, index)[0]),
+            'sentiment': index.sentiments[doc_idx],
+            'distance': f"{(1 - score):.2f}",
+        })
+    if skipped:
+        logger.warning(f"Cross-event search skipped {len(skipped)} events that missed the {deadline}s deadline.")
+    return {
+        'results': results,
+        'events_searched': searched,
+        'skipped': sorted(events[event_id] for event_id in skipped),
+        'failed': sorted(events[event_id] for event_id in failed),
+        'elapsed': time.perf_counter() - start,
+    }
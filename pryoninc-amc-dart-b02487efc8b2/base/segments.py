@@ -0,0 +1,535 @@
+"""
+Search index and embedding segments shared between worker processes.
+
+Every gunicorn worker keeps its own search indexes, so the memory used by
+indexes and embeddings grows with the number of workers.  With segments an
+event's index is written once to an immutable file under
+`DART_SEGMENT_DIR`, and every worker maps that file read-only with `mmap`.
+The pages live in the operating system's page cache and are shared by all
+processes, so adding workers for throughput does not add index copies.
+
+File layout::
+
+    b'DARTSEG1'
+    u32 header length, header (JSON), padding to 8 bytes
+    uncompressed sections, each padded to 8 bytes
+
+The header records the event, the ``comments_version`` /
+``comments_rewrites`` stamps the segment was built at, the largest comment
+id it contains and each section's offset, length and array type code.  The
+sections hold the comment ids, the documents (one UTF-8 buffer and its
+offsets), one-byte sentiment codes, the sorted vocabulary with its IDF
+weights, and the postings in compressed sparse row form (per term offsets
+into parallel arrays of document numbers and float32 weights).  Nothing is
+decoded up front: terms are found by binary search and postings are read
+straight from the mapped pages.
+
+Embeddings are kept next to the segment, one ``.emb`` file per embedder,
+written by whichever process needs them first and mapped by the others.
+
+Comments added after a segment was written go to a small per-process delta:
+`SegmentIndex` searches the mapped segment and the delta as one index (new
+terms are weighted against the size of the whole event).  Once a delta
+reaches `DART_SEGMENT_MERGE_ROWS` comments, or the segment is older than
+`DART_SEGMENT_MERGE_INTERVAL` seconds, one process merges it into a new
+segment (guarded by a lock file) and the others pick the new file up on
+their next search.  Edited or deleted comments bump ``comments_rewrites``
+and the segment is rebuilt.  Set `DART_SEGMENT_DIR` to None to keep
+indexes in process memory instead.
+"""
+
+import bisect
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+from array import array
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .corpus import SENTIMENTS, TextColumn
+from .search import EventIndex, _estimate_nbytes, estimate_sentiment, join_comment_text, tokenize
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DARTSEG1'
+EMBEDDING_MAGIC = b'DARTEMB1'
+FORMAT_VERSION = 1
+_LENGTH = struct.Struct('<I')
+_EMBEDDING_HEADER = struct.Struct('<8sII')
+_SENTIMENT_CODES = {name: code for code, name in enumerate(SENTIMENTS)}
+_LOCK_TIMEOUT = 300
+
+
+class SegmentError(Exception):
+    """Raised when a segment file cannot be read."""
+
+
+def segment_dir() -> str | None:
+    directory = getattr(settings, 'DART_SEGMENT_DIR', os.path.join(settings.BASE_DIR, 'segments'))
+    return str(directory) if directory else None
+
+
+def enabled() -> bool:
+    return segment_dir() is not None
+
+
+def _event_dir(event_id: int) -> str:
+    return os.path.join(segment_dir(), f'event-{event_id}')
+
+
+def _pad(length: int) -> int:
+    return -length % 8
+
+
+# -- writing -------------------------------------------------------------
+
+def write_segment(index: EventIndex, last_id: int) -> 'Segment':
+    """Write `index` (built in process memory) to a new segment file and map it."""
+    comments_version, rewrites = index.version
+    text = bytearray()
+    text_offsets = array('Q', [0])
+    for document in index.documents:
+        text += document.encode('utf-8')
+        text_offsets.append(len(text))
+
+    terms = sorted(index.postings)
+    term_bytes = bytearray()
+    term_offsets = array('Q', [0])
+    posting_offsets = array('Q', [0])
+    posting_docs = array('I')
+    posting_weights = array('f')
+    for term in terms:
+        term_bytes += term.encode('utf-8')
+        term_offsets.append(len(term_bytes))
+        for doc_idx, weight in index.postings[term]:
+            posting_docs.append(doc_idx)
+            posting_weights.append(weight)
+        posting_offsets.append(len(posting_docs))
+
+    sections = {
+        'ids': array('q', index.comment_ids),
+        'text': array('B', bytes(text)),
+        'text_offsets': text_offsets,
+        'sentiments': array('b', (_SENTIMENT_CODES[s] for s in index.sentiments)),
+        'terms': array('B', bytes(term_bytes)),
+        'term_offsets': term_offsets,
+        'idf': array('d', (index.idf[term] for term in terms)),
+        'posting_offsets': posting_offsets,
+        'posting_docs': posting_docs,
+        'posting_weights': posting_weights,
+    }
+    header = {
+        'format': FORMAT_VERSION,
+        'event_id': index.event_id,
+        'comments_version': comments_version,
+        'comments_rewrites': rewrites,
+        'last_id': last_id,
+        'count': len(index.documents),
+        'created': time.time(),
+        'sections': {},
+    }
+    offset = 0
+    for name, values in sections.items():
+        length = values.itemsize * len(values)
+        header['sections'][name] = [offset, length, values.typecode]
+        offset += length + _pad(length)
+    encoded_header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+    directory = _event_dir(index.event_id)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{rewrites:010d}-{comments_version:010d}.seg')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(MAGIC)
+        handle.write(_LENGTH.pack(len(encoded_header)))
+        handle.write(encoded_header)
+        handle.write(b'\0' * _pad(len(MAGIC) + 4 + len(encoded_header)))
+        for values in sections.values():
+            data = values.tobytes()
+            handle.write(data)
+            handle.write(b'\0' * _pad(len(data)))
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote index segment {path} ({len(index.documents)} comments).")
+
+    segment = Segment(path)
+    with _segments_lock:
+        _segments[index.event_id] = segment
+    _remove_other_files(directory, path)
+    return segment
+
+
+def _file_stamps(name: str) -> tuple[int, int] | None:
+    """The ``(comments_rewrites, comments_version)`` a segment or embedding file was built at."""
+    rewrites, _, rest = name.partition('-')
+    version = rest.split('.', 1)[0]
+    if not (rewrites.isdigit() and version.isdigit()):
+        return None
+    return int(rewrites), int(version)
+
+
+def _remove_other_files(directory: str, keep: str) -> None:
+    """
+    Delete segments (and their embeddings) superseded by `keep`.  Processes
+    that still map them keep their pages.  Files built at later stamps were
+    written by another process in the meantime and are left alone.
+    """
+    kept = _file_stamps(os.path.basename(keep))
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.tmp'):
+            continue
+        stamps = _file_stamps(entry.name)
+        if stamps is None or stamps >= kept:
+            continue
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove superseded segment file {entry.path}: {e}")
+
+
+def remove_event(event_id: int) -> None:
+    """Delete all segments of an event, e.g. when it is archived."""
+    with _segments_lock:
+        _segments.pop(event_id, None)
+    if not enabled():
+        return
+    # Another process may be removing or merging the same event.
+    shutil.rmtree(_event_dir(event_id), ignore_errors=True)
+
+
+# -- reading -------------------------------------------------------------
+
+class _Terms:
+    """The sorted vocabulary of a segment, as a sequence `bisect` can search."""
+
+    def __init__(self, data: memoryview, offsets: memoryview):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+
+class _SentimentColumn:
+    def __init__(self, codes: memoryview):
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> str:
+        return SENTIMENTS[self.codes[i]]
+
+
+class Segment:
+    """A read-only mapping of one segment file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise SegmentError(f"{path} is not a DART index segment.")
+        (header_length,) = _LENGTH.unpack_from(self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(view[start:start + header_length]))
+        body = start + header_length
+        body += _pad(body)
+        sections = {
+            name: view[body + offset:body + offset + length].cast(typecode)
+            for name, (offset, length, typecode) in self.header['sections'].items()
+        }
+        self.event_id = self.header['event_id']
+        self.version = self.header['comments_version']
+        self.rewrites = self.header['comments_rewrites']
+        self.last_id = self.header['last_id']
+        self.count = self.header['count']
+        self.created = self.header['created']
+        self.comment_ids = sections['ids']
+        self.documents = TextColumn(sections['text'], sections['text_offsets'])
+        self.sentiments = _SentimentColumn(sections['sentiments'])
+        self.terms = _Terms(sections['terms'], sections['term_offsets'])
+        self.idf = sections['idf']
+        self._posting_offsets = sections['posting_offsets']
+        self._posting_docs = sections['posting_docs']
+        self._posting_weights = sections['posting_weights']
+        self._embeddings: dict[str, object] = {}
+        self._embeddings_lock = threading.Lock()
+
+    def lookup(self, term: str) -> int | None:
+        """The row of `term` in the vocabulary, or None."""
+        row = bisect.bisect_left(self.terms, term)
+        if row < len(self.terms) and self.terms[row] == term:
+            return row
+        return None
+
+    def postings(self, row: int) -> list[tuple[int, float]]:
+        start, end = self._posting_offsets[row], self._posting_offsets[row + 1]
+        return list(zip(self._posting_docs[start:end], self._posting_weights[start:end]))
+
+    def embedding_matrix(self, embedder, prefix=None):
+        """
+        Embeddings of the segment's documents, computed once and shared
+        through a file.  `prefix`, a matrix of the embeddings of the first
+        documents (such as those of the previous segment), saves embedding
+        them again.
+        """
+        from .embeddings import EmbeddingMatrix
+        with self._embeddings_lock:
+            matrix = self._embeddings.get(embedder.name)
+            if matrix is not None:
+                return matrix
+            slug = re.sub(r'[^\w.-]', '_', embedder.name)
+            path = f'{os.path.splitext(self.path)[0]}.{slug}.emb'
+            if not os.path.exists(path):
+                known = min(prefix.rows, self.count) if prefix is not None else 0
+                parts = [prefix.vectors(0, known)] if known else []
+                parts.append(embedder.embed(self.documents[known:]))
+                computed = EmbeddingMatrix.concat(parts)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as handle:
+                    handle.write(_EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, computed.rows, computed.dimensions))
+                    handle.write(computed.tobytes())
+                os.replace(tmp_path, path)
+            with open(path, 'rb') as handle:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, rows, dimensions = _EMBEDDING_HEADER.unpack_from(mapped)
+            if magic != EMBEDDING_MAGIC or rows != self.count:
+                raise SegmentError(f"{path} does not match its segment.")
+            matrix = EmbeddingMatrix.from_buffer(memoryview(mapped)[_EMBEDDING_HEADER.size:], rows, dimensions)
+            self._embeddings[embedder.name] = matrix
+            return matrix
+
+
+_segments: dict[int, Segment] = {}
+_segments_lock = threading.Lock()
+
+
+def latest_segment(event_id: int, version: int, rewrites: int) -> Segment | None:
+    """The newest segment of an event built at `rewrites` and no later than `version`."""
+    with _segments_lock:
+        segment = _segments.get(event_id)
+    if segment is not None and segment.rewrites == rewrites and segment.version == version:
+        return segment
+    directory = _event_dir(event_id)
+    if not os.path.isdir(directory):
+        return None
+    prefix = f'{rewrites:010d}-'
+    names = sorted(
+        (name for name in os.listdir(directory) if name.startswith(prefix) and name.endswith('.seg')),
+        reverse=True,
+    )
+    for name in names:
+        if int(name[len(prefix):-len('.seg')]) > version:
+            continue
+        if segment is not None and os.path.basename(segment.path) == name:
+            return segment
+        try:
+            segment = Segment(os.path.join(directory, name))
+        except (OSError, ValueError, SegmentError) as e:
+            # Superseded and removed by another process since the listing.
+            logger.info(f"Skipping segment {name} of event {event_id}: {e}")
+            continue
+        with _segments_lock:
+            _segments[event_id] = segment
+        return segment
+    return None
+
+
+# -- indexes -------------------------------------------------------------
+
+class _Chain:
+    """Read-only concatenation of two sequences."""
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __len__(self) -> int:
+        return len(self.first) + len(self.second)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        split = len(self.first)
+        if index < 0:
+            index += len(self)
+        return self.first[index] if index < split else self.second[index - split]
+
+    def __iter__(self):
+        yield from self.first
+        yield from self.second
+
+
+class _Idf:
+    def __init__(self, segment: Segment, delta: dict[str, float]):
+        self.segment = segment
+        self.delta = delta
+
+    def get(self, term: str, default=None):
+        row = self.segment.lookup(term)
+        if row is not None:
+            return self.segment.idf[row]
+        return self.delta.get(term, default)
+
+    def __contains__(self, term: str) -> bool:
+        return self.get(term) is not None
+
+    def __getitem__(self, term: str) -> float:
+        value = self.get(term)
+        if value is None:
+            raise KeyError(term)
+        return value
+
+
+class _Postings:
+    def __init__(self, segment: Segment, delta: dict[str, list[tuple[int, float]]]):
+        self.segment = segment
+        self.delta = delta
+
+    def __getitem__(self, term: str) -> list[tuple[int, float]]:
+        row = self.segment.lookup(term)
+        postings = self.segment.postings(row) if row is not None else []
+        return postings + self.delta.get(term, [])
+
+
+class SegmentIndex(EventIndex):
+    """
+    An `EventIndex` over a mapped segment plus the comments added since it
+    was written.  Scoring is inherited; only the storage differs.
+    """
+
+    def __init__(self, segment: Segment, version: tuple, delta_rows: list[tuple[int, str]]):
+        self.event_id = segment.event_id
+        self.version = version
+        self.segment = segment
+        self.delta_rows = delta_rows
+        delta_documents = [doc for _, doc in delta_rows]
+        self.comment_ids = _Chain(segment.comment_ids, [comment_id for comment_id, _ in delta_rows])
+        self.documents = _Chain(segment.documents, delta_documents)
+        self.sentiments = _Chain(segment.sentiments, [estimate_sentiment(doc) for doc in delta_documents])
+
+        term_counts = [Counter(tokenize(doc)) for doc in delta_documents]
+        doc_freq: Counter = Counter()
+        for counts in term_counts:
+            doc_freq.update(counts.keys())
+        n_docs = segment.count + len(delta_documents)
+        delta_idf = {
+            term: math.log((1 + n_docs) / (1 + df)) + 1.0
+            for term, df in doc_freq.items() if segment.lookup(term) is None
+        }
+        self.idf = _Idf(segment, delta_idf)
+        postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+        for offset, counts in enumerate(term_counts):
+            weights = {term: (1.0 + math.log(tf)) * self.idf[term] for term, tf in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for term, weight in weights.items():
+                postings[term].append((segment.count + offset, weight / norm))
+        self.postings = _Postings(segment, dict(postings))
+        # The segment is mapped and shared; only the delta is held privately.
+        self.nbytes = _estimate_nbytes(postings, delta_documents)
+        self._embeddings: dict[str, object] = {}
+        self._inherited: dict[str, object] = {}
+        self._embeddings_lock = threading.Lock()
+        self._trigrams = None
+
+    def embedding_matrix(self, embedder):
+        from .embeddings import EmbeddingMatrix, StackedMatrix
+        with self._embeddings_lock:
+            matrix = self._embeddings.get(embedder.name)
+            if matrix is None:
+                matrix = self.segment.embedding_matrix(embedder, self._inherited.get(embedder.name))
+                if self.delta_rows:
+                    delta = EmbeddingMatrix.concat(self._embed_tail(embedder, self.segment.count, len(self)))
+                    matrix = StackedMatrix(matrix, delta)
+                self._embeddings[embedder.name] = matrix
+                self._inherited.pop(embedder.name, None)
+            return matrix
+
+
+def _lock_path(event_id: int) -> str:
+    return os.path.join(_event_dir(event_id), 'merge.lock')
+
+
+def _acquire_merge_lock(event_id: int) -> bool:
+    path = _lock_path(event_id)
+    try:
+        if time.time() - os.stat(path).st_mtime > _LOCK_TIMEOUT:
+            # Left behind by a process that died while merging.
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        return False
+
+
+def _should_merge(segment: Segment, delta_rows: list) -> bool:
+    if not delta_rows:
+        return False
+    if len(delta_rows) >= getattr(settings, 'DART_SEGMENT_MERGE_ROWS', 1000):
+        return True
+    return time.time() - segment.created >= getattr(settings, 'DART_SEGMENT_MERGE_INTERVAL', 300)
+
+
+def _merge(segment: Segment, delta_rows: list[tuple[int, str]], version: tuple) -> Segment | None:
+    """Write a segment holding `segment` and `delta_rows`, unless another process is already merging."""
+    if not _acquire_merge_lock(segment.event_id):
+        return None
+    try:
+        rows = list(zip(segment.comment_ids, segment.documents)) + delta_rows
+        index = EventIndex(segment.event_id, version, rows)
+        return write_segment(index, max(segment.last_id, max(comment_id for comment_id, _ in delta_rows)))
+    finally:
+        try:
+            os.remove(_lock_path(segment.event_id))
+        except FileNotFoundError:
+            pass
+
+
+def load_index(event_id: int, version: tuple) -> SegmentIndex:
+    """
+    Return the index of a (not archived) event at `version`, its
+    ``(comments_version, comments_rewrites)`` stamps, writing or merging
+    segments as needed.
+    """
+    from .models import Comment
+    from . import corpus as corpus_cache
+    comments_version, rewrites = version
+    segment = latest_segment(event_id, comments_version, rewrites)
+    delta_rows: list[tuple[int, str]] = []
+    if segment is not None and segment.version != comments_version:
+        comments = Comment.objects.filter(event_id=event_id)
+        values = (
+            comments.filter(id__gt=segment.last_id).order_by('id')
+            .values_list('id', 'observation', 'discussion', 'recommendation')
+        )
+        delta_rows = [(comment_id, join_comment_text(o, d, r)) for comment_id, o, d, r in values]
+        if segment.count + len(delta_rows) != comments.count():
+            # A comment committed out of id order would be missed; rebuild.
+            segment, delta_rows = None, []
+    if segment is None:
+        corpus = corpus_cache.get_corpora({event_id: version})[event_id]
+        segment = write_segment(EventIndex.from_corpus(corpus), corpus.last_id)
+        # The segment now holds the documents; no need for a private copy.
+        corpus_cache.discard(event_id)
+    elif _should_merge(segment, delta_rows):
+        merged = _merge(segment, delta_rows, version)
+        if merged is not None:
+            segment, delta_rows = merged, []
+    return SegmentIndex(segment, version, delta_rows)
@@ -0,0 +1,244 @@
+"""
+Production static files: hashed, precompressed and served with long caching.
+
+Django only serves static files itself in debug mode, through a view that
+reads each file on every request with no compression and no caching
+headers.  In production DART serves them as follows:
+
+* `collectstatic` copies the assets into `STATIC_ROOT` (`staticfiles/`)
+  through `CompressedManifestStorage`.  Every file is also saved under a name
+  containing a hash of its content (``styles.css`` becomes
+  ``styles.3c5b6a1e2f09.css``), with the references inside CSS rewritten to
+  match, and `{% static %}` links to the hashed names.  A changed file
+  therefore gets a new URL, and browsers may cache every URL for good.
+  References to files that are missing (such as the icon fonts, which are
+  not shipped) are left as they are rather than failing the build.
+* The same storage writes a gzip (``.gz``) copy of every compressible file
+  and, when the optional `brotli` package is installed, a brotli (``.br``)
+  copy, keeping only those that are meaningfully smaller.  Compression thus
+  happens once at build time, at the highest level, instead of per request.
+* `StaticFilesMiddleware` serves `STATIC_URL` from `STATIC_ROOT` before the
+  rest of the middleware runs (no session, user or instrumentation work).
+  It indexes the files once at start-up, picks the smallest variant the
+  browser accepts, answers ``If-None-Match`` and ``If-Modified-Since`` with
+  304, and hands the file to the server with `FileResponse` (``sendfile``
+  under gunicorn).  Hashed files are sent with a one-year immutable
+  `Cache-Control`; other files for `DART_STATIC_MAX_AGE` seconds.
+
+The middleware is active when `DART_STATIC_SERVE` is true, which defaults to
+``not DEBUG``.  Files collected after start-up are served after a restart.
+"""
+
+import gzip
+import json
+import logging
+import mimetypes
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_EXTENSIONS = frozenset({
+    '.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico', '.scss',
+    '.eot', '.ttf', '.otf',
+})
+# Encodings in order of preference, with the suffix of their precompressed files.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """`ManifestStaticFilesStorage` that writes precompressed copies and tolerates missing references."""
+
+    # Only keep a compressed copy that saves at least this share of the file.
+    min_saving = 0.05
+    min_size = 256
+    _reported: set = set()
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # A file that was never collected; link to it unhashed rather than fail the page.
+            if name not in self._reported:
+                self._reported.add(name)
+                logger.warning(f"No hashed static file for '{name}'; linking to it unhashed.")
+            return name
+
+    def url_converter(self, name, hashed_files, template=None):
+        converter = super().url_converter(name, hashed_files, template)
+
+        def tolerant(matchobj):
+            try:
+                return converter(matchobj)
+            except ValueError:
+                if (name, matchobj[0]) not in self._reported:
+                    self._reported.add((name, matchobj[0]))
+                    logger.warning(f"Leaving {matchobj[0]} in {name} unchanged: the file it refers to is missing.")
+                return matchobj[0]
+        return tolerant
+
+    def post_process(self, paths, dry_run=False, **options):
+        names = []
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            yield name, hashed_name, processed
+            if not isinstance(processed, Exception):
+                names.append(name)
+        if dry_run:
+            return
+        if brotli is None:
+            logger.info("The brotli package is not installed; writing gzip copies only.")
+        for name in names:
+            for stored in {name, self.hashed_files.get(self.hash_key(self.clean_name(name)), name)}:
+                self._compress(stored)
+
+    def _compress(self, name: str) -> None:
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return
+        path = self.path(name)
+        with open(path, 'rb') as handle:
+            data = handle.read()
+        if len(data) < self.min_size:
+            return
+        variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants['.br'] = brotli.compress(data, quality=11)
+        for suffix, compressed in variants.items():
+            if len(compressed) <= len(data) * (1 - self.min_saving):
+                with open(path + suffix, 'wb') as handle:
+                    handle.write(compressed)
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+class _StaticFile:
+    __slots__ = ('path', 'size', 'mtime', 'content_type', 'cache_control', 'variants')
+
+    def __init__(self, path: str, st, cache_control: str):
+        self.path = path
+        self.size = st.st_size
+        self.mtime = int(st.st_mtime)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.cache_control = cache_control
+        # encoding -> (path, size)
+        self.variants: dict[str, tuple[str, int]] = {}
+
+    def etag(self, encoding: str | None, size: int) -> str:
+        suffix = f'-{encoding}' if encoding else ''
+        return f'"{self.mtime:x}-{size:x}{suffix}"'
+
+
+class StaticFilesMiddleware:
+    """Serve the collected static files (see the module docstring)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(settings, 'DART_STATIC_SERVE', not settings.DEBUG):
+            raise MiddlewareNotUsed
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        self.root = str(settings.STATIC_ROOT)
+        self.files = self._index()
+
+    def _index(self) -> dict[str, _StaticFile]:
+        if not os.path.isdir(self.root):
+            logger.warning(f"STATIC_ROOT {self.root} does not exist; run `manage.py collectstatic`.")
+            return {}
+        hashed = set()
+        manifest = os.path.join(self.root, CompressedManifestStorage.manifest_name)
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf-8') as handle:
+                hashed = set(json.load(handle).get('paths', {}).values())
+        max_age = getattr(settings, 'DART_STATIC_MAX_AGE', 60)
+        suffixes = {suffix for _, suffix in ENCODINGS}
+        files = {}
+        for directory, _, names in os.walk(self.root):
+            for filename in names:
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                base, suffix = os.path.splitext(path)
+                if suffix in suffixes and os.path.exists(base):
+                    continue
+                st = os.stat(path)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                cache_control = IMMUTABLE if relative in hashed else f'public, max-age={max_age}'
+                entry = _StaticFile(path, st, cache_control)
+                for encoding, encoded_suffix in ENCODINGS:
+                    if os.path.exists(path + encoded_suffix):
+                        entry.variants[encoding] = (path + encoded_suffix, os.path.getsize(path + encoded_suffix))
+                files[self.prefix + relative] = entry
+        logger.info(f"Serving {len(files)} static files from {self.root}.")
+        return files
+
+    def __call__(self, request):
+        if request.path_info.startswith(self.prefix) and request.method in ('GET', 'HEAD'):
+            entry = self.files.get(request.path_info)
+            if entry is not None:
+                return self.serve(request, entry)
+        return self.get_response(request)
+
+    @staticmethod
+    def _accepted_encodings(header: str) -> set[str]:
+        accepted = set()
+        for item in header.split(','):
+            coding, _, params = item.strip().partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(coding.strip().lower())
+        return accepted
+
+    def serve(self, request, entry: _StaticFile):
+        accepted = self._accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding, path, size = None, entry.path, entry.size
+        for candidate, _ in ENCODINGS:
+            if candidate in entry.variants and candidate in accepted:
+                encoding = candidate
+                path, size = entry.variants[candidate]
+                break
+        etag = entry.etag(encoding, size)
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(entry.mtime, usegmt=True),
+            'Cache-Control': entry.cache_control,
+        }
+        if entry.variants:
+            headers['Vary'] = 'Accept-Encoding'
+        if self._not_modified(request, etag, entry.mtime):
+            response = HttpResponseNotModified()
+        elif request.method == 'HEAD':
+            response = HttpResponse(content_type=entry.content_type)
+            headers['Content-Length'] = str(size)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=entry.content_type)
+            # FileResponse names the (possibly compressed) file it was given.
+            del response.headers['Content-Disposition']
+            headers['Content-Length'] = str(size)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        for name, value in headers.items():
+            response.headers[name] = value
+        return response
+
+    @staticmethod
+    def _not_modified(request, etag: str, mtime: int) -> bool:
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            return '*' in tags or etag in tags
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            try:
+                return int(parsedate_to_datetime(if_modified_since).timestamp()) >= mtime
+            except (TypeError, ValueError):
+                return False
+        return False
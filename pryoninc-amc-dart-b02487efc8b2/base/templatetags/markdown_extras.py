@@ -1,11 +1,11 @@
 from django import template
 from django.template.defaultfilters import stringfilter
-import markdown as md
-import bleach
+from django.utils.safestring import mark_safe
+from base.rendering import render_markdown
 
 register = template.Library()
 
 @register.filter()
 @stringfilter
 def markdown(value):
-    return md.markdown(value, extensions=['markdown.extensions.fenced_code'])
+    return mark_safe(render_markdown(value))
@@ -0,0 +1,77 @@
+"""Fixtures shared by the test modules."""
+
+import shutil
+import tempfile
+from datetime import date
+
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from base import corpus, embeddings, search, segments
+from base.models import Comment, Event
+
+
+def make_event(user, name: str = 'Exercise', **kwargs) -> Event:
+    event = Event.objects.create(
+        user=user, name=name, start_date=date(2026, 1, 1), end_date=date(2026, 1, 2),
+        vectordb_collection_key=Event()._generate_key(), **kwargs,
+    )
+    event.invitees.add(user)
+    return event
+
+
+def add_comment(event, user, observation: str, recommendation: str = 'Keep doing this.', **kwargs) -> Comment:
+    return Comment.objects.create(event=event, user=user, observation=observation,
+                                  recommendation=recommendation, **kwargs)
+
+
+class DartTestMixin:
+    """
+    Gives each test private archive, segment, journal and activity
+    directories, in-memory caches and empty per-process index and corpus
+    caches.  Segments, the comment journal and precomputation are off unless
+    a test switches them on.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp(prefix='dart-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        overrides = override_settings(
+            DART_ARCHIVE_DIR=f'{self.directory}/archive',
+            DART_SEGMENT_DIR=None,
+            DART_COMMENT_JOURNAL_DIR=None,
+            DART_LLM_ACTIVITY_DIR=None,
+            DART_PRECOMPUTE_ENABLED=False,
+            CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+                'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+            },
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.addCleanup(self._clear_caches)
+        self._clear_caches()
+
+    @staticmethod
+    def _clear_caches():
+        # Event ids are reused once a test's transaction is rolled back.
+        with search._indexes_lock:
+            search._indexes.clear()
+            search._building.clear()
+        with corpus._corpora_lock:
+            corpus._corpora.clear()
+        with segments._segments_lock:
+            segments._segments.clear()
+        with embeddings._embedders_lock:
+            embeddings._embedders.clear()
+
+
+class DartTestCase(DartTestMixin, TestCase):
+    """Each test runs in a transaction that is rolled back afterwards."""
+
+
+class DartTransactionTestCase(DartTestMixin, TransactionTestCase):
+    """For tests whose code writes from other threads, which cannot see a test's open transaction."""
+
+    # Outside a transaction reads are routed to the replica (a mirror of default).
+    databases = {'default', 'replica'}
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from base import access
+
+from .helpers import DartTestCase, make_event
+
+
+class CachedUserTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('observer', password='correct horse')
+        self.event = make_event(self.user)
+        self.client.force_login(self.user)
+
+    def test_cached_users_leave_out_the_password_hash(self):
+        self.client.get('/')
+        entry = caches['shared'].get(access._user_key(self.user.pk))
+        self.assertNotIn('password', entry['fields'])
+        self.assertNotIn(self.user.password, repr(entry))
+
+    def test_a_cached_user_needs_no_user_query(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connections['default']) as queries:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if 'FROM "auth_user"' in q['sql']])
+        self.assertFalse([q['sql'] for q in queries if 'django_session' in q['sql']])
+
+    def test_changing_the_password_ends_other_sessions(self):
+        self.client.get('/')
+        self.user.set_password('battery staple')
+        self.user.save()
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_sessions_survive_losing_the_cache(self):
+        self.client.get('/')
+        caches['shared'].clear()
+        self.assertEqual(self.client.get('/').status_code, 200)
+
+    def test_a_restored_user_keeps_its_password_when_saved(self):
+        self.client.get('/')
+        user = access.CachedModelBackend().get_user(self.user.pk)
+        user.first_name = 'Olive'
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('correct horse'))
@@ -0,0 +1,110 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from base import search
+from base.admin import CommentAdmin
+
+from .helpers import DartTestCase, add_comment, make_event
+
+CHANGELIST = '/admin/base/comment/'
+
+
+class CommentChangeListTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        self.client.force_login(self.admin)
+        self.event = make_event(self.admin)
+        self.ids = [add_comment(self.event, self.admin, f'Observation {i}.').id for i in range(5)]
+        per_page = mock.patch.object(CommentAdmin, 'list_per_page', 2)
+        per_page.start()
+        self.addCleanup(per_page.stop)
+
+    def changelist(self, query=''):
+        response = self.client.get(f'{CHANGELIST}?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def page(self, query=''):
+        cl = self.changelist(query)
+        return [comment.id for comment in cl.result_list], cl.previous_url, cl.next_url
+
+    def test_pages_by_key_in_both_directions(self):
+        newest = self.ids[::-1]
+        rows, previous_url, next_url = self.page()
+        self.assertEqual((rows, previous_url), (newest[:2], None))
+        self.assertEqual(next_url, f'?after={newest[1]}')
+
+        rows, previous_url, next_url = self.page(f'after={newest[3]}')
+        # The last page has no older link.
+        self.assertEqual((rows, next_url), (newest[4:], None))
+        self.assertEqual(previous_url, f'?before={newest[4]}')
+
+        rows, previous_url, next_url = self.page(f'before={newest[4]}')
+        self.assertEqual(rows, newest[2:4])
+        self.assertEqual((previous_url, next_url), (f'?before={newest[2]}', f'?after={newest[3]}'))
+
+        # Going back to the first page from the second.
+        rows, previous_url, next_url = self.page(f'before={newest[2]}')
+        self.assertEqual((rows, previous_url, next_url), (newest[:2], None, f'?after={newest[1]}'))
+
+    def test_sorting_by_a_column_falls_back_to_numbered_pages(self):
+        cl = self.changelist('o=1&p=2')
+        self.assertFalse(cl.keyset)
+        self.assertEqual((cl.paginator.num_pages, len(cl.result_list)), (3, 2))
+        self.assertEqual([comment.id for comment in cl.result_list], self.ids[2:4])
+
+    def test_changing_filters_drops_the_cursor(self):
+        cl = self.changelist(f'after={self.ids[3]}')
+        self.assertEqual(cl.get_query_string({'event__id__exact': self.event.id}),
+                         f'?event__id__exact={self.event.id}')
+        self.assertEqual(cl.get_query_string({'o': '1'}), '?o=1')
+        # The cursor is not taken for a field lookup.
+        self.assertEqual(len(self.changelist(f'after={self.ids[3]}&event__id__exact={self.event.id}').result_list), 2)
+
+    def test_search_within_an_event_uses_its_index(self):
+        match = add_comment(self.event, self.admin, 'The generator ran out of diesel.')
+        with mock.patch.object(search, 'get_indexes', wraps=search.get_indexes) as get_indexes:
+            cl = self.changelist(f'event__id__exact={self.event.id}&q=diesel')
+        get_indexes.assert_called_once_with([self.event.id])
+        self.assertEqual([comment.id for comment in cl.result_list], [match.id])
+
+        # Without an event the term is a comment id or an exact username.
+        with mock.patch.object(search, 'get_indexes') as get_indexes:
+            self.assertEqual(len(self.changelist('q=diesel').result_list), 0)
+            self.assertEqual(len(self.changelist('q=admin').result_list), 2)
+            self.assertEqual([comment.id for comment in self.changelist(f'q={self.ids[0]}').result_list],
+                             [self.ids[0]])
+        get_indexes.assert_not_called()
+
+    def test_query_count_does_not_grow_with_the_page_and_counts_are_cached(self):
+        with CaptureQueriesContext(connection) as first:
+            self.changelist()
+        with CaptureQueriesContext(connection) as again:
+            self.changelist()
+        # The exact count is cached, so the second load runs no COUNT.
+        self.assertTrue(any('COUNT(' in query['sql'] for query in first.captured_queries))
+        self.assertFalse([query['sql'] for query in again.captured_queries if 'COUNT(' in query['sql']])
+
+        other = User.objects.create_user('other')
+        for i in range(10):
+            add_comment(make_event(other, name=f'Drill {i}'), other, f'Late observation {i}.')
+        with mock.patch.object(CommentAdmin, 'list_per_page', 12):
+            with CaptureQueriesContext(connection) as larger:
+                cl = self.changelist()
+        self.assertEqual(len(cl.result_list), 12)
+        # No per-row queries for the related users and events.
+        self.assertEqual(len(larger.captured_queries), len(again.captured_queries))
+
+    def test_the_planner_estimate_replaces_count_on_unfiltered_lists(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        with CaptureQueriesContext(connection) as queries:
+            cl = self.changelist()
+        self.assertFalse([query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql']])
+        self.assertEqual(cl.result_count, 5)
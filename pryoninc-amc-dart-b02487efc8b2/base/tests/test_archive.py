@@ -0,0 +1,91 @@
+import os
+from unittest import mock
+
+from django.contrib.auth.models import User
+
+from base import archive, search
+from base.models import Chat, Comment, Event
+
+from .helpers import DartTestCase, add_comment, make_event
+
+
+class ArchiveRoundTripTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('planner')
+        self.event = make_event(self.user)
+        add_comment(self.event, self.user, 'The evacuation route was blocked by debris.', fingerprint='f' * 64)
+        add_comment(self.event, self.user, 'Volunteers arrived early and briefed well.', discussion='Good morale.')
+        Chat.objects.create(event=self.event, user=self.user, query_dict={'query': 'debris', 'summarize': True})
+
+    def snapshot(self):
+        comments = list(
+            Comment.objects.filter(event=self.event).order_by('id').values_list(
+                'id', 'user_id', 'observation', 'discussion', 'recommendation', 'fingerprint',
+                'created_at', 'updated_at')
+        )
+        chats = list(Chat.objects.filter(event=self.event).values_list(
+            'id', 'user_id', 'query_dict', 'summarize', 'created_at', 'updated_at'))
+        return comments, chats
+
+    def search(self, query):
+        index = search.get_indexes([self.event.id])[self.event.id]
+        return [index.comment_ids[doc_idx] for _, doc_idx in index.search(query, 5)]
+
+    def test_archive_then_rehydrate_restores_the_rows(self):
+        before = self.snapshot()
+        debris = self.search('debris')
+
+        described = archive.archive_event(self.event)
+        self.assertEqual((described['comments'], described['chats']), (2, 1))
+        self.assertTrue(os.path.exists(described['path']))
+        self.assertFalse(Comment.objects.filter(event=self.event).exists())
+        self.assertFalse(Chat.objects.filter(event=self.event).exists())
+        self.event.refresh_from_db()
+        self.assertIsNotNone(self.event.archived_at)
+        # Still searchable, from the archive.
+        self.assertEqual(self.search('debris'), debris)
+
+        self.assertEqual(archive.rehydrate_event(self.event), 2)
+        self.assertEqual(self.snapshot(), before)
+        self.assertFalse(os.path.exists(described['path']))
+        self.event.refresh_from_db()
+        self.assertIsNone(self.event.archived_at)
+        self.assertEqual(self.search('debris'), debris)
+
+    def test_an_archived_event_cannot_be_archived_again(self):
+        archive.archive_event(self.event)
+        with self.assertRaises(archive.ArchiveError):
+            archive.archive_event(self.event)
+
+    def test_a_comment_written_during_archiving_is_kept(self):
+        write = archive._write
+
+        def write_then_comment(*args):
+            size = write(*args)
+            add_comment(self.event, self.user, 'Posted while the archive was written.')
+            return size
+
+        with mock.patch.object(archive, '_write', side_effect=write_then_comment):
+            with self.assertRaisesMessage(archive.ArchiveError, 'changed while it was being archived'):
+                archive.archive_event(self.event)
+        self.assertEqual(Comment.objects.filter(event=self.event).count(), 3)
+        self.assertEqual(Chat.objects.filter(event=self.event).count(), 1)
+        self.assertIsNone(Event.objects.get(pk=self.event.pk).archived_at)
+        self.assertFalse(os.path.exists(archive.archive_path(self.event.id)))
+
+    def test_a_chat_updated_during_archiving_is_kept(self):
+        write = archive._write
+
+        def write_then_chat(*args):
+            size = write(*args)
+            chat = Chat.objects.get(event=self.event)
+            chat.query_dict = {**chat.query_dict, 'query': 'volunteers'}
+            chat.save()
+            return size
+
+        with mock.patch.object(archive, '_write', side_effect=write_then_chat):
+            with self.assertRaises(archive.ArchiveError):
+                archive.archive_event(self.event)
+        self.assertEqual(Chat.objects.get(event=self.event).query_dict['query'], 'volunteers')
+        self.assertEqual(Comment.objects.filter(event=self.event).count(), 2)
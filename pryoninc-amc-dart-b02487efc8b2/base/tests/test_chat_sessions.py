@@ -0,0 +1,53 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+
+from base import chat_sessions
+from base.model_router import AUTO, CHAT, ModelRouter
+from base.models import Chat
+from base.ollama_client import OllamaClient
+
+from .helpers import DartTestCase, make_event
+
+
+def fake_client() -> OllamaClient:
+    client = OllamaClient.__new__(OllamaClient)
+    client.client = mock.Mock()
+    client.models = ['large', 'tiny']
+    client.model_sizes = {'large': 40 * 10 ** 9, 'tiny': 10 ** 9}
+    client.converse = mock.Mock(return_value=('An answer.', [1, 2, 3]))
+    return client
+
+
+class PreloadTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('planner')
+        self.chat = Chat.objects.create(event=make_event(user), user=user, query_dict={})
+        self.router = ModelRouter()
+        self.client = fake_client()
+        for target, value in (('base.ollama_client.router', self.router),
+                              ('base.chat_sessions.OllamaClient', mock.Mock(return_value=self.client)),
+                              ('base.chat_sessions._get_preload_executor', mock.Mock())):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_preloading_registers_no_routing_trial(self):
+        chat_sessions.preload_async(self.client, AUTO, self.chat)
+        chat_sessions._get_preload_executor().submit.assert_called_once_with(self.client.preload, 'tiny', '30m')
+        self.assertEqual(self.router._trials, {})
+
+    def test_the_first_question_goes_to_the_preloaded_model(self):
+        chat_sessions.preload_async(self.client, AUTO, self.chat)
+        # Another chat's question takes tiny's trial in the meantime.
+        self.assertEqual(self.router.choose(CHAT, self.client.models, self.client.model_sizes), 'tiny')
+        chat_sessions.answer(self.chat, 'What went well?', ['Radios worked.'], AUTO)
+        self.assertEqual(self.client.converse.call_args.args[0], 'tiny')
+
+    def test_resetting_the_chat_forgets_the_pin(self):
+        chat_sessions.preload_async(self.client, AUTO, self.chat)
+        chat_sessions.reset(self.chat)
+        self.router.choose(CHAT, self.client.models, self.client.model_sizes)
+        chat_sessions.answer(self.chat, 'What went well?', ['Radios worked.'], AUTO)
+        self.assertEqual(self.client.converse.call_args.args[0], 'large')
@@ -0,0 +1,149 @@
+import json
+import os
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import OperationalError
+
+from base import comment_journal
+from base.models import Comment
+
+from .helpers import DartTestCase, DartTransactionTestCase, make_event
+
+
+def dead_pid() -> int:
+    """A pid that no running process has."""
+    pid = 4_000_000
+    while comment_journal._process_alive(pid):
+        pid += 1
+    return pid
+
+
+class JournalTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.journal_dir = os.path.join(self.directory, 'journal')
+        os.makedirs(self.journal_dir)
+        self.user = User.objects.create_user('participant')
+        self.event = make_event(self.user)
+
+    def record(self, record_id, event_id=None, observation='Sirens were hard to hear.'):
+        return {'id': record_id, 'user_id': self.user.id, 'event_id': event_id or self.event.id,
+                'observation': observation, 'discussion': '', 'recommendation': 'Add speakers.'}
+
+    def write_journal(self, records, pid=None, torn_tail=False) -> str:
+        path = os.path.join(self.journal_dir, f'comments-{pid or dead_pid()}.journal')
+        with open(path, 'wb') as handle:
+            for record in records:
+                handle.write(json.dumps(record).encode('utf-8') + b'\n')
+            if torn_tail:
+                handle.write(b'{"id": "torn", "user_')
+        return path
+
+    def fingerprints(self):
+        return sorted(
+            fingerprint[len(comment_journal._FINGERPRINT_PREFIX):]
+            for fingerprint in Comment.objects.filter(event=self.event).values_list('fingerprint', flat=True)
+        )
+
+
+class ReplayTests(JournalTestMixin, DartTestCase):
+    def test_orphaned_journals_are_replayed_and_removed(self):
+        self.write_journal([self.record('a'), self.record('b')], torn_tail=True)
+        self.assertEqual(comment_journal.replay_orphans(self.journal_dir), 2)
+        self.assertEqual(self.fingerprints(), ['a', 'b'])
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_replaying_a_committed_record_again_is_a_no_op(self):
+        self.write_journal([self.record('a')])
+        comment_journal.replay_orphans(self.journal_dir)
+        self.write_journal([self.record('a'), self.record('b')])
+        comment_journal.replay_orphans(self.journal_dir)
+        self.assertEqual(self.fingerprints(), ['a', 'b'])
+
+    def test_replay_starts_at_the_checkpoint(self):
+        path = self.write_journal([self.record('a'), self.record('b')])
+        with open(path, 'rb') as handle:
+            comment_journal._write_checkpoint(path, len(handle.readline()))
+        comment_journal.replay_orphans(self.journal_dir)
+        self.assertEqual(self.fingerprints(), ['b'])
+
+    def test_journals_of_running_processes_are_left_alone(self):
+        self.write_journal([self.record('a')], pid=os.getppid())
+        self.assertEqual(comment_journal.replay_orphans(self.journal_dir), 0)
+        self.assertEqual(self.fingerprints(), [])
+
+    def test_other_errors_are_raised_and_drop_nothing(self):
+        with mock.patch.object(comment_journal, '_insert', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                comment_journal._insert_or_drop([self.record('a')])
+
+    def test_a_failed_replay_leaves_the_journal_for_the_next_scan(self):
+        path = self.write_journal([self.record('a'), self.record('b')])
+        with mock.patch.object(comment_journal, '_insert', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                comment_journal.replay_orphans(self.journal_dir)
+        self.assertEqual(os.listdir(self.journal_dir), [os.path.basename(path)])
+        self.assertEqual(self.fingerprints(), [])
+        comment_journal.replay_orphans(self.journal_dir)
+        self.assertEqual(self.fingerprints(), ['a', 'b'])
+
+
+class DropTests(JournalTestMixin, DartTransactionTestCase):
+    # SQLite checks foreign keys when the transaction commits, which a
+    # rolled-back test transaction never does.
+
+    def test_records_the_database_rejects_are_dropped(self):
+        deleted = make_event(self.user, name='Deleted')
+        deleted_id = deleted.id
+        deleted.delete()
+        event_ids, dropped = comment_journal._insert_or_drop(
+            [self.record('a'), self.record('b', event_id=deleted_id), self.record('c')])
+        self.assertEqual(event_ids, {self.event.id})
+        self.assertEqual(list(dropped), ['b'])
+        self.assertEqual(self.fingerprints(), ['a', 'c'])
+
+
+class CommitterTests(JournalTestMixin, DartTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.journal = comment_journal.CommentJournal(self.journal_dir)
+
+    def test_a_submission_is_committed_and_the_journal_truncated(self):
+        pending = self.journal.submit(self.user.id, self.event.id, 'Sirens were hard to hear.', '', 'Add speakers.')
+        self.assertTrue(pending.wait(10))
+        self.assertEqual(self.fingerprints(), [pending.record['id']])
+        # The submitter is released before the journal is checkpointed.
+        deadline = time.monotonic() + 10
+        while os.path.getsize(self.journal.path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(os.path.getsize(self.journal.path), 0)
+
+    def test_a_group_is_retried_while_the_database_stays_locked(self):
+        insert = comment_journal._insert
+        attempts = []
+
+        def locked_twice(records):
+            attempts.append(len(records))
+            if len(attempts) <= 2:
+                raise OperationalError('database is locked')
+            return insert(records)
+
+        with mock.patch.object(comment_journal, '_insert', side_effect=locked_twice):
+            pending = self.journal.submit(self.user.id, self.event.id, 'Retried.', '', 'Keep it.')
+            self.assertTrue(pending.wait(10))
+        self.assertEqual(len(attempts), 3)
+        self.assertIsNone(pending.error)
+        self.assertEqual(self.fingerprints(), [pending.record['id']])
+
+    def test_a_rejected_submission_fails_without_holding_up_the_group(self):
+        deleted = make_event(self.user, name='Deleted')
+        deleted_id = deleted.id
+        deleted.delete()
+        rejected = self.journal.submit(self.user.id, deleted_id, 'Too late.', '', 'None.')
+        accepted = self.journal.submit(self.user.id, self.event.id, 'On time.', '', 'None.')
+        self.assertTrue(accepted.wait(10))
+        self.assertFalse(rejected.wait(10))
+        self.assertIsNotNone(rejected.error)
+        self.assertEqual(self.fingerprints(), [accepted.record['id']])
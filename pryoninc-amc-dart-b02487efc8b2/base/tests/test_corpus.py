@@ -0,0 +1,120 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from base import corpus, search
+from base.models import Comment, Event
+
+from .helpers import DartTestCase, add_comment, make_event
+
+
+class CorpusCacheTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('scribe')
+        self.event = make_event(self.user)
+        self.first = add_comment(self.event, self.user, 'Shelter beds were ready on time.')
+        self.second = add_comment(self.event, self.user, 'Water supply ran short by noon.')
+
+    def load(self):
+        return corpus.get_corpora(search.event_versions([self.event.id]))[self.event.id]
+
+    def test_an_unchanged_event_returns_the_cached_corpus(self):
+        loaded = self.load()
+        self.assertIs(self.load(), loaded)
+
+    def test_new_comments_are_appended(self):
+        loaded = self.load()
+        add_comment(self.event, self.user, 'Medical tent was understaffed.')
+        refresh, refreshed = corpus._refresh, []
+
+        def record(*args):
+            refreshed.append(refresh(*args))
+            return refreshed[-1]
+
+        with mock.patch.object(corpus, '_refresh', side_effect=record):
+            appended = self.load()
+        self.assertEqual(refreshed, [appended])
+        self.assertEqual(len(loaded), 2)  # the cached copy is not modified in place
+        self.assertEqual(list(appended.comment_ids[:2]), list(loaded.comment_ids))
+        self.assertEqual(len(appended), 3)
+        self.assertEqual(appended.rewrites, loaded.rewrites)
+
+    def test_edits_and_deletions_force_a_reload(self):
+        loaded = self.load()
+        self.first.observation = 'Shelter beds were late.'
+        self.first.save()
+        with mock.patch.object(corpus, '_refresh') as refresh:
+            edited = self.load()
+        refresh.assert_not_called()
+        self.assertGreater(edited.rewrites, loaded.rewrites)
+        self.assertIn('Shelter beds were late.', ' '.join(edited.texts))
+
+        Comment.objects.filter(pk=self.second.pk).delete()
+        with mock.patch.object(corpus, '_refresh') as refresh:
+            deleted = self.load()
+        refresh.assert_not_called()
+        self.assertEqual(list(deleted.comment_ids), [self.first.pk])
+
+    def test_a_comment_committed_out_of_id_order_forces_a_reload(self):
+        late = add_comment(self.event, self.user, 'Committed with a high id.', id=self.second.pk + 10)
+        loaded = self.load()
+        self.assertEqual(loaded.last_id, late.pk)
+        # A lower id committed afterwards is invisible to "id > last_id".
+        add_comment(self.event, self.user, 'Committed later with a lower id.', id=self.second.pk + 5)
+        reloaded = self.load()
+        self.assertEqual(sorted(reloaded.comment_ids),
+                         sorted(Comment.objects.filter(event=self.event).values_list('id', flat=True)))
+        self.assertEqual(len(reloaded), 4)
+
+
+class CommentVersionTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('author')
+        self.event = make_event(self.user)
+
+    def stamps(self, event=None):
+        return Event.objects.values_list('comments_version', 'comments_rewrites').get(pk=(event or self.event).pk)
+
+    def test_adding_bumps_the_version_and_editing_the_rewrites(self):
+        before = self.stamps()
+        comment = add_comment(self.event, self.user, 'Added.')
+        added = self.stamps()
+        self.assertEqual((added[0] - before[0], added[1] - before[1]), (1, 0))
+        comment.save()
+        self.assertEqual(self.stamps()[1], added[1] + 1)
+
+    def test_deleting_comments_takes_the_same_queries_however_many_and_bumps_the_rewrites(self):
+        def delete_all():
+            with CaptureQueriesContext(connection) as queries:
+                Comment.objects.filter(event=self.event).delete()
+            return len(queries)
+
+        for i in range(3):
+            add_comment(self.event, self.user, f'Small batch {i}.')
+        small = delete_all()
+        for i in range(40):
+            add_comment(self.event, self.user, f'Large batch {i}.')
+        rewrites = self.stamps()[1]
+        self.assertEqual(delete_all(), small)
+        self.assertEqual(self.stamps()[1], rewrites + 1)
+
+    def test_deleting_a_single_comment_bumps_the_rewrites(self):
+        comment = add_comment(self.event, self.user, 'Soon gone.')
+        rewrites = self.stamps()[1]
+        comment.delete()
+        self.assertEqual(self.stamps()[1], rewrites + 1)
+
+    def test_deleting_a_user_bumps_the_events_they_commented_on(self):
+        owner = User.objects.create_user('owner')
+        other = make_event(owner, name='Other exercise')
+        leaving = User.objects.create_user('leaving')
+        add_comment(other, leaving, 'Will be removed with the user.')
+        add_comment(other, owner, 'Stays.')
+        rewrites = self.stamps(other)[1]
+        leaving.delete()
+        self.assertEqual(self.stamps(other)[1], rewrites + 1)
+        self.assertEqual(list(Comment.objects.filter(event=other).values_list('observation', flat=True)), ['Stays.'])
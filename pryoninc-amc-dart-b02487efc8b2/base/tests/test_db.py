@@ -0,0 +1,83 @@
+from unittest import mock
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+
+from base.db import STICKY_COOKIE, PrimaryPinMiddleware, ReplicaRouter, configure_connection, use_primary
+from base.models import Comment
+
+
+@override_settings(DART_DB_REPLICAS=['replica'], DART_DB_STICKY_SECONDS=5)
+class ReplicaRouterTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request):
+        """The alias reads are sent to while `request` goes through the middleware, and the response."""
+        routed = []
+
+        def view(request):
+            routed.append(self.router.db_for_read(Comment))
+            return HttpResponse()
+
+        response = PrimaryPinMiddleware(view)(request)
+        return routed[0], response
+
+    def test_reads_go_to_the_replica_and_writes_to_default(self):
+        self.assertEqual(self.router.db_for_read(Comment), 'replica')
+        self.assertEqual(self.router.db_for_write(Comment), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.route(self.factory.get('/'))[0], 'replica')
+
+    def test_reads_stay_on_default_inside_a_transaction_or_use_primary(self):
+        with transaction.atomic():
+            self.assertEqual(self.router.db_for_read(Comment), DEFAULT_DB_ALIAS)
+        with use_primary():
+            self.assertEqual(self.router.db_for_read(Comment), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.router.db_for_read(Comment), 'replica')
+
+    @override_settings(DART_DB_REPLICAS=[])
+    def test_reads_go_to_default_without_replicas(self):
+        self.assertEqual(self.router.db_for_read(Comment), DEFAULT_DB_ALIAS)
+
+    def test_a_write_pins_the_user_to_default_for_the_sticky_period(self):
+        alias, response = self.route(self.factory.post('/'))
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        cookie = response.cookies[STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertTrue(cookie['httponly'])
+
+        pinned = self.factory.get('/')
+        pinned.COOKIES[STICKY_COOKIE] = cookie.value
+        alias, response = self.route(pinned)
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        # Reads do not extend the pin.
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    @override_settings(DART_DB_STICKY_SECONDS=0)
+    def test_no_pin_when_the_sticky_period_is_zero(self):
+        alias, response = self.route(self.factory.post('/'))
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+@override_settings(DART_SQLITE_PRAGMAS={'journal_mode': 'wal', 'synchronous': 'normal'})
+class ConfigureConnectionTests(SimpleTestCase):
+    def pragmas(self, name, vendor='sqlite'):
+        connection = mock.MagicMock(vendor=vendor, settings_dict={'NAME': name})
+        configure_connection(sender=None, connection=connection)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        return [call.args[0] for call in cursor.execute.call_args_list]
+
+    def test_the_writer_gets_every_pragma(self):
+        self.assertEqual(self.pragmas('/srv/dart/db.sqlite3'),
+                         ['PRAGMA journal_mode = wal', 'PRAGMA synchronous = normal'])
+
+    def test_read_only_connections_leave_the_journal_mode_alone(self):
+        self.assertEqual(self.pragmas('file:///srv/dart/db.sqlite3?mode=ro'), ['PRAGMA synchronous = normal'])
+
+    def test_other_databases_are_left_alone(self):
+        self.assertEqual(self.pragmas('dart', vendor='postgresql'), [])
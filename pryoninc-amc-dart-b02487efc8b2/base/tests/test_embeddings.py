@@ -0,0 +1,49 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from base import embeddings
+from base.embeddings import HashingEmbedder, OllamaEmbedder, get_embedder
+
+
+def fake_client(models):
+    client = mock.Mock(models=models)
+    client.client = mock.Mock()
+    return client
+
+
+@override_settings(DART_EMBEDDING_MODEL='nomic-embed-text')
+class GetEmbedderTests(SimpleTestCase):
+    def setUp(self):
+        embeddings._embedders.clear()
+        self.addCleanup(embeddings._embedders.clear)
+
+    def test_the_ollama_embedder_is_made_once_per_process(self):
+        with mock.patch('base.ollama_client.OllamaClient', return_value=fake_client(['nomic-embed-text'])) as client:
+            first = get_embedder()
+            self.assertIsInstance(first, OllamaEmbedder)
+            self.assertIs(get_embedder(), first)
+        self.assertEqual(client.call_count, 1)
+
+    def test_an_unreachable_server_falls_back_to_hashing_and_is_retried_later(self):
+        with mock.patch('base.ollama_client.OllamaClient', return_value=fake_client([])) as client, \
+                mock.patch('base.embeddings.time.monotonic', return_value=100.0):
+            self.assertIsInstance(get_embedder(), HashingEmbedder)
+            self.assertIsInstance(get_embedder(), HashingEmbedder)
+        self.assertEqual(client.call_count, 1)
+
+        with mock.patch('base.ollama_client.OllamaClient', return_value=fake_client(['nomic-embed-text'])), \
+                mock.patch('base.embeddings.time.monotonic', return_value=100.0 + embeddings._RETRY_SECONDS):
+            self.assertIsInstance(get_embedder(), OllamaEmbedder)
+
+    def test_no_client_falls_back_to_hashing(self):
+        client = fake_client(['nomic-embed-text'])
+        client.client = None
+        with mock.patch('base.ollama_client.OllamaClient', return_value=client):
+            self.assertIsInstance(get_embedder(), HashingEmbedder)
+
+    @override_settings(DART_EMBEDDING_MODEL=None)
+    def test_no_model_configured_uses_hashing(self):
+        with mock.patch('base.ollama_client.OllamaClient') as client:
+            self.assertIsInstance(get_embedder(), HashingEmbedder)
+        client.assert_not_called()
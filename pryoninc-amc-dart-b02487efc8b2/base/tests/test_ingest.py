@@ -0,0 +1,223 @@
+import io
+import json
+import zipfile
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.utils import timezone
+
+from base import ingest
+from base.models import Comment, CommentUpload
+
+from .helpers import DartTestCase, make_event
+
+CSV = (
+    b'observation,discussion,recommendation\n'
+    b'Radios failed,,Carry spares\n'
+    b'Maps were outdated,Teams got lost,Print new maps\n'
+    b'Radios failed,,Carry spares\n'
+    b'Catering was late,,Order earlier\n'
+    b',,\n'
+)
+
+
+def upload(name='comments.csv', content=CSV):
+    return SimpleUploadedFile(name, content, content_type='text/csv')
+
+
+def xlsx(rows: list[list]) -> bytes:
+    """
+    A minimal workbook: strings in the header row are shared, the others
+    inline, and None leaves a cell out.
+    """
+    shared = [value for value in rows[0] if value is not None]
+    xml_rows = []
+    for number, row in enumerate(rows, start=1):
+        cells = []
+        for column, value in enumerate(row):
+            ref = f'{chr(ord("A") + column)}{number}'
+            if value is None:
+                continue
+            if number == 1:
+                cells.append(f'<c r="{ref}" t="s"><v>{shared.index(value)}</v></c>')
+            elif isinstance(value, str):
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t>{value}</t></is></c>')
+            else:
+                cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+        xml_rows.append(f'<row r="{number}">{"".join(cells)}</row>')
+    namespace = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w') as workbook:
+        workbook.writestr('xl/sharedStrings.xml', f'<sst {namespace}>'
+                          + ''.join(f'<si><t>{value}</t></si>' for value in shared) + '</sst>')
+        workbook.writestr('xl/worksheets/sheet1.xml',
+                          f'<worksheet {namespace}><sheetData>{"".join(xml_rows)}</sheetData></worksheet>')
+    return content.getvalue()
+
+
+def archive(members: dict[str, bytes]) -> bytes:
+    content = io.BytesIO()
+    with zipfile.ZipFile(content, 'w') as zipped:
+        for name, data in members.items():
+            zipped.writestr(name, data)
+    return content.getvalue()
+
+
+@override_settings(DART_INGEST_BATCH_SIZE=2, DART_INGEST_WORKERS=1)
+class UploadResumeTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('importer')
+        self.event = make_event(self.user)
+
+    def comments(self):
+        return list(Comment.objects.filter(event=self.event).order_by('id').values_list('observation', flat=True))
+
+    def test_imports_every_row_including_repeats(self):
+        report = ingest.ingest_files(self.event, self.user, [upload()])
+        self.assertEqual(report.errors, [])
+        self.assertEqual((report.rows, report.skipped), (4, 1))
+        self.assertEqual(self.comments(), ['Radios failed', 'Maps were outdated', 'Radios failed', 'Catering was late'])
+        stored = CommentUpload.objects.get(event=self.event)
+        self.assertEqual((stored.status, stored.rows_total, stored.rows_committed), (CommentUpload.COMPLETE, 4, 4))
+
+    def test_reimporting_a_completed_file_is_a_no_op(self):
+        ingest.ingest_files(self.event, self.user, [upload()])
+        report = ingest.ingest_files(self.event, self.user, [upload('renamed.csv')])
+        self.assertEqual((report.duplicate_files, report.rows), (1, 0))
+        self.assertEqual(len(self.comments()), 4)
+
+    def test_a_failed_import_resumes_after_its_last_committed_batch(self):
+        write_rows = ingest.write_rows
+        calls = []
+
+        def fail_on_second_batch(*args):
+            calls.append(args[-1])
+            if len(calls) == 2:
+                raise OSError('disk full')
+            return write_rows(*args)
+
+        with mock.patch.object(ingest, 'write_rows', side_effect=fail_on_second_batch):
+            report = ingest.ingest_files(self.event, self.user, [upload()])
+        self.assertEqual(report.errors, ['comments.csv: disk full'])
+        stored = CommentUpload.objects.get(event=self.event)
+        self.assertEqual((stored.status, stored.rows_committed), (CommentUpload.FAILED, 2))
+
+        with mock.patch.object(ingest, 'write_rows', side_effect=write_rows) as retried:
+            report = ingest.ingest_files(self.event, self.user, [upload()])
+        self.assertEqual((report.resumed_files, report.rows, report.duplicate_rows), (1, 2, 0))
+        self.assertEqual([len(call.args[-1]) for call in retried.call_args_list], [2])
+        self.assertEqual(self.comments(), ['Radios failed', 'Maps were outdated', 'Radios failed', 'Catering was late'])
+        self.assertEqual(CommentUpload.objects.get(event=self.event).status, CommentUpload.COMPLETE)
+
+    def test_rows_already_on_the_event_are_not_duplicated(self):
+        ingest.ingest_files(self.event, self.user, [upload()])
+        # Same rows in a different file: the file is new, its rows are not.
+        report = ingest.ingest_files(self.event, self.user, [upload(content=CSV + b'Extra row,,More\n')])
+        self.assertEqual((report.rows, report.duplicate_rows), (1, 4))
+        self.assertEqual(len(self.comments()), 5)
+
+    def test_an_upload_claimed_by_another_import_is_left_alone(self):
+        ingest.ingest_files(self.event, self.user, [upload()])
+        stored = CommentUpload.objects.get(event=self.event)
+        CommentUpload.objects.filter(pk=stored.pk).update(
+            status=CommentUpload.RUNNING, rows_committed=0, updated_at=timezone.now())
+        Comment.objects.filter(event=self.event).delete()
+
+        report = ingest.ingest_files(self.event, self.user, [upload()])
+        self.assertEqual(report.errors, ['comments.csv: it is being imported by another request.'])
+        self.assertEqual(self.comments(), [])
+
+    def test_an_abandoned_claim_is_taken_over(self):
+        ingest.ingest_files(self.event, self.user, [upload()])
+        stored = CommentUpload.objects.get(event=self.event)
+        CommentUpload.objects.filter(pk=stored.pk).update(
+            status=CommentUpload.RUNNING, rows_committed=2, updated_at=timezone.now() - timedelta(hours=1))
+
+        with self.settings(DART_INGEST_CLAIM_TIMEOUT=600):
+            report = ingest.ingest_files(self.event, self.user, [upload()])
+        self.assertEqual(report.errors, [])
+        self.assertEqual(report.resumed_files, 1)
+        self.assertEqual(CommentUpload.objects.get(pk=stored.pk).status, CommentUpload.COMPLETE)
+
+    def test_claim_succeeds_once(self):
+        stored = CommentUpload.objects.create(event=self.event, user=self.user, sha256='0' * 64, name='a.csv')
+        other = CommentUpload.objects.get(pk=stored.pk)
+        self.assertTrue(ingest.claim(stored))
+        self.assertFalse(ingest.claim(other))
+        self.assertEqual(other.status, CommentUpload.RUNNING)
+
+
+@override_settings(DART_INGEST_WORKERS=1)
+class FormatTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('importer')
+        self.event = make_event(self.user)
+
+    def ingest(self, *files):
+        report = ingest.ingest_files(self.event, self.user, list(files))
+        self.assertEqual(report.errors, [])
+        rows = Comment.objects.filter(event=self.event).order_by('id')
+        return report, list(rows.values_list('observation', 'discussion', 'recommendation'))
+
+    def test_header_aliases(self):
+        content = b'\xef\xbb\xbf Observations ,Disc.,RECS,Notes\nRadios failed,Too few spares,Carry spares,ignored\n'
+        self.assertEqual(self.ingest(upload(content=content))[1],
+                         [('Radios failed', 'Too few spares', 'Carry spares')])
+        self.assertEqual(ingest._normalise({'Obs': ' Late ', 'rec': None, 'Unknown': 'x'}), ('Late', '', ''))
+        self.assertIsNone(ingest._normalise({'observation': ' ', 'notes': 'x'}))
+
+    def test_json_lists_and_comment_objects(self):
+        rows = [{'observation': 'Maps were outdated', 'recommendation': 'Print new maps'},
+                {'Obs': 'Catering was late', 'Rec': 'Order earlier'}]
+        report, comments = self.ingest(upload('list.json', json.dumps(rows).encode()),
+                                       upload('object.json', json.dumps({'comments': rows[:1] + [{}]}).encode()))
+        self.assertEqual((report.rows, report.skipped, report.duplicate_rows), (2, 1, 1))
+        self.assertEqual(comments, [('Maps were outdated', '', 'Print new maps'),
+                                    ('Catering was late', '', 'Order earlier')])
+
+    def test_json_lines(self):
+        content = b'{"observation": "Radios failed"}\n\n{"observations": "Radios failed"}\n[1, 2]\n'
+        report, comments = self.ingest(upload('comments.jsonl', content))
+        # Both rows are kept; a record that is not an object is skipped.
+        self.assertEqual((report.rows, report.skipped), (2, 1))
+        self.assertEqual(comments, [('Radios failed', '', '')] * 2)
+
+    def test_xlsx(self):
+        content = xlsx([
+            ['Observation', 'Discussion', 'Recommendations'],
+            ['Radios failed', None, 'Carry spares'],
+            [None, None, None],
+            ['Generator ran', 12, 'Refuel earlier'],
+        ])
+        report, comments = self.ingest(upload('comments.xlsx', content))
+        self.assertEqual(comments, [('Radios failed', '', 'Carry spares'), ('Generator ran', '12', 'Refuel earlier')])
+
+    def test_zip_archives_are_expanded(self):
+        content = archive({
+            'day1/comments.csv': b'obs,rec\nRadios failed,Carry spares\n',
+            'day2/comments.jsonl': b'{"obs": "Maps were outdated"}\n',
+            'day3/comments.xlsx': xlsx([['Observation'], ['Catering was late']]),
+            'readme.txt': b'not comments',
+            '__MACOSX/._comments.csv': b'',
+            'day4/.hidden.csv': b'obs\nHidden\n',
+        })
+        report, comments = self.ingest(upload('export.zip', content))
+        self.assertEqual(report.files, 3)
+        self.assertEqual(sorted(observation for observation, _, _ in comments),
+                         ['Catering was late', 'Maps were outdated', 'Radios failed'])
+        self.assertEqual(sorted(CommentUpload.objects.filter(event=self.event).values_list('name', flat=True)),
+                         ['export.zip/day1/comments.csv', 'export.zip/day2/comments.jsonl',
+                          'export.zip/day3/comments.xlsx'])
+
+    def test_unsupported_and_corrupt_files_are_reported(self):
+        report = ingest.ingest_files(self.event, self.user, [upload('notes.txt', b'x'), upload('broken.zip', b'x'),
+                                                             upload('broken.json', b'{')])
+        self.assertEqual(report.errors[0], "notes.txt: unsupported file type '.txt'")
+        self.assertTrue(report.errors[1].startswith('broken.zip: '))
+        self.assertTrue(report.errors[2].startswith('broken.json: '))
+        self.assertEqual(report.rows, 0)
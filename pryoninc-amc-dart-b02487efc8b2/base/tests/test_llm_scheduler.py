@@ -0,0 +1,132 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from base import llm_scheduler
+from base.llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, SchedulerBusy
+from base.ollama_client import OllamaClient
+
+
+@override_settings(DART_LLM_CONCURRENCY={'default': 1}, DART_LLM_MAX_QUEUE=8, DART_LLM_MAX_WAIT=10.0,
+                   DART_LLM_ACTIVITY_DIR=None)
+class LLMSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = LLMScheduler()
+        self.threads = []
+        self.outcomes = {}
+
+    def tearDown(self):
+        for thread in self.threads:
+            thread.join(10)
+
+    def start(self, prompt, func, priority=INTERACTIVE, name=None):
+        """Run a call on another thread, recording its result or error under `name`."""
+        def target():
+            try:
+                self.outcomes[name or prompt] = self.scheduler.run('m', prompt, func, priority=priority)
+            except Exception as e:
+                self.outcomes[name or prompt] = e
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        self.threads.append(thread)
+        return thread
+
+    def hold_slot(self):
+        """Occupy the model's only slot until the returned event is set."""
+        started, release = threading.Event(), threading.Event()
+
+        def func():
+            started.set()
+            release.wait(10)
+            return 'held'
+
+        self.start('hold', func)
+        self.assertTrue(started.wait(10))
+        return release
+
+    def wait_for_depth(self, depth):
+        for _ in range(1000):
+            if self.scheduler.queue_depth('m') == depth:
+                return
+            time.sleep(0.01)
+        self.fail(f'queue depth stayed at {self.scheduler.queue_depth("m")}, not {depth}')
+
+    def test_identical_concurrent_prompts_share_one_call(self):
+        calls = []
+        started, release, joined = threading.Event(), threading.Event(), threading.Event()
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait(10)
+            return 'answer'
+
+        with mock.patch.object(llm_scheduler.LLM_COALESCED, 'inc', side_effect=lambda **labels: joined.set()):
+            self.start('same prompt', func, name='leader')
+            self.assertTrue(started.wait(10))
+            self.start('same prompt', func, name='follower')
+            self.assertTrue(joined.wait(10))
+            release.set()
+            for thread in self.threads:
+                thread.join(10)
+        self.assertEqual(calls, [1])
+        self.assertEqual(self.outcomes, {'leader': 'answer', 'follower': 'answer'})
+
+    def test_interactive_calls_go_ahead_of_batch_calls(self):
+        order = []
+        release = self.hold_slot()
+        self.start('summary', lambda: order.append('batch'), priority=BATCH)
+        self.wait_for_depth(2)
+        self.start('question', lambda: order.append('interactive'), priority=INTERACTIVE)
+        self.wait_for_depth(3)
+        release.set()
+        for thread in self.threads:
+            thread.join(10)
+        self.assertEqual(order, ['interactive', 'batch'])
+
+    @override_settings(DART_LLM_MAX_QUEUE=1)
+    def test_calls_over_the_queue_limit_are_shed_at_once(self):
+        release = self.hold_slot()
+        self.start('queued', lambda: 'queued', priority=BATCH)
+        self.wait_for_depth(2)
+        start = time.perf_counter()
+        with self.assertRaises(SchedulerBusy):
+            self.scheduler.run('m', 'another', lambda: 'another', priority=BATCH)
+        self.assertLess(time.perf_counter() - start, 1)
+
+        # An interactive call displaces the queued batch call instead.
+        self.start('question', lambda: 'answered', priority=INTERACTIVE)
+        for _ in range(1000):
+            if 'queued' in self.outcomes:
+                break
+            time.sleep(0.01)
+        self.assertIsInstance(self.outcomes.get('queued'), SchedulerBusy)
+        release.set()
+        for thread in self.threads:
+            thread.join(10)
+        self.assertEqual(self.outcomes['question'], 'answered')
+
+    @override_settings(DART_LLM_MAX_QUEUE=1)
+    def test_a_shed_call_is_answered_with_the_busy_message(self):
+        release = self.hold_slot()
+        self.start('queued', lambda: 'queued')
+        self.wait_for_depth(2)
+        client = OllamaClient.__new__(OllamaClient)
+        client.client, client.models, client.model_sizes = mock.Mock(), ['m'], {'m': 1}
+        with mock.patch('base.ollama_client.scheduler', self.scheduler):
+            self.assertEqual(client.generate('m', 'question'), OllamaClient.BUSY_MESSAGE)
+        client.client.generate.assert_not_called()
+        release.set()
+
+    def test_a_failed_call_releases_its_slot_and_does_not_poison_later_calls(self):
+        def fail():
+            raise ValueError('model crashed')
+
+        with self.assertRaises(ValueError):
+            self.scheduler.run('m', 'prompt', fail)
+        self.assertEqual(self.scheduler.queue_depth('m'), 0)
+        self.assertEqual(self.scheduler.run('m', 'prompt', lambda: 'recovered'), 'recovered')
+        self.assertTrue(self.scheduler.is_idle())
@@ -0,0 +1,47 @@
+import json
+import os
+import re
+import socket
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import LiveServerTestCase, SimpleTestCase
+
+from base import loadtest
+
+from .helpers import DartTestMixin
+
+
+class PercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(loadtest.percentile(values, 50), 50.0)
+        self.assertEqual(loadtest.percentile(values, 99), 99.0)
+        self.assertEqual(loadtest.percentile([3.0, 1.0], 99), 3.0)
+        self.assertEqual(loadtest.percentile([], 50), 0.0)
+
+
+class SmokeTests(DartTestMixin, LiveServerTestCase):
+    """A short run against the test server and the stub Ollama."""
+
+    databases = {'default', 'replica'}
+
+    def test_a_short_run_has_no_errors_and_reaches_the_stub(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        results = os.path.join(self.directory, 'results.json')
+        out = StringIO()
+        # The test server runs in this process, so it finds the stub through
+        # the environment as a started server would.
+        with mock.patch.dict(os.environ, {'OLLAMA_HOST': f'127.0.0.1:{port}'}):
+            call_command('loadtest', url=self.live_server_url, ollama_port=port, users='2', stage_seconds=3,
+                         think_time=0.1, seed_comments=20, llm_latency=0.01, llm_tokens_per_second=10000,
+                         json=results, stdout=out)
+        with open(results, encoding='utf-8') as handle:
+            stage = json.load(handle)['stages'][0]
+        self.assertGreater(stage['overall']['requests'], 0)
+        self.assertEqual(stage['overall']['errors'], 0, stage['endpoints'])
+        served = int(re.search(r'served (\d+) generations', out.getvalue()).group(1))
+        self.assertGreater(served, 0)
@@ -0,0 +1,76 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from base.model_router import CHAT, SUMMARY, ModelRouter
+
+GB = 10 ** 9
+
+
+def response(ttft: float, tokens: int, seconds: float) -> dict:
+    """An Ollama generate response reporting the given timings."""
+    return {'load_duration': 0, 'prompt_eval_duration': int(ttft * 1e9),
+            'eval_count': tokens, 'eval_duration': int(seconds * 1e9)}
+
+
+@override_settings(DART_MODEL_ROUTER={})
+class ModelRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ModelRouter()
+        self.sizes = {'tiny': 1 * GB, 'small': 4 * GB, 'large': 40 * GB, 'nomic-embed-text': GB // 2}
+
+    def test_predicts_ttft_plus_expected_tokens_over_throughput(self):
+        self.router.record('small', CHAT, response(ttft=0.5, tokens=100, seconds=2.0), wall_seconds=2.5)
+        # 200 expected chat tokens at 50 tok/s.
+        self.assertAlmostEqual(self.router.predict('small', CHAT), 4.5)
+        # Without summary measurements the chat ones are used, for 600 tokens.
+        self.assertAlmostEqual(self.router.predict('small', SUMMARY), 12.5)
+        self.assertIsNone(self.router.predict('large', CHAT))
+
+    def test_excludes_embedding_models(self):
+        self.assertEqual(self.router.candidates(list(self.sizes), self.sizes), ['tiny', 'small', 'large'])
+
+    def test_fastest_tries_each_unmeasured_model_smallest_first(self):
+        models = ['large', 'small', 'tiny']
+        self.assertEqual(self.router.choose(CHAT, models, self.sizes), 'tiny')
+        # While tiny's trial runs the next unmeasured model is tried.
+        self.assertEqual(self.router.choose(CHAT, models, self.sizes), 'small')
+        self.router.record('tiny', CHAT, response(0.1, 100, 1.0), 1.1)
+        self.router.record('small', CHAT, response(0.2, 100, 0.5), 0.7)
+        # One model measured does not stop the others being tried.
+        self.assertEqual(self.router.choose(CHAT, models, self.sizes), 'large')
+
+    def test_fastest_routes_to_the_lowest_prediction_once_all_are_measured(self):
+        self.router.record('tiny', CHAT, response(0.1, 100, 4.0), 4.1)    # 8.1s predicted
+        self.router.record('small', CHAT, response(0.3, 100, 1.0), 1.3)   # 2.3s predicted
+        self.router.record('large', CHAT, response(1.0, 100, 10.0), 11.0)  # 21s predicted
+        for _ in range(3):
+            self.assertEqual(self.router.choose(CHAT, ['tiny', 'small', 'large'], self.sizes), 'small')
+
+    def test_a_running_trial_is_not_repeated_until_its_deadline(self):
+        self.router.record('tiny', CHAT, response(0.1, 100, 1.0), 1.1)
+        models = ['tiny', 'large']
+        with mock.patch('base.model_router.time.monotonic', return_value=100.0):
+            self.assertEqual(self.router.choose(CHAT, models, self.sizes), 'large')
+            self.assertEqual(self.router.choose(CHAT, models, self.sizes), 'tiny')
+        # The trial never reported back: try again after the chat deadline.
+        with mock.patch('base.model_router.time.monotonic', return_value=111.0):
+            self.assertEqual(self.router.choose(CHAT, models, self.sizes), 'large')
+
+    def test_a_lookup_without_a_trial_leaves_the_model_free(self):
+        models = ['large', 'tiny']
+        self.assertEqual(self.router.choose(CHAT, models, self.sizes, record_trial=False), 'tiny')
+        self.assertEqual(self.router.choose(CHAT, models, self.sizes), 'tiny')
+
+    def test_largest_picks_the_biggest_model_within_the_deadline(self):
+        models = ['tiny', 'small', 'large']
+        # Unmeasured models are assumed to meet the deadline.
+        self.assertEqual(self.router.choose(SUMMARY, models, self.sizes), 'large')
+        self.router.record('large', SUMMARY, response(5.0, 100, 20.0), 25.0)  # 125s for 600 tokens
+        self.router.record('small', SUMMARY, response(1.0, 100, 2.0), 3.0)   # 13s
+        self.assertEqual(self.router.choose(SUMMARY, models, self.sizes), 'small')
+
+    def test_largest_falls_back_to_the_fastest_when_none_meets_the_deadline(self):
+        self.router.record('large', SUMMARY, response(5.0, 100, 20.0), 25.0)  # 125s
+        self.router.record('small', SUMMARY, response(5.0, 100, 15.0), 20.0)  # 95s
+        self.assertEqual(self.router.choose(SUMMARY, ['small', 'large'], self.sizes), 'small')
@@ -0,0 +1,76 @@
+from django.test import SimpleTestCase, override_settings
+
+from base import passages
+from base.search import EventIndex
+
+DOCUMENT = ('The radio failed twice during the night. Generators were refuelled late in the morning. '
+            'Food was good and hot.')
+
+
+@override_settings(DART_PASSAGE_MAX_CHARS=50)
+class BestPassageTests(SimpleTestCase):
+    def setUp(self):
+        self.index = EventIndex(1, (1, 0), [
+            (1, DOCUMENT),
+            (2, 'Radio checks were made every hour.'),
+            (3, 'Food arrived cold on the second day.'),
+        ])
+
+    def text(self, span):
+        return DOCUMENT[span[0]:span[1]]
+
+    def test_splits_into_sentences_that_fit_the_limit(self):
+        self.assertEqual([self.text(span) for span in passages.split(DOCUMENT)], [
+            'The radio failed twice during the night.',
+            'Generators were refuelled late in the morning.',
+            'Food was good and hot.',
+        ])
+        # Short sentences are merged, and an overlong one is cut at a space.
+        self.assertEqual(passages.split('One. Two. Three.'), [(0, 16)])
+        text = 'word ' * 20
+        spans = passages.split(text.strip())
+        self.assertEqual(len(spans), 2)
+        self.assertTrue(all(end - start <= 50 and text[start:end].strip() == text[start:end]
+                            for start, end in spans))
+
+    def test_the_index_scores_passages_by_tfidf(self):
+        span, score = passages.best_passage(DOCUMENT, 'generators refuelled', self.index)
+        self.assertEqual(self.text(span), 'Generators were refuelled late in the morning.')
+        self.assertGreater(score, 0)
+
+    def test_without_an_index_or_shared_terms_trigrams_choose_the_passage(self):
+        for index in (None, self.index):
+            with self.subTest(index=index):
+                span, score = passages.best_passage(DOCUMENT, 'genrators refueled', index)
+                self.assertEqual(self.text(span), 'Generators were refuelled late in the morning.')
+                self.assertGreater(score, 0.5)
+
+    def test_a_snippet_marks_where_the_comment_continues(self):
+        spans = passages.split(DOCUMENT)
+        self.assertEqual(passages.snippet(DOCUMENT, spans[0]), 'The radio failed twice during the night.…')
+        self.assertEqual(passages.snippet(DOCUMENT, spans[1]), '…Generators were refuelled late in the morning.…')
+        self.assertEqual(passages.snippet(DOCUMENT, spans[2]), '…Food was good and hot.')
+        self.assertEqual(passages.snippet('Short.', (0, 6)), 'Short.')
+
+
+class HighlightTests(SimpleTestCase):
+    def test_marks_query_words_but_not_stopwords(self):
+        self.assertEqual(passages.highlight('The radio failed at the gate.', 'did the radio break at the gate'),
+                         '<p>The <mark>radio</mark> failed at the <mark>gate</mark>.</p>')
+
+    def test_marks_misspelt_words_by_trigram_similarity(self):
+        html = passages.highlight('Generatrs were refuelled late.', 'generators refueled')
+        self.assertIn('<mark>Generatrs</mark>', html)
+        self.assertIn('<mark>refuelled</mark>', html)
+        self.assertNotIn('<mark>late</mark>', html)
+
+    def test_the_result_is_sanitised(self):
+        html = passages.highlight('<script>alert(1)</script> radio [link](javascript:alert(1)) '
+                                  '<b onclick="steal()">radio</b>', 'radio')
+        self.assertNotIn('<script>', html)
+        self.assertNotIn('javascript:', html)
+        self.assertNotIn('onclick', html)
+        self.assertEqual(html.count('<mark>radio</mark>'), 2)
+
+    def test_without_query_words_nothing_is_marked(self):
+        self.assertEqual(passages.highlight('Radio was *fine*.', 'was it'), '<p>Radio was <em>fine</em>.</p>')
@@ -0,0 +1,93 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+
+from base import precompute
+from base.models import Event, PrecomputedAnswer
+from base.ollama_client import OllamaClient
+
+from .helpers import DartTestCase, add_comment, make_event
+
+QUESTION = "What went well?"
+
+
+def fake_client():
+    client = mock.Mock(models=['llama3'])
+    client.resolve_model.return_value = 'llama3'
+    return client
+
+
+@override_settings(DART_PRECOMPUTE_QUESTIONS=[QUESTION], DART_PRECOMPUTE_MIN_AGE=300)
+class PrecomputeTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('planner')
+        self.event = make_event(self.user)
+        add_comment(self.event, self.user, 'Sandbags arrived on time.')
+
+    def store(self, kind=PrecomputedAnswer.SUMMARY, key='All', model_name='llama3', age=0):
+        row = PrecomputedAnswer.objects.create(
+            event=self.event, kind=kind, key=key, text='Done.', model_name=model_name,
+            comments_stamp=precompute.current_stamps([self.event.id])[self.event.id],
+        )
+        PrecomputedAnswer.objects.filter(pk=row.pk).update(computed_at=timezone.now() - timedelta(seconds=age))
+        return row
+
+    def pending(self, force=False):
+        return precompute.pending_work([self.event.id], force=force)
+
+    def test_missing_items_are_pending_overall_summary_first(self):
+        self.assertEqual(self.pending(), [
+            (self.event.id, PrecomputedAnswer.SUMMARY, 'All'),
+            (self.event.id, PrecomputedAnswer.QUESTION, QUESTION),
+            (self.event.id, PrecomputedAnswer.SUMMARY, 'Positive'),
+            (self.event.id, PrecomputedAnswer.SUMMARY, 'Negative'),
+            (self.event.id, PrecomputedAnswer.SUMMARY, 'Neutral'),
+        ])
+
+    def test_stale_items_wait_for_the_minimum_age(self):
+        self.store()
+        self.assertNotIn((self.event.id, PrecomputedAnswer.SUMMARY, 'All'), self.pending())
+        add_comment(self.event, self.user, 'The pump failed overnight.')
+        # Stale, but generated too recently to be regenerated yet.
+        self.assertNotIn((self.event.id, PrecomputedAnswer.SUMMARY, 'All'), self.pending())
+        self.assertIn((self.event.id, PrecomputedAnswer.SUMMARY, 'All'), self.pending(force=True))
+        PrecomputedAnswer.objects.update(computed_at=timezone.now() - timedelta(seconds=301))
+        self.assertIn((self.event.id, PrecomputedAnswer.SUMMARY, 'All'), self.pending())
+
+    def test_fresh_summary_matches_the_model_and_the_comments(self):
+        row = self.store(model_name='llama3')
+        self.assertEqual(precompute.fresh_summary(self.event), row)
+        self.assertEqual(precompute.fresh_summary(self.event, 'auto'), row)
+        self.assertEqual(precompute.fresh_summary(self.event, 'llama3'), row)
+        self.assertIsNone(precompute.fresh_summary(self.event, 'mistral'))
+        add_comment(self.event, self.user, 'The pump failed overnight.')
+        self.assertIsNone(precompute.fresh_summary(self.event, 'llama3'))
+
+    def test_stores_a_generated_summary(self):
+        with mock.patch.object(Event, '_summarize_texts', return_value='Sandbags were *on time*.'):
+            row = precompute.compute(self.event.id, PrecomputedAnswer.SUMMARY, 'All', fake_client())
+        self.assertEqual((row.text, row.model_name, row.comment_count), ('Sandbags were *on time*.', 'llama3', 1))
+        self.assertIn('<em>on time</em>', row.text_html)
+        self.assertEqual(self.pending()[0], (self.event.id, PrecomputedAnswer.QUESTION, QUESTION))
+
+    def test_fallback_and_busy_text_is_never_stored(self):
+        texts = ['', OllamaClient.BUSY_MESSAGE, OllamaClient.ERROR_MESSAGE,
+                 f'{OllamaClient.NOT_AVAILABLE_MESSAGE}\n\nSandbags arrived on time.']
+        for text in texts:
+            with self.subTest(text=text), mock.patch.object(Event, '_summarize_texts', return_value=text):
+                self.assertIsNone(precompute.compute(self.event.id, PrecomputedAnswer.SUMMARY, 'All', fake_client()))
+        answer = {'answer': OllamaClient.BUSY_MESSAGE, 'responses': [{'id': 1}]}
+        with mock.patch('base.reports.answer_questions', return_value=iter([answer])):
+            self.assertIsNone(precompute.compute(self.event.id, PrecomputedAnswer.QUESTION, QUESTION, fake_client()))
+        self.assertFalse(PrecomputedAnswer.objects.exists())
+
+    def test_nothing_is_generated_while_ollama_is_unreachable(self):
+        client = fake_client()
+        client.models = []
+        with mock.patch.object(Event, '_summarize_texts') as summarize:
+            self.assertIsNone(precompute.compute(self.event.id, PrecomputedAnswer.SUMMARY, 'All', client))
+        summarize.assert_not_called()
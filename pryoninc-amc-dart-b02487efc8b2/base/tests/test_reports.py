@@ -0,0 +1,63 @@
+import json
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from .helpers import DartTestCase, add_comment, make_event
+
+
+class ReportValidationTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('analyst', password='secret')
+        self.event = make_event(self.user)
+        add_comment(self.event, self.user, 'Radio traffic was delayed at the command post.')
+        self.client.force_login(self.user)
+        self.url = reverse('report', args=[self.event.pk])
+
+    def post(self, body):
+        data = body if isinstance(body, (str, bytes)) else json.dumps(body)
+        return self.client.post(self.url, data=data, content_type='application/json')
+
+    def test_rejects_bodies_that_are_not_json(self):
+        response = self.post('questions: radio')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_json_that_is_not_an_object(self):
+        for body in ([], ['What went well?'], 'radio', 3, None):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+    def test_rejects_malformed_fields(self):
+        for body in (
+            {'questions': 'What went well?'},
+            {'questions': []},
+            {'questions': ['  ', 7]},
+            {'questions': ['What went well?'], 'n_results': 'many'},
+            {'questions': ['What went well?'], 'model': ['llama3']},
+            {'questions': ['What went well?'], 'sentiment': {'name': 'All'}},
+        ):
+            with self.subTest(body=body):
+                response = self.post(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_limits_the_number_of_questions(self):
+        with self.settings(DART_REPORT_MAX_QUESTIONS=2):
+            response = self.post({'questions': ['a?', 'b?', 'c?']})
+        self.assertEqual(response.status_code, 400)
+
+    def test_answers_in_question_order_without_generating(self):
+        response = self.post({'questions': ['How was the radio traffic?', 'What about catering?'],
+                              'generate': False})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['position'] for r in results], [0, 1])
+        [hit] = results[0]['responses']
+        self.assertEqual(set(hit), {'comment_id', 'passage', 'sentiment', 'distance'})
+        self.assertIn('Radio traffic', hit['passage'])
+
+    def test_uninvited_users_get_404(self):
+        stranger = User.objects.create_user('stranger', password='secret')
+        self.client.force_login(stranger)
+        self.assertEqual(self.post({'questions': ['What went well?']}).status_code, 404)
@@ -0,0 +1,93 @@
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from base import search
+
+from .helpers import DartTransactionTestCase, add_comment, make_event
+
+
+@override_settings(DART_SEARCH_DEADLINE=0.5)
+class SearchEventsTests(DartTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('analyst')
+        self.ready = make_event(self.user, name='Ready')
+        self.cold = make_event(self.user, name='Cold')
+        add_comment(self.ready, self.user, 'The radio relay failed twice.')
+        add_comment(self.cold, self.user, 'Radio traffic was heavy all day.')
+        self.events = {self.ready.id: 'Ready', self.cold.id: 'Cold'}
+
+    def search(self):
+        return search.search_events(self.user, 'radio', events=self.events)
+
+    def test_an_index_not_ready_in_time_is_skipped_and_searched_once_built(self):
+        search.get_indexes([self.ready.id])
+        release = threading.Event()
+        build = search._build
+
+        def slow_build(*args):
+            release.wait(10)
+            return build(*args)
+
+        with mock.patch.object(search, '_build', side_effect=slow_build):
+            outcome = self.search()
+            self.assertEqual((outcome['skipped'], outcome['failed'], outcome['events_searched']), (['Cold'], [], 1))
+            self.assertLess(outcome['elapsed'], 2)
+            release.set()
+            with search._indexes_lock:
+                future = search._building[self.cold.id][1]
+            future.result(10)
+
+        outcome = self.search()
+        self.assertEqual((outcome['skipped'], outcome['events_searched']), ([], 2))
+        self.assertEqual({result['event_name'] for result in outcome['results']}, {'Ready', 'Cold'})
+
+    def test_concurrent_searches_share_one_rebuild(self):
+        release = threading.Event()
+        calls = []
+        build = search._build
+
+        def slow_build(*args):
+            calls.append(args[0])
+            release.wait(10)
+            return build(*args)
+
+        with mock.patch.object(search, '_build', side_effect=slow_build):
+            self.search()
+            self.search()
+            release.set()
+            search.get_indexes(self.events)
+        self.assertEqual(sorted(calls), sorted(self.events))
+
+    def test_failed_searches_are_reported_apart_from_skipped_ones(self):
+        search.get_indexes(self.events)
+        with search._indexes_lock:
+            broken = search._indexes[self.cold.id]
+        with mock.patch.object(broken, 'search', side_effect=ValueError('corrupt index')):
+            outcome = self.search()
+        self.assertEqual((outcome['failed'], outcome['skipped'], outcome['events_searched']), (['Cold'], [], 1))
+
+    def test_failed_rebuilds_are_reported_as_failed(self):
+        with mock.patch.object(search, '_build', side_effect=OSError('disk full')):
+            outcome = self.search()
+        self.assertEqual((outcome['failed'], outcome['skipped']), (['Cold', 'Ready'], []))
+
+
+class IndexCacheTests(DartTransactionTestCase):
+    def test_indexes_are_evicted_by_estimated_size(self):
+        user = User.objects.create_user('owner')
+        events = [make_event(user, name=f'Exercise {i}') for i in range(3)]
+        for event in events:
+            add_comment(event, user, 'Generators were refuelled late. ' * 20)
+        search.get_indexes([event.id for event in events])
+        sizes = [search._indexes[event.id].nbytes for event in events]
+        self.assertTrue(all(size > 0 for size in sizes))
+
+        search._indexes.clear()
+        with override_settings(DART_CORPUS_CACHE_BYTES=sizes[1] + sizes[2]):
+            for event in events:
+                search.get_indexes([event.id])
+        self.assertEqual(list(search._indexes), [events[1].id, events[2].id])
@@ -0,0 +1,102 @@
+import os
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from base import search, segments
+from base.search import EventIndex
+
+from .helpers import DartTestCase, add_comment, make_event
+
+
+class SegmentTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(
+            DART_SEGMENT_DIR=f'{self.directory}/segments',
+            DART_SEGMENT_MERGE_ROWS=3,
+            DART_SEGMENT_MERGE_INTERVAL=3600,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.user = User.objects.create_user('logger')
+        self.event = make_event(self.user)
+        for text in ('Triage tags ran out early.', 'Decontamination line moved quickly.',
+                     'Triage area was too small.'):
+            add_comment(self.event, self.user, text)
+
+    def load(self):
+        return segments.load_index(self.event.id, search.event_versions([self.event.id])[self.event.id])
+
+    def files(self):
+        return sorted(name for name in os.listdir(segments._event_dir(self.event.id)) if name.endswith('.seg'))
+
+    def assertMatchesMemoryIndex(self, index):
+        rows = list(zip(index.comment_ids, index.documents))
+        expected = EventIndex(self.event.id, index.version, rows)
+        for query in ('triage', 'decontamination line', 'radio'):
+            found = [index.comment_ids[i] for _, i in index.search(query, 10)]
+            self.assertEqual(sorted(found), sorted(expected.comment_ids[i] for _, i in expected.search(query, 10)))
+
+    def test_a_new_event_is_written_to_one_segment(self):
+        index = self.load()
+        self.assertEqual((index.segment.count, index.delta_rows), (3, []))
+        self.assertEqual(len(self.files()), 1)
+        self.assertMatchesMemoryIndex(index)
+
+    def test_new_comments_go_to_the_delta_until_it_is_merged(self):
+        first = self.load()
+        add_comment(self.event, self.user, 'Radio checks every hour helped.')
+        delta = self.load()
+        self.assertEqual(delta.segment.path, first.segment.path)
+        self.assertEqual(len(delta.delta_rows), 1)
+        self.assertEqual(len(delta.comment_ids), 4)
+        self.assertMatchesMemoryIndex(delta)
+
+        add_comment(self.event, self.user, 'Radio batteries were flat.')
+        add_comment(self.event, self.user, 'Triage volunteers needed radio training.')
+        merged = self.load()
+        self.assertNotEqual(merged.segment.path, first.segment.path)
+        self.assertEqual((merged.segment.count, merged.delta_rows), (6, []))
+        self.assertEqual(list(merged.comment_ids), sorted(merged.comment_ids))
+        # The superseded segment is removed.
+        self.assertEqual(self.files(), [os.path.basename(merged.segment.path)])
+        self.assertMatchesMemoryIndex(merged)
+
+    def test_no_merge_while_another_process_holds_the_lock(self):
+        self.load()
+        for i in range(3):
+            add_comment(self.event, self.user, f'Late comment {i}.')
+        self.assertTrue(segments._acquire_merge_lock(self.event.id))
+        index = self.load()
+        self.assertEqual(len(index.delta_rows), 3)
+        os.remove(segments._lock_path(self.event.id))
+        self.assertEqual(self.load().delta_rows, [])
+
+    def test_an_edit_rebuilds_the_segment(self):
+        first = self.load()
+        comment = self.event.comment_set.order_by('id').first()
+        comment.observation = 'Triage tags were restocked.'
+        comment.save()
+        rebuilt = self.load()
+        self.assertGreater(rebuilt.segment.rewrites, first.segment.rewrites)
+        self.assertEqual(rebuilt.delta_rows, [])
+        self.assertIn('restocked', rebuilt.documents[0])
+
+    def test_newer_segments_written_by_another_process_are_kept(self):
+        index = self.load()
+        directory = segments._event_dir(self.event.id)
+        rewrites, version = index.segment.rewrites, index.segment.version
+        newer = f'{rewrites:010d}-{version + 5:010d}.seg'
+        older = f'{rewrites:010d}-{version - 1:010d}.seg'
+        for name in (newer, older, f'{newer}.123.tmp'):
+            open(os.path.join(directory, name), 'wb').close()
+        segments._remove_other_files(directory, index.segment.path)
+        self.assertEqual(sorted(os.listdir(directory)),
+                         sorted([os.path.basename(index.segment.path), newer, f'{newer}.123.tmp']))
+
+    def test_removing_an_event_twice_is_harmless(self):
+        self.load()
+        segments.remove_event(self.event.id)
+        segments.remove_event(self.event.id)
+        self.assertFalse(os.path.exists(segments._event_dir(self.event.id)))
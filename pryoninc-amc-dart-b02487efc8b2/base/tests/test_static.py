@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import tempfile
+from email.utils import formatdate
+
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from base.static import IMMUTABLE, StaticFilesMiddleware
+
+
+class StaticFilesMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='dart-static-')
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.write('base/app.css', b'body { color: black; }' * 40)
+        self.write('base/app.0123456789ab.css', b'body { color: black; }' * 40)
+        self.write('base/app.0123456789ab.css.gz', b'g' * 60)
+        self.write('base/app.0123456789ab.css.br', b'b' * 50)
+        self.write('staticfiles.json', json.dumps({'paths': {'base/app.css': 'base/app.0123456789ab.css'}}).encode())
+        overrides = override_settings(STATIC_ROOT=self.root, STATIC_URL='/static/', DART_STATIC_SERVE=True,
+                                      DART_STATIC_MAX_AGE=60)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.middleware = StaticFilesMiddleware(lambda request: HttpResponse('from the view'))
+        self.factory = RequestFactory()
+        self.hashed = '/static/base/app.0123456789ab.css'
+
+    def write(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(data)
+
+    def get(self, path: str, method: str = 'get', **headers):
+        return self.middleware(getattr(self.factory, method)(path, **headers))
+
+    def test_brotli_is_preferred_over_gzip(self):
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(b''.join(response.streaming_content), b'b' * 50)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_an_encoding_with_q_zero_is_refused(self):
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='br; q=0.0, gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response['Content-Length'], str(22 * 40))
+
+    def test_a_matching_etag_is_not_modified(self):
+        etag = self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+        self.assertEqual(response.status_code, 304)
+        # The gzip variant's tag does not match the brotli one.
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='br', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_modified_since(self):
+        mtime = int(os.stat(os.path.join(self.root, 'base/app.css')).st_mtime)
+        response = self.get('/static/base/app.css', HTTP_IF_MODIFIED_SINCE=formatdate(mtime, usegmt=True))
+        self.assertEqual(response.status_code, 304)
+        response = self.get('/static/base/app.css', HTTP_IF_MODIFIED_SINCE=formatdate(mtime - 1, usegmt=True))
+        self.assertEqual(response.status_code, 200)
+        response = self.get('/static/base/app.css', HTTP_IF_MODIFIED_SINCE='not a date')
+        self.assertEqual(response.status_code, 200)
+
+    def test_head_reports_the_length_of_the_chosen_variant(self):
+        response = self.get(self.hashed, method='head', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response.status_code, response['Content-Length']), (200, '60'))
+        self.assertEqual(response.content, b'')
+
+    def test_hashed_files_are_immutable_and_others_cached_briefly(self):
+        self.assertEqual(self.get(self.hashed)['Cache-Control'], IMMUTABLE)
+        self.assertEqual(self.get('/static/base/app.css')['Cache-Control'], 'public, max-age=60')
+
+    def test_other_paths_reach_the_view(self):
+        self.assertEqual(self.get('/static/base/missing.css').content, b'from the view')
+        self.assertEqual(self.get(self.hashed, method='post').content, b'from the view')
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+
+from base import trigrams
+from base.trigrams import TrigramIndex, threshold_for_sensitivity
+
+from .helpers import DartTestCase, add_comment, make_event
+
+
+class TrigramTests(SimpleTestCase):
+    def test_trigrams_are_padded_like_pg_trgm(self):
+        self.assertEqual(trigrams.trigrams('Cat'), {'  c', ' ca', 'cat', 'at '})
+        self.assertEqual(trigrams.trigrams('a-b'), {'  a', ' a ', '  b', ' b '})
+
+    def test_threshold_is_one_minus_sensitivity_clamped(self):
+        self.assertAlmostEqual(threshold_for_sensitivity(0.3), 0.7)
+        self.assertEqual(threshold_for_sensitivity('1.5'), 0.0)
+        self.assertEqual(threshold_for_sensitivity(-1), 1.0)
+        self.assertAlmostEqual(threshold_for_sensitivity('loose'), 0.2)
+
+    def test_search_scores_the_share_of_query_trigrams(self):
+        index = TrigramIndex(['communications were down', 'the generator failed', 'comms restored'])
+        hits = index.search('comunications', 0.5)
+        self.assertEqual([doc_idx for _, doc_idx in hits], [0])
+        self.assertGreater(hits[0][0], 0.5)
+        self.assertLess(hits[0][0], 1.0)
+
+    def test_a_lower_threshold_admits_looser_matches(self):
+        index = TrigramIndex(['communications were down', 'the generator failed', 'comms restored'])
+        strict = index.search('comunications', 0.8)
+        loose = index.search('comunications', 0.1)
+        self.assertEqual([doc_idx for _, doc_idx in strict], [0])
+        self.assertEqual([doc_idx for _, doc_idx in loose], [0, 2])
+        self.assertEqual(index.search('comunications', 0.0)[-1][1], 2)
+        self.assertEqual(index.search('', 0.0), [])
+
+
+class CandidateTests(DartTestCase):
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('observer')
+        self.event = make_event(user)
+        add_comment(self.event, user, 'Communications were excellent throughout.')
+        add_comment(self.event, user, 'Communications failed at the shelter.', recommendation='Fix the radios.')
+        add_comment(self.event, user, 'The cook ran out of fuel.')
+
+    def test_candidates_follow_the_sensitivity_slider(self):
+        tight = trigrams.candidates(self.event.id, 'comunications', 0.2)
+        self.assertEqual(len(tight), 2)
+        self.assertTrue(all('Communications' in document for document, _ in tight))
+        # Any comment sharing a trigram ("cook" shares " co") is a candidate.
+        self.assertEqual(len(trigrams.candidates(self.event.id, 'comunications', 2)), 3)
+
+    def test_candidates_are_capped_and_filtered_by_sentiment(self):
+        with self.settings(DART_TRIGRAM_MAX_CANDIDATES=1):
+            self.assertEqual(len(trigrams.candidates(self.event.id, 'comunications', 2)), 1)
+        positive = trigrams.candidates(self.event.id, 'comunications', 2, sentiment='Positive')
+        self.assertTrue(positive)
+        self.assertEqual({sentiment for _, sentiment in positive}, {'Positive'})
@@ -0,0 +1,153 @@
+"""
+Character-trigram candidate retrieval for fuzzy chat search.
+
+Fuzzy search tolerates the misspellings common in hastily typed field notes
+because `SequenceMatcher` compares characters rather than words, but scoring
+every comment of an event that way is a full scan.  A trigram index gives the
+same tolerance at index-lookup cost: "comunications" shares most of its
+three-character substrings with "communications", so comments containing a
+misspelt (or correctly spelt) query word are found by looking up the query's
+trigrams instead of reading every comment.
+
+Trigrams are extracted as PostgreSQL's pg_trgm does (lower-cased words,
+padded with two spaces in front and one behind), and a comment's score is
+the fraction of the query's trigrams it contains, which approximates
+pg_trgm's `word_similarity`.  Comments scoring at least the threshold become
+candidates, best first, and only those are scored with `SequenceMatcher`.
+
+The threshold comes from the chat's sensitivity slider (0.1 to 2), read as
+the largest acceptable distance just like the distances shown with each
+result: the minimum similarity is ``1 - sensitivity``, so a higher
+sensitivity admits looser matches and values of 1 or more admit any comment
+sharing a trigram with the query.
+
+The index is built in process, once per event index version (see
+`EventIndex.trigram_index`).  On PostgreSQL with the pg_trgm extension
+installed the candidates are selected in the database instead, unless
+`DART_TRIGRAM_BACKEND` says otherwise.
+"""
+
+import logging
+import re
+from array import array
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'[^\W_]+')
+_pg_trgm_available: bool | None = None
+
+
+def trigrams(text: str) -> set[str]:
+    """The set of pg_trgm style trigrams of `text`."""
+    grams = set()
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f'  {word} '
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def threshold_for_sensitivity(sensitivity) -> float:
+    """Minimum trigram similarity for a chat `sensitivity` setting."""
+    try:
+        sensitivity = float(sensitivity)
+    except (TypeError, ValueError):
+        sensitivity = 0.8
+    return min(1.0, max(0.0, 1.0 - sensitivity))
+
+
+def max_candidates() -> int:
+    return getattr(settings, 'DART_TRIGRAM_MAX_CANDIDATES', 200)
+
+
+class TrigramIndex:
+    """Inverted index from trigram to the documents containing it."""
+
+    def __init__(self, documents: list[str]):
+        postings: dict[str, array] = {}
+        for doc_idx, document in enumerate(documents):
+            for gram in trigrams(document):
+                doc_ids = postings.get(gram)
+                if doc_ids is None:
+                    doc_ids = postings[gram] = array('I')
+                doc_ids.append(doc_idx)
+        self.postings = postings
+
+    def search(self, query: str, threshold: float) -> list[tuple[float, int]]:
+        """``(similarity, doc_idx)`` pairs scoring at least `threshold`, best first."""
+        grams = trigrams(query)
+        if not grams:
+            return []
+        shared: Counter = Counter()
+        for gram in grams:
+            doc_ids = self.postings.get(gram)
+            if doc_ids is not None:
+                shared.update(doc_ids)
+        total = len(grams)
+        hits = [(count / total, doc_idx) for doc_idx, count in shared.items() if count / total >= threshold]
+        hits.sort(key=lambda hit: (-hit[0], hit[1]))
+        return hits
+
+
+def _use_database() -> bool:
+    global _pg_trgm_available
+    backend = getattr(settings, 'DART_TRIGRAM_BACKEND', 'auto')
+    if backend == 'memory' or connection.vendor != 'postgresql':
+        return False
+    if _pg_trgm_available is None:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                _pg_trgm_available = cursor.fetchone() is not None
+        except Exception as e:
+            logger.error(f"Could not check for the pg_trgm extension: {e}")
+            _pg_trgm_available = False
+        if not _pg_trgm_available:
+            logger.info("pg_trgm is not installed; using the in-process trigram index.")
+    return _pg_trgm_available
+
+
+def _database_candidates(event_id: int, query: str, threshold: float, limit: int) -> list[str]:
+    from django.contrib.postgres.search import TrigramWordSimilarity
+    from django.db.models import Value
+    from django.db.models.functions import Coalesce, Concat
+    from .models import Comment
+    document = Concat(
+        'observation', Value(' '), Coalesce('discussion', Value('')), Value(' '), 'recommendation',
+    )
+    return list(
+        Comment.objects.filter(event_id=event_id)
+        .annotate(document=document)
+        .annotate(similarity=TrigramWordSimilarity(query, 'document'))
+        .filter(similarity__gte=threshold)
+        .order_by('-similarity', 'id')
+        .values_list('document', flat=True)[:limit]
+    )
+
+
+def candidates(event_id: int, query: str, sensitivity, sentiment: str = 'All') -> list[tuple[str, str]]:
+    """
+    Up to `DART_TRIGRAM_MAX_CANDIDATES` ``(document, sentiment)`` pairs of
+    the event's comments that are trigram-similar to `query` at the given
+    chat sensitivity, best first, optionally restricted to one sentiment.
+    """
+    from . import search
+    threshold = threshold_for_sensitivity(sensitivity)
+    limit = max_candidates()
+    if _use_database() and not search.archived_event_ids([event_id]):
+        # Over-fetch so the sentiment filter still leaves enough candidates.
+        fetch = limit if sentiment == 'All' else limit * 4
+        pairs = [(doc, search.estimate_sentiment(doc))
+                 for doc in _database_candidates(event_id, query, threshold, fetch)]
+    else:
+        index = search.get_indexes([event_id])[event_id]
+        pairs = ((index.documents[doc_idx], index.sentiments[doc_idx])
+                 for _, doc_idx in index.trigram_index().search(query, threshold))
+    if sentiment and sentiment != 'All':
+        pairs = (pair for pair in pairs if pair[1] == sentiment)
+    return list(islice(pairs, limit))
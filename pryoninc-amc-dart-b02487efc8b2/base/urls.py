@@ -10,4 +10,7 @@ urlpatterns = [
    path('event/', views.StartEvent.as_view(), name='start-event'),
    path('event/<int:pk>/', views.Event.as_view(), name='event'),
    path('event/<int:pk>/chat/', views.Chat.as_view(), name='chat'),
+   path('event/<int:pk>/report/', views.Report.as_view(), name='report'),
+   path('search/', views.Search.as_view(), name='search'),
+   path('metrics', views.Metrics.as_view(), name='metrics'),
 ]
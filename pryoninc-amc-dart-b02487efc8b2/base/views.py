@@ -1,15 +1,22 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.conf import settings
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
-from . import models, forms
+from django.contrib import messages
+from . import models, forms, access, instrumentation, search, reports, chat_sessions, comment_journal, passages, precompute
 from datetime import datetime
+import json
 from .ollama_client import OllamaClient
+from .model_router import AUTO, CHAT, SUMMARY, router
+from .rendering import render_markdown
 
 class Home(LoginRequiredMixin, View):
     def get(self, request):
-        user_events = models.Event.objects.filter(invitees=request.user).order_by('-updated_at')
+        user_events = models.Event.objects.filter(pk__in=access.invited_events(request)).order_by('-updated_at')
         context = {'user_events': user_events}
-        return render(request, 'base/home.html', context=context)
+        with instrumentation.span('render'):
+            return render(request, 'base/home.html', context=context)
 
 class StartEvent(LoginRequiredMixin, View):
     def get(self, request):
@@ -46,52 +53,121 @@ class Event(LoginRequiredMixin, View):
         event = models.Event.objects.get(pk=pk)
         comment_form = forms.CommentForm(instance=event)
         ollama_client = OllamaClient()
+        # Summaries prepared in idle time are shown straight away.
+        precompute.ensure_started()
         context = {
             'event': event, 
             'comment_form': comment_form,
-            'ollama_models': ollama_client.models
+            'ollama_models': ollama_client.models,
+            'model_options': router.options(ollama_client.models, SUMMARY),
+            'precomputed': precompute.for_event(event),
         }
-        return render(request, 'base/event.html', context=context)
+        with instrumentation.span('render'):
+            return render(request, 'base/event.html', context=context)
 
     def post(self, request, pk):
         event = models.Event.objects.get(pk=pk)
         if 'summarize-event' in request.POST:
             model_name = request.POST.get('ollama-model')
-            summary = event._summarize_texts(
-                collection_name=event.vectordb_collection_key,
-                model_name=model_name
-            )
-            event.summary = summary
-            event.save()
+            precomputed = precompute.fresh_summary(event, model_name)
+            if precomputed is not None:
+                summary = precomputed.text
+            else:
+                summary = event._summarize_texts(
+                    collection_name=event.vectordb_collection_key,
+                    model_name=model_name
+                )
+            if summary == OllamaClient.BUSY_MESSAGE:
+                # Keep the previous summary rather than replacing it with the
+                # busy notice.
+                messages.warning(request, summary)
+            else:
+                event.summary = summary
+                event.save()
+                # Warm the rendering cache so the event page does not pay for it.
+                render_markdown(summary)
 
         elif 'submit-comments' in request.POST:
-            new_comment = models.Comment.objects.create(
-                user=request.user,
-                event=event,
-                observation=request.POST['observation'],
-                discussion=request.POST['discussion'],
-                recommendation=request.POST['recommendation']
-            )
-            new_comment.save()
-            new_comment._load_comment_to_collection(
-                collection_name=event.vectordb_collection_key,
-            )
+            _rehydrate(request, event)
+            if comment_journal.enabled():
+                status = comment_journal.submit(
+                    request.user, event,
+                    request.POST['observation'],
+                    request.POST['discussion'],
+                    request.POST['recommendation'],
+                )
+                if status == comment_journal.PENDING:
+                    messages.info(request, "Your comment has been saved and will appear shortly.")
+                elif status == comment_journal.FAILED:
+                    messages.error(request, "Your comment could not be saved.")
+            else:
+                new_comment = models.Comment.objects.create(
+                    user=request.user,
+                    event=event,
+                    observation=request.POST['observation'],
+                    discussion=request.POST['discussion'],
+                    recommendation=request.POST['recommendation']
+                )
+                new_comment._load_comment_to_collection(
+                    collection_name=event.vectordb_collection_key,
+                )
         
         elif 'upload-comments' in request.POST:
-            event._upload_comments_to_collection(
+            _rehydrate(request, event)
+            report = event._upload_comments_to_collection(
                 request=request,
                 collection_name=event.vectordb_collection_key
             )
+            if report is None:
+                messages.error(request, "The comments could not be imported.")
+            else:
+                messages.success(
+                    request,
+                    f"Imported {report.rows} comments from {report.files} files "
+                    f"in {report.seconds:.1f}s ({report.rows_per_second:.0f} rows/s)."
+                )
+                if report.duplicate_files or report.duplicate_rows:
+                    messages.info(
+                        request,
+                        f"Skipped {report.duplicate_files} files and {report.duplicate_rows} rows "
+                        f"that had already been imported."
+                    )
+                for error in report.errors:
+                    messages.warning(request, f"Skipped {error}")
 
         return redirect('event', event.id)
     
+def _rehydrate(request, event) -> None:
+    """Restore an archived event before it is edited."""
+    if event.is_archived:
+        event._rehydrate()
+        messages.info(request, "This event was restored from the archive.")
+
+
+def _archived_chat(request, event):
+    """
+    An unsaved chat for an archived event: the archived chat, with any
+    queries and settings from this session on top.  Archived events are
+    read only, so their chat history is kept in the session instead.
+    """
+    from .archive import open_archive
+    archived = open_archive(event.id).chats()
+    query_dict = request.session.get(f'archived-chat-{event.id}')
+    if query_dict is None:
+        query_dict = archived[0]['query_dict'] if archived else {}
+    return models.Chat(event=event, user=request.user, query_dict=query_dict)
+
+
 class Chat(LoginRequiredMixin, View):
     def get(self, request, pk):
         event = models.Event.objects.get(pk=pk)
-        user_events = models.Event.objects.filter(invitees=request.user).order_by('-updated_at')
-        # Ensure a chat exists for this event.  Provide a default user when
-        # creating to satisfy the non‑nullable `user` field on Chat.
-        chat_object, _ = models.Chat.objects.get_or_create(event=event, defaults={'user': request.user})
+        user_events = models.Event.objects.filter(pk__in=access.invited_events(request)).order_by('-updated_at')
+        if event.is_archived:
+            chat_object = _archived_chat(request, event)
+        else:
+            # Ensure a chat exists for this event.  Provide a default user when
+            # creating to satisfy the non‑nullable `user` field on Chat.
+            chat_object, _ = models.Chat.objects.get_or_create(event=event, defaults={'user': request.user})
         queries = chat_object.query_dict.get('queries', [])
         
         ollama_client = OllamaClient()
@@ -105,18 +181,19 @@ class Chat(LoginRequiredMixin, View):
             chat_object.query_dict['sensitivity'] = 0.8
         if 'summarize' not in chat_object.query_dict:
             chat_object.query_dict['summarize'] = False
-        # Select a default model for chat.  Prefer gemma3n if it exists, otherwise
-        # use the first available model.  Only set if none has been chosen.
+        if 'search_mode' not in chat_object.query_dict:
+            chat_object.query_dict['search_mode'] = 'fuzzy'
+        # Unless a model has been chosen, let the router pick the fastest
+        # adequate model for each question.
         if 'selected_model' not in chat_object.query_dict and ollama_client.models:
-            preferred = None
-            for m in ollama_client.models:
-                # normalise names to handle tags like gemma3n:latest
-                if m.lower().startswith('gemma3n'):
-                    preferred = m
-                    break
-            chat_object.query_dict['selected_model'] = preferred or ollama_client.models[0]
+            chat_object.query_dict['selected_model'] = AUTO
         
-        chat_object.save()
+        if not event.is_archived:
+            chat_object.save()
+        # Load the chat model in the background so the first question does
+        # not pay for a cold start.
+        chat_sessions.preload_async(ollama_client, chat_object.query_dict.get('selected_model'), chat_object)
+        precompute.ensure_started()
 
         context = {
             'event': event, 
@@ -124,57 +201,180 @@ class Chat(LoginRequiredMixin, View):
             'queries': queries,
             'chat_object': chat_object,
             'ollama_models': ollama_client.models,
+            'model_options': router.options(ollama_client.models, CHAT),
             'selected_model': chat_object.query_dict.get('selected_model'),
             'sentiment_filter': chat_object.query_dict.get('sentiment_filter'),
             'n_results_filter': chat_object.query_dict.get('n_results_filter'),
             'sensitivity': chat_object.query_dict.get('sensitivity'),
             'summarize': chat_object.query_dict.get('summarize'),
+            'search_mode': chat_object.query_dict.get('search_mode'),
+            'prepared_answers': precompute.for_event(event)['answers'],
         }
-        return render(request, 'base/chat.html', context=context)
+        with instrumentation.span('render'):
+            return render(request, 'base/chat.html', context=context)
         
     def post(self, request, pk):
         event = models.Event.objects.get(pk=pk)
-        chat_object = models.Chat.objects.filter(event=event).first()
+        archived = event.is_archived
+        if archived:
+            chat_object = _archived_chat(request, event)
+        else:
+            chat_object = models.Chat.objects.filter(event=event).first()
 
         if not chat_object:
             return redirect('chat', event.id)
 
+        def save():
+            if archived:
+                request.session[f'archived-chat-{event.id}'] = chat_object.query_dict
+            else:
+                chat_object.save()
+
         if "query" in request.POST and request.POST['query']:
             query = request.POST['query']
             model_name = chat_object.query_dict.get('selected_model')
-            chat_object._query_collection(query, model_name=model_name)
+            chat_object._query_collection(query, model_name=model_name, commit=not archived)
             chat_object.query_dict['last_question'] = query
-            chat_object.save()
+            save()
         
         elif "last-query" in request.POST:
             if chat_object.query_dict.get('last_question'):
                 query = chat_object.query_dict['last_question']
                 model_name = chat_object.query_dict.get('selected_model')
-                chat_object._query_collection(query, model_name=model_name)
-                chat_object.save()
+                chat_object._query_collection(query, model_name=model_name, commit=not archived)
+                save()
 
         elif "select-model" in request.POST:
             chat_object.query_dict['selected_model'] = request.POST.get('ollama-model')
-            chat_object.save()
+            save()
 
         elif "sentiment_filter" in request.POST:
             chat_object.query_dict['sentiment_filter'] = request.POST['sentiment_filter']
-            chat_object.save()
+            save()
 
         elif "update-n-results" in request.POST:
             chat_object.query_dict['n_results_filter'] = int(request.POST['selected-n'])
-            chat_object.save()
+            save()
         
         elif "update-sensitivity" in request.POST:
             chat_object.query_dict['sensitivity'] = float(request.POST['selected-sensitivity'])
-            chat_object.save()
+            save()
 
         elif "clear-chat" in request.POST:
             chat_object.query_dict['queries'] = []
-            chat_object.save()
+            chat_sessions.reset(chat_object)
+            save()
+
+        elif "search-mode" in request.POST:
+            mode = request.POST['search-mode']
+            if mode in ('fuzzy', 'hybrid'):
+                chat_object.query_dict['search_mode'] = mode
+                save()
 
         elif "summarize" in request.POST:
             chat_object.query_dict['summarize'] = not chat_object.query_dict.get('summarize', False)
-            chat_object.save()
+            save()
 
         return redirect('chat', event.id)
+
+
+class Report(LoginRequiredMixin, View):
+    """
+    Answer a list of questions about an event in one request, for building
+    after-action reports.  Expects a JSON body such as::
+
+        {"questions": ["What went well?", ...], "model": "llama3",
+         "n_results": 4, "sentiment": "All", "generate": true, "stream": false}
+
+    Only `questions` is required.  With `stream` the results are sent as
+    newline-delimited JSON in completion order; otherwise one JSON document
+    is returned with the results in question order.  The chat history is not
+    modified.
+    """
+    def post(self, request, pk):
+        if not access.is_invited(request, pk):
+            raise Http404
+        event = get_object_or_404(models.Event, pk=pk)
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'error': 'The request body must be JSON.'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'error': 'The request body must be a JSON object.'}, status=400)
+        questions = payload.get('questions', [])
+        if not isinstance(questions, list):
+            return JsonResponse({'error': 'questions must be a list of strings.'}, status=400)
+        questions = [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+        max_questions = getattr(settings, 'DART_REPORT_MAX_QUESTIONS', 100)
+        if not questions:
+            return JsonResponse({'error': 'Provide a non-empty list of questions.'}, status=400)
+        if len(questions) > max_questions:
+            return JsonResponse({'error': f'At most {max_questions} questions may be asked at once.'}, status=400)
+        try:
+            n_results = max(1, min(int(payload.get('n_results', 4)), 20))
+        except (TypeError, ValueError):
+            return JsonResponse({'error': 'n_results must be an integer.'}, status=400)
+
+        model_name = payload.get('model')
+        sentiment = payload.get('sentiment')
+        if not isinstance(model_name, (str, type(None))) or not isinstance(sentiment, (str, type(None))):
+            return JsonResponse({'error': 'model and sentiment must be strings.'}, status=400)
+        if not model_name:
+            chat_object = models.Chat.objects.filter(event=event).first()
+            model_name = chat_object.query_dict.get('selected_model') if chat_object else None
+        results = reports.answer_questions(
+            event, questions,
+            model_name=model_name,
+            n_results=n_results,
+            sentiment=sentiment,
+            generate=bool(payload.get('generate', True)),
+        )
+        if payload.get('stream'):
+            return StreamingHttpResponse(
+                (json.dumps(result) + '\n' for result in results),
+                content_type='application/x-ndjson'
+            )
+        ordered = sorted(results, key=lambda result: result['position'])
+        return JsonResponse({'event': event.id, 'results': ordered})
+
+
+class Search(LoginRequiredMixin, View):
+    """
+    Search the comments of every event the user is invited to.  Results are
+    returned as JSON when `format=json` is requested, otherwise rendered as
+    a page.
+    """
+    def get(self, request):
+        query = request.GET.get('q', '').strip()
+        try:
+            k = max(1, min(int(request.GET.get('k', 10)), 100))
+        except ValueError:
+            k = 10
+        sentiment = request.GET.get('sentiment') or None
+        outcome = search.search_events(
+            request.user, query, k=k, sentiment=sentiment, events=access.invited_events(request)
+        )
+        if request.GET.get('format') == 'json':
+            return JsonResponse({'query': query, **outcome})
+        for result in outcome['results']:
+            result['passage_html'] = passages.highlight(result['passage'], query)
+        context = {'query': query, 'k': k, **outcome}
+        with instrumentation.span('render'):
+            return render(request, 'base/search.html', context=context)
+
+
+class Metrics(View):
+    """
+    Expose the in-process performance metrics in the Prometheus text format.
+    Staff users may always view the page; scrapers are admitted by address
+    via `DART_METRICS_ALLOWED_IPS`.
+    """
+    def get(self, request):
+        allowed_ips = getattr(settings, 'DART_METRICS_ALLOWED_IPS', [])
+        is_staff = request.user.is_authenticated and request.user.is_staff
+        if not is_staff and request.META.get('REMOTE_ADDR') not in allowed_ips:
+            return HttpResponseForbidden()
+        return HttpResponse(
+            instrumentation.REGISTRY.render_prometheus(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
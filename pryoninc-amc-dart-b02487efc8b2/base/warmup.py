@@ -0,0 +1,101 @@
+"""
+Process warm-up for DART workers.
+
+Worker start-up should be cheap: heavy dependencies such as `ollama`,
+`markdown` and `bleach` are imported lazily, so a management command that
+never renders a page or talks to a model does not pay for them.  A serving
+process, on the other hand, wants everything loaded before the first
+request arrives.
+
+`warm_up` loads those dependencies, builds the in-memory search indexes of
+the currently active events, optionally asks Ollama to load the default
+chat model and maps the local model weights listed in
+`DART_LLM_PRELOAD_WEIGHTS` (see `base.model_registry`).  It is used by
+`manage.py warmup` and, when
+`DART_WARMUP_ON_LOAD=1` is set (as `gunicorn.conf.py` does), by
+`dart/wsgi.py` in the gunicorn master process.  With `preload_app = True`
+the master then forks its workers, which share the warmed pages
+copy-on-write.  `gc.freeze()` moves the warmed objects out of the garbage
+collector's generations so collections in the workers do not touch, and
+thereby copy, those pages.  Threads do not survive the fork, so the thread
+pools used while warming up (`base.search`, `base.jobs`) are started again
+in each worker on first use.
+"""
+
+import gc
+import importlib
+import logging
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+HEAVY_MODULES = ('ollama', 'markdown', 'bleach')
+
+
+def active_event_ids() -> list[int]:
+    """Events that have not ended more than `DART_WARMUP_EVENT_DAYS` ago."""
+    from .models import Event
+    days = getattr(settings, 'DART_WARMUP_EVENT_DAYS', 30)
+    cutoff = date.today() - timedelta(days=days)
+    return list(Event.objects.filter(end_date__gte=cutoff).values_list('id', flat=True))
+
+
+def _import_heavy_modules() -> None:
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.info(f"Optional dependency {name} is not installed; skipping.")
+
+
+def _build_indexes() -> int:
+    from . import search
+    event_ids = active_event_ids()
+    if event_ids:
+        search.get_indexes(event_ids)
+    return len(event_ids)
+
+
+def _preload_llm() -> str | None:
+    from .model_router import AUTO, CHAT
+    from .ollama_client import OllamaClient
+    client = OllamaClient()
+    if not client.client or not client.models:
+        return None
+    preferred = client.resolve_model(AUTO, CHAT)
+    return preferred if client.preload(preferred) else None
+
+
+def warm_up(indexes: bool = True, llm: bool = True, freeze: bool = False) -> dict:
+    """
+    Load dependencies, indexes and (optionally) the default LLM.  Returns the
+    time spent in each step, in seconds, along with what was loaded.
+    """
+    report = {}
+    start = time.perf_counter()
+    _import_heavy_modules()
+    report['imports'] = time.perf_counter() - start
+
+    if indexes:
+        start = time.perf_counter()
+        report['events_indexed'] = _build_indexes()
+        report['indexes'] = time.perf_counter() - start
+
+    if llm:
+        start = time.perf_counter()
+        report['llm_model'] = _preload_llm()
+        from .model_registry import preload_weights
+        report['weights_mapped'] = preload_weights()
+        report['llm'] = time.perf_counter() - start
+
+    # Never hand an open database connection to forked workers.
+    connections.close_all()
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    logger.info(f"Warm-up finished: {report}")
+    return report
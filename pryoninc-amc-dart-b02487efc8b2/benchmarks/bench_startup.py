@@ -0,0 +1,158 @@
+"""
+Benchmark worker start-up time and per-worker memory.
+
+Run from the Django project directory:
+
+    python benchmarks/bench_startup.py --workers 4
+
+Two things are measured:
+
+1. Start-up cost: the wall time of `django.setup()` plus importing the
+   application modules in a fresh interpreter, and which heavy optional
+   modules that pulled in.
+2. Per-worker memory under a pre-fork model.  In "preload" mode the parent
+   warms up (imports, search indexes) and then forks the workers, as
+   gunicorn does with `preload_app = True`.  In "lazy" mode every worker
+   warms up after the fork.  Each worker runs a few searches and reports
+   its RSS, PSS and private dirty memory from /proc (Linux only).
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('ollama', 'httpx', 'markdown', 'bleach')
+QUERIES = ('communication problems', 'schedule', 'training was good', 'equipment failure')
+
+IMPORT_SNIPPET = """
+import json, os, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+import base.models, base.views, base.urls
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'heavy': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_imports(settings_module: str, repeat: int) -> dict:
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    runs = []
+    heavy = []
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET], cwd=PROJECT_DIR, env=env)
+        result = json.loads(output)
+        runs.append(result['elapsed'])
+        heavy = result['heavy']
+    return {'median_s': statistics.median(runs), 'min_s': min(runs), 'heavy_modules_loaded': heavy}
+
+
+def read_memory() -> dict:
+    """Return RSS, PSS and private dirty memory of this process in KiB."""
+    fields = {'Rss': 0, 'Pss': 0, 'Private_Dirty': 0}
+    try:
+        with open('/proc/self/smaps_rollup') as handle:
+            for line in handle:
+                key, _, rest = line.partition(':')
+                if key in fields:
+                    fields[key] = int(rest.split()[0])
+    except OSError:
+        import resource
+        fields['Rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return fields
+
+
+def simulate_requests() -> None:
+    from base import search
+    from base.warmup import active_event_ids
+    indexes = search.get_indexes(active_event_ids())
+    for query in QUERIES:
+        for index in indexes.values():
+            index.search(query, 10)
+
+
+def run_workers(mode: str, workers: int) -> dict:
+    from django.db import connections
+    from base.warmup import warm_up
+
+    if mode == 'preload':
+        warm_up(llm=False, freeze=True)
+    connections.close_all()
+
+    children = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            start = time.perf_counter()
+            if mode == 'lazy':
+                warm_up(llm=False)
+            ready = time.perf_counter() - start
+            simulate_requests()
+            connections.close_all()
+            result = dict(read_memory(), ready_s=ready)
+            os.write(write_fd, json.dumps(result).encode())
+            os.close(write_fd)
+            # Stay alive until the parent has read every worker so shared
+            # pages are still shared when PSS is computed.
+            time.sleep(0.5)
+            os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd))
+
+    results = []
+    for pid, read_fd in children:
+        with os.fdopen(read_fd) as handle:
+            results.append(json.loads(handle.read()))
+        os.waitpid(pid, 0)
+
+    return {
+        'workers': workers,
+        'ready_s_mean': statistics.mean(r['ready_s'] for r in results),
+        'rss_kib_mean': statistics.mean(r['Rss'] for r in results),
+        'pss_kib_mean': statistics.mean(r['Pss'] for r in results),
+        'private_dirty_kib_mean': statistics.mean(r['Private_Dirty'] for r in results),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', default=os.environ.get('DJANGO_SETTINGS_MODULE', 'dart.settings'))
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5, help="Fresh interpreters used to time imports.")
+    args = parser.parse_args()
+
+    sys.path.insert(0, PROJECT_DIR)
+    os.environ['DJANGO_SETTINGS_MODULE'] = args.settings
+
+    report = {'startup': measure_imports(args.settings, args.repeat)}
+
+    if hasattr(os, 'fork'):
+        import django
+        django.setup()
+        for mode in ('lazy', 'preload'):
+            # Run each mode in its own child so the lazy run is not helped by
+            # anything the preload run left behind.
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                os.write(write_fd, json.dumps(run_workers(mode, args.workers)).encode())
+                os.close(write_fd)
+                os._exit(0)
+            os.close(write_fd)
+            with os.fdopen(read_fd) as handle:
+                report[mode] = json.loads(handle.read())
+            os.waitpid(pid, 0)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
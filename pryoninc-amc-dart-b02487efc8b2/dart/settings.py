@@ -6,10 +6,10 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = get_random_secret_key()
 #
 # In development we enable the Django debug mode.  This allows the server to
-# run without explicitly specifying `ALLOWED_HOSTS`.  For production you
-# should set `DEBUG = False` and supply a list of valid hostnames via
+# run without explicitly specifying `ALLOWED_HOSTS`.  For production set
+# DART_DEBUG=0 in the environment and supply a list of valid hostnames via
 # `ALLOWED_HOSTS`.
-DEBUG = True
+DEBUG = os.environ.get('DART_DEBUG', '1').lower() not in ('0', 'false', 'no', 'off')
 # Restrict the allowed hosts to localhost by default.  Update this list if
 # you deploy to another host.
 ALLOWED_HOSTS = ['localhost', '127.0.0.1']
@@ -27,6 +27,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'base.static.StaticFilesMiddleware',
+    'base.db.PrimaryPinMiddleware',
+    'base.middleware.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -59,9 +62,61 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds to wait for SQLite's write lock before "database is locked".
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# Applied to every new SQLite connection (see base/db.py): write-ahead
+# logging lets readers and the writer proceed concurrently.
+DART_SQLITE_PRAGMAS = {'journal_mode': 'wal', 'synchronous': 'normal'}
+
+# Read/write routing (see base/db.py).  Writes go to `default`; reads go to
+# the aliases in `DART_DB_REPLICAS` except during POST requests, inside
+# transactions and for `DART_DB_STICKY_SECONDS` after the user's last write.
+# The SQLite replica is a read-only connection to the same WAL file; point it
+# at a PostgreSQL streaming replica when `default` is PostgreSQL, or set
+# `DART_DB_REPLICAS = []` to read from `default`.
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': f"{(BASE_DIR / 'db.sqlite3').as_uri()}?mode=ro",
+    'OPTIONS': {'timeout': 20},
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['base.db.ReplicaRouter']
+DART_DB_REPLICAS = ['replica']
+DART_DB_STICKY_SECONDS = 5
+
+# Caches.  `default` is per process (chat sessions, throttles).  `shared`
+# holds copies of the sessions, the authenticated users and their event
+# memberships (see base/access.py), so requests need no session or user
+# queries.  Everything in it can be rebuilt from the database: sessions are
+# stored there too (the cached_db engine), so culling the cache only costs a
+# query.  It is a file-based cache that every worker on the host shares; set
+# DART_REDIS_URL (e.g. redis://localhost:6379/0, needs `pip install redis`)
+# to share it between hosts instead.  Cached users are refreshed after
+# `DART_USER_CACHE_SECONDS` and whenever they change.
+DART_REDIS_URL = os.environ.get('DART_REDIS_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': DART_REDIS_URL,
+    } if DART_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        # Every write lists the directory to decide whether to cull, so keep
+        # it small.
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'shared'
+AUTHENTICATION_BACKENDS = ['base.access.CachedModelBackend']
+DART_USER_CACHE_SECONDS = 300
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -85,8 +140,207 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static'),)
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# `collectstatic` writes content-hashed copies of the assets with gzip (and,
+# with `pip install brotli`, brotli) variants next to them.  Unless
+# `DART_STATIC_SERVE` is false, base/static.py serves them from `STATIC_ROOT`
+# when DEBUG is off: hashed names are cached by browsers for a year, other
+# files for `DART_STATIC_MAX_AGE` seconds.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'base.static.CompressedManifestStorage'},
+}
+DART_STATIC_SERVE = not DEBUG
+DART_STATIC_MAX_AGE = 60
 
 LOGIN_REDIRECT_URL = "home"
 LOGOUT_REDIRECT_URL = "login"
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Performance instrumentation.  Request metrics are exposed in the Prometheus
+# text format at `/metrics`; access is limited to staff users and to the
+# addresses listed in `DART_METRICS_ALLOWED_IPS` (for an unauthenticated
+# scraper).  The sampling profiler can be switched on per request with
+# `?profile=1` by staff users when `DART_PROFILING_ENABLED` is true.
+DART_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+DART_PROFILING_ENABLED = DEBUG
+DART_PROFILING_INTERVAL = 0.005
+DART_PROFILE_DIR = BASE_DIR / 'profiles'
+
+# Rendered, sanitised markdown is cached per process in an LRU keyed by the
+# content hash of the source text.  This bounds the number of entries kept.
+DART_MARKDOWN_CACHE_SIZE = 2048
+
+# Cross-event search fans a query out over per-event indexes on a thread
+# pool.  Events whose index is not rebuilt, or that have not answered, within
+# the deadline (in seconds, from the start of the search) are skipped and
+# reported rather than delaying the response; their rebuilds carry on in the
+# background.  Each process keeps indexes up to an estimated
+# `DART_CORPUS_CACHE_BYTES` (see below) in total.
+DART_SEARCH_WORKERS = 8
+DART_SEARCH_DEADLINE = 2.0
+# Seconds other callers (the chat, reports) wait for an event's index to be
+# rebuilt before using its previous index (or failing, if it has none).
+DART_INDEX_BUILD_TIMEOUT = 120
+
+# `manage.py warmup` and the gunicorn master (see gunicorn.conf.py) build
+# search indexes for events that ended at most this many days ago.
+DART_WARMUP_EVENT_DAYS = 30
+
+# LLM scheduling.  At most `DART_LLM_CONCURRENCY` generations run per model
+# in each process ('default' applies to models without their own entry).
+# Further calls queue by priority (chat before summaries); once
+# `DART_LLM_MAX_QUEUE` callers are waiting, or a caller has waited
+# `DART_LLM_MAX_WAIT` seconds, the call is answered with a "busy" message.
+DART_LLM_CONCURRENCY = {'default': 1}
+DART_LLM_MAX_QUEUE = 8
+DART_LLM_MAX_WAIT = 15.0
+# Each process records whether it is generating in this directory, so the
+# idle time precomputation waits for covers every worker.  None keeps it
+# per process.
+DART_LLM_ACTIVITY_DIR = BASE_DIR / 'llm-activity'
+
+# Model routing (see base/model_router.py).  With "Auto" selected, chat
+# answers go to the model with the lowest measured latency and summaries to
+# the largest model predicted to finish within `deadline` seconds.  Latency
+# statistics cover the last `DART_ROUTER_WINDOW` calls per model and task.
+# Models matching an `exclude` pattern are never routed to.
+DART_MODEL_ROUTER = {
+    'chat': {'strategy': 'fastest', 'deadline': 10.0, 'expected_tokens': 200},
+    'summary': {'strategy': 'largest', 'deadline': 60.0, 'expected_tokens': 600},
+    'exclude': ['embed'],
+    'min_size_gb': 0.0,
+}
+DART_ROUTER_WINDOW = 50
+
+# Multi-turn chat (see base/chat_sessions.py).  Follow-up questions reuse the
+# model's context from the previous answer for `DART_CHAT_SESSION_TIMEOUT`
+# seconds, until it exceeds `DART_CHAT_MAX_CONTEXT_TOKENS`.  Chat calls ask
+# Ollama to keep the model loaded for `DART_LLM_KEEP_ALIVE`, and opening the
+# chat page preloads the model at most every `DART_LLM_PRELOAD_INTERVAL`
+# seconds.
+DART_LLM_KEEP_ALIVE = '30m'
+DART_CHAT_SESSION_TIMEOUT = 1800
+DART_CHAT_MAX_CONTEXT_TOKENS = 8192
+DART_LLM_PRELOAD_INTERVAL = 60
+
+# Local model weights (see base/model_registry.py and `manage.py
+# llm_models`).  Models are catalogued in `DART_LLM_DIR`/manifest.json and
+# loaded from memory-mapped safetensors files; the models named in
+# `DART_LLM_PRELOAD_WEIGHTS` are mapped during warm-up so forked workers
+# share their pages.
+DART_LLM_DIR = BASE_DIR / 'llm'
+DART_LLM_PRELOAD_WEIGHTS = []
+
+# Hybrid chat retrieval (see base/retrieval.py).  Lexical and vector
+# retrievers each return `candidates` results within their budget, the
+# rankings are fused with reciprocal rank fusion (`rrf_k`) and the fused top
+# `rerank_depth` are reranked with `rerank` ('sequence', 'embedding' or
+# 'none').  Budgets are in milliseconds.  Set `DART_EMBEDDING_MODEL` to an
+# Ollama embedding model (e.g. 'nomic-embed-text') to use it for vector
+# retrieval; otherwise a model-free hashing embedder is used.
+DART_EMBEDDING_MODEL = None
+DART_HYBRID_SEARCH = {
+    'candidates': 100,
+    'rrf_k': 60,
+    'rerank': 'none',
+    'rerank_depth': 50,
+    'budgets_ms': {'lexical': 250, 'vector': 750, 'rerank': 500},
+}
+
+# Per-event corpus cache (see base/corpus.py).  The tokenised comments of
+# recently searched events are kept in compact arrays in each process, up to
+# `DART_CORPUS_CACHE_BYTES` in total, and refreshed by fetching only the
+# comments added since they were loaded.
+DART_CORPUS_CACHE_BYTES = 256 * 1024 * 1024
+
+# Shared index segments (see base/segments.py).  Each event's search index
+# and embeddings are written to immutable files in `DART_SEGMENT_DIR` and
+# mapped read-only by every worker process.  New comments are kept in a
+# per-process delta until it holds `DART_SEGMENT_MERGE_ROWS` comments or the
+# segment is `DART_SEGMENT_MERGE_INTERVAL` seconds old, then merged into a
+# new segment.  Set `DART_SEGMENT_DIR = None` to keep indexes in memory.
+DART_SEGMENT_DIR = BASE_DIR / 'segments'
+DART_SEGMENT_MERGE_ROWS = 1000
+DART_SEGMENT_MERGE_INTERVAL = 300
+
+# Fuzzy chat search (see base/trigrams.py).  Comments are pre-selected with
+# a character-trigram index, at a similarity of at least 1 - sensitivity,
+# and at most `DART_TRIGRAM_MAX_CANDIDATES` of them are scored.
+# `DART_TRIGRAM_BACKEND` is 'auto' (use pg_trgm on PostgreSQL when it is
+# installed) or 'memory' (always use the in-process index).
+DART_TRIGRAM_BACKEND = 'auto'
+DART_TRIGRAM_MAX_CANDIDATES = 200
+
+# Search results and LLM context use the best passage of each comment
+# (see base/passages.py): sentences merged up to this many characters.
+DART_PASSAGE_MAX_CHARS = 320
+
+# Batch question answering (`event/<pk>/report/`).  Generations run on a
+# pool of `DART_REPORT_WORKERS` threads (by default the model's
+# `DART_LLM_CONCURRENCY`); raise both, together with Ollama's
+# OLLAMA_NUM_PARALLEL, to answer more questions at once.
+DART_REPORT_MAX_QUESTIONS = 100
+DART_REPORT_WORKERS = None
+DART_REPORT_BUSY_RETRIES = 3
+
+# Idle-time precomputation (see base/precompute.py).  Summaries per
+# sentiment and answers to `DART_PRECOMPUTE_QUESTIONS` are generated for
+# active events once no generation has run for
+# `DART_PRECOMPUTE_IDLE_SECONDS`, checking every `DART_PRECOMPUTE_INTERVAL`
+# seconds.  Stale items are regenerated at most every
+# `DART_PRECOMPUTE_MIN_AGE` seconds.  Only the worker holding
+# `DART_PRECOMPUTE_LOCK` precomputes.
+DART_PRECOMPUTE_ENABLED = True
+DART_PRECOMPUTE_QUESTIONS = [
+    "What were the main problems?",
+    "What went well?",
+    "What are the key recommendations?",
+]
+DART_PRECOMPUTE_IDLE_SECONDS = 5.0
+DART_PRECOMPUTE_INTERVAL = 30
+DART_PRECOMPUTE_MIN_AGE = 300
+DART_PRECOMPUTE_LOCK = BASE_DIR / 'precompute.lock'
+
+# Comment uploads (see base/ingest.py).  Uploaded files are parsed on a pool
+# of `DART_INGEST_WORKERS` processes (by default one per CPU) and written in
+# transactions of `DART_INGEST_BATCH_SIZE` rows.  An upload claimed by an
+# import that has written nothing for `DART_INGEST_CLAIM_TIMEOUT` seconds is
+# taken over by the next import of the same file.
+DART_INGEST_WORKERS = None
+DART_INGEST_BATCH_SIZE = 2000
+DART_INGEST_CLAIM_TIMEOUT = 600
+
+# Live comment submission (see base/comment_journal.py).  Submissions are
+# appended to a per-process journal in `DART_COMMENT_JOURNAL_DIR` and
+# committed in groups of up to `DART_COMMENT_GROUP_SIZE`, collected for
+# `DART_COMMENT_GROUP_WAIT_MS`.  A submitting request waits up to
+# `DART_COMMENT_COMMIT_WAIT` seconds for its group.  Set the directory to
+# None to write each comment synchronously.
+DART_COMMENT_JOURNAL_DIR = BASE_DIR / 'journal'
+DART_COMMENT_JOURNAL_FSYNC = True
+DART_COMMENT_GROUP_SIZE = 100
+DART_COMMENT_GROUP_WAIT_MS = 20
+DART_COMMENT_COMMIT_WAIT = 2.0
+
+# Cold-event archival (see base/archive.py and `manage.py archive_events`).
+# Events that ended more than `DART_ARCHIVE_GRACE_DAYS` days ago have their
+# comments and chats moved into compressed files in `DART_ARCHIVE_DIR`
+# (zstd at `DART_ARCHIVE_LEVEL` when the zstandard package is installed,
+# lzma otherwise).  `DART_ARCHIVE_CACHE_SIZE` decoded archives are kept in
+# memory per process.
+DART_ARCHIVE_DIR = BASE_DIR / 'archive'
+DART_ARCHIVE_GRACE_DAYS = 30
+DART_ARCHIVE_LEVEL = 10
+DART_ARCHIVE_CACHE_SIZE = 8
+
+# Admin for large tables (see base/admin.py and base/jobs.py).  Filtered
+# change list counts are cached for `DART_ADMIN_COUNT_CACHE_SECONDS`;
+# comment search within an event returns at most `DART_ADMIN_SEARCH_LIMIT`
+# hits; bulk actions run on `DART_ADMIN_JOB_WORKERS` background threads of
+# the worker that received them, and the last `DART_ADMIN_JOB_HISTORY` jobs
+# of all workers are listed.
+DART_ADMIN_COUNT_CACHE_SECONDS = 300
+DART_ADMIN_SEARCH_LIMIT = 500
+DART_ADMIN_JOB_WORKERS = 1
+DART_ADMIN_JOB_HISTORY = 100
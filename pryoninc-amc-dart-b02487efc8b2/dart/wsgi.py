@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dart.settings')
 
 application = get_wsgi_application()
+
+# When the application is preloaded in a pre-fork server master (see
+# gunicorn.conf.py) load indexes and heavy dependencies before forking.
+if os.environ.get('DART_WARMUP_ON_LOAD') == '1':
+    from base.warmup import warm_up
+    warm_up(freeze=True)
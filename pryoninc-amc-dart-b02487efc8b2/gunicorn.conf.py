@@ -0,0 +1,25 @@
+"""
+gunicorn configuration for DART.
+
+Run with `gunicorn` from this directory.  The application is loaded once in
+the master process (`preload_app`) and warmed up there, see
+`base/warmup.py`, so every forked worker shares the imported modules and
+search indexes copy-on-write instead of loading its own copy.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'dart.wsgi:application'
+bind = os.environ.get('DART_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('DART_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('DART_THREADS', 4))
+preload_app = True
+
+# Read by dart/wsgi.py while the master imports the application.
+os.environ.setdefault('DART_WARMUP_ON_LOAD', '1')
+
+
+def post_fork(server, worker):
+    # Connections must never be shared between processes.
+    from django.db import connections
+    connections.close_all()
@@ -1,14 +1,24 @@
 """
-NOTE Downloading a new LLM requires the internet. You won't be able to run these functions without being connected.
+Download a model from the Hugging Face hub into llm/models.
+
+NOTE Downloading a new LLM requires the internet.  Nothing is downloaded when
+this module is imported; run it as a script, or preferably use
+`python manage.py llm_models --download <repo_id>`, which fetches only the
+safetensors weights and records the model in llm/manifest.json.
 """
-from huggingface_hub import snapshot_download
+import argparse
+
 
-def download_llm(repo_id: str, local_dir = None | str) -> None:
+def download_llm(repo_id: str, local_dir: str | None = None) -> None:
+    from huggingface_hub import snapshot_download
     snapshot_download(
         repo_id=repo_id,
         local_dir=local_dir,
     )
-repo_id = "MBZUAI/LaMini-Flan-T5-783M"
-local_dir = f"./llm/models/{repo_id.split('/')[-1]}"
 
-download_llm(repo_id, local_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('repo_id', nargs='?', default="MBZUAI/LaMini-Flan-T5-783M")
+    args = parser.parse_args()
+    download_llm(args.repo_id, f"./llm/models/{args.repo_id.split('/')[-1]}")